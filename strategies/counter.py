@@ -0,0 +1,31 @@
+'''
+COM戦略の例: まだ出ていないプレイヤーのカードに一番勝てる手を出す
+
+    python yakyuken.py --com strategies/counter.py
+
+戦略モジュールは choose(view) で出す手札の位置を返す。
+view はカードを 'G', 'C', 'P' の名前で表した辞書で、
+    hand            COMの手札
+    com_pile        COMの山札の残り枚数 {'G': n, 'C': n, 'P': n}
+    player_unseen   プレイヤーのまだ出ていないカードの枚数
+    player_hand_num プレイヤーの手札の枚数
+    lives           {'player': n, 'com': n}
+    history         これまでの (プレイヤー, COM, 結果) 結果はプレイヤーから見た値
+    rules           {'card_num': n, 'hand_max': n, 'life_max': n}
+別プロセスで呼ばれ、制限時間を過ぎた・例外を出した場合はランダムな手になる。
+'''
+
+# 手ごとに勝てる相手
+BEATS = {'G': 'C', 'C': 'P', 'P': 'G'}
+
+
+def choose(view: dict) -> int:
+    unseen = view['player_unseen']
+
+    def score(card: str) -> int:
+        # 勝てる枚数 - 負ける枚数
+        lose = [k for k, v in BEATS.items() if v == card][0]
+        return unseen[BEATS[card]] - unseen[lose]
+
+    hand = view['hand']
+    return max(range(len(hand)), key=lambda i: score(hand[i]))
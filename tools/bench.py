@@ -0,0 +1,354 @@
+'''
+主要処理のマイクロベンチマーク
+
+pyxel を何もしないスタブに差し替えてから yakyuken を読み込み、
+画面なしで Deck / App / 描画まわりの処理時間を計測する。
+(描画は pyxel 側の処理を含まない Python 側のコストになる)
+
+基準値は tools/bench_baseline.json に保存し、基準より
+--threshold の割合以上遅くなった処理があれば失敗とする。
+マシンの速さやその時の負荷の違いを打ち消すため、各処理の直前に
+基準ループを交互に計測し、その比(相対コスト)で比較する。
+それでも共有マシンでは揺れるので、遅くなったと判定された処理は
+--retries 回まで計測し直して一番良い値を採用する。
+(基準値の作成時も同じ回数計測して一番良い値を使う)
+
+    python tools/bench.py              # 基準値と比較
+    python tools/bench.py --update     # 基準値を更新
+'''
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import types
+from array import array
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+BASELINE_PATH = os.path.join(ROOT, 'tools', 'bench_baseline.json')
+# 1回の計測にかける時間(秒)
+MEASURE_TIME = 0.05
+
+
+class StubImage:
+    '''
+    pyxel.Image のスタブ(描画メソッドは何もしない)
+    '''
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+
+    def __getattr__(self, name):
+        return Noop
+
+
+class StubFont:
+    '''
+    pyxel.Font のスタブ
+    '''
+    def __init__(self, path: str):
+        self.path = path
+
+    def text_width(self, txt: str) -> int:
+        return len(txt) * 5
+
+
+def Noop(*args, **kwargs):
+    return None
+
+
+def StubPyxel() -> types.ModuleType:
+    '''
+    yakyuken が使う範囲の pyxel スタブを作成
+    '''
+    mod = types.ModuleType('pyxel')
+    colors = ('BLACK', 'NAVY', 'PURPLE', 'GREEN', 'BROWN', 'DARK_BLUE',
+              'LIGHT_BLUE', 'WHITE', 'RED', 'ORANGE', 'YELLOW', 'LIME',
+              'CYAN', 'GRAY', 'PINK', 'PEACH')
+    for i, name in enumerate(colors):
+        setattr(mod, f'COLOR_{name}', i)
+    mod.KEY_D = 1
+    mod.KEY_H = 2
+    mod.MOUSE_BUTTON_LEFT = 3
+    mod.width = 256
+    mod.height = 256
+    mod.frame_count = 0
+    mod.mouse_x = 0
+    mod.mouse_y = 0
+    mod.Image = StubImage
+    mod.Font = StubFont
+    mod.images = [StubImage(256, 256) for _ in range(3)]
+    mod.btn = lambda key: False
+    mod.btnp = lambda key, hold=0, repeat=0: False
+    mod.user_data_dir = lambda vendor, app: ROOT
+    # それ以外の関数は何もしない
+    mod.__getattr__ = lambda name: Noop
+    return mod
+
+
+sys.modules['pyxel'] = StubPyxel()
+import yakyuken  # noqa: E402
+from yakyuken import CTRL_PLAYER, CTRL_COM, GU, CH, MsgState  # noqa: E402
+
+
+def MakeApp() -> yakyuken.App:
+    '''
+    pyxel.init などを通さずに対戦中の App を作る
+    '''
+    app = yakyuken.App.__new__(yakyuken.App)
+    yakyuken.ObjectBase.__init__(app, 0, 0, 0, 0)
+    app.DefineVariables()
+    app.player.deck.selected_card = app.player.deck.CreateBigCard(0, GU)
+    app.com.deck.selected_card = app.com.deck.CreateBigCard(0, CH)
+    return app
+
+
+def BenchShuffle():
+    deck = yakyuken.Deck(0, 0, CTRL_PLAYER)
+    n = yakyuken.RULES.card_num
+    return lambda: deck.Shuffle(n, n, n), 1
+
+
+def BenchHandDrow():
+    deck = yakyuken.Deck(0, 0, CTRL_PLAYER)
+    n = yakyuken.RULES.card_num
+
+    def op():
+        # 先頭の手札を出して補充(山札が尽きたら作り直す)
+        deck.hands[0].is_selected = True
+        if len(deck.cards) <= 0:
+            deck.cards = deck.Shuffle(n, n, n)
+        deck.HandDrow()
+    return op, 1
+
+
+def BenchDeckCount():
+    deck = yakyuken.Deck(0, 0, CTRL_PLAYER)
+    return deck.DeckCount, 1
+
+
+def BenchIsAllInit():
+    deck = yakyuken.Deck(0, 0, CTRL_COM)
+    deck.HandUnlock()
+    return deck.IsAllInit, 1
+
+
+def BenchBattle():
+    return MakeApp().Battle, 1
+
+
+def BenchIsEnd():
+    return MakeApp().IsEnd, 1
+
+
+def BenchDrawText():
+    obj = yakyuken.ObjectBase(0, 0, 0, 0)
+    return lambda: obj.DrawText(10, 10, 'Choose your card',
+                                yakyuken.pyxel.COLOR_GRAY), 1
+
+
+def BenchCardDraw():
+    if not yakyuken.CARD_SHEET.is_built:
+        yakyuken.CARD_SHEET.Build()
+    card = yakyuken.Card(0, 0, 0, GU, True)
+    return card.draw, 1
+
+
+def BenchMessageBox():
+    box = yakyuken.MessageBox()
+    msg = 'Choose your card'
+
+    def op():
+        # メッセージを最後まで表示する(1文字ごとに update 1回)
+        box.SetMessage(msg)
+        while box.state == MsgState.DISPLAYING:
+            box.update()
+    return op, len(msg) + 1
+
+
+def FillParticles(num: int) -> yakyuken.ParticlePool:
+    '''
+    止まったままのパーティクルを num 個出したプールを作る
+    '''
+    pool = yakyuken.ParticlePool(num)
+    for i in range(num):
+        pool.Add(i % 256, i % 200, 0, 0, 0, 30000, 7, 1 + i % 2)
+    return pool
+
+
+def BenchParticleUpdate():
+    pool = FillParticles(1024)
+
+    def op():
+        # 寿命が尽きる前に戻す
+        pool.update()
+        if pool.life[0] < 100:
+            pool.life[:] = array('h', [30000]) * pool.num
+    return op, pool.num
+
+
+def BenchParticleDraw():
+    return FillParticles(1024).draw, 1024
+
+
+BENCHES = (
+    ('Deck.Shuffle', BenchShuffle),
+    ('Deck.HandDrow', BenchHandDrow),
+    ('Deck.DeckCount', BenchDeckCount),
+    ('Deck.IsAllInit', BenchIsAllInit),
+    ('App.Battle', BenchBattle),
+    ('App.IsEnd', BenchIsEnd),
+    ('ObjectBase.DrawText', BenchDrawText),
+    ('Card.draw', BenchCardDraw),
+    ('MessageBox.update', BenchMessageBox),
+    ('ParticlePool.update', BenchParticleUpdate),
+    ('ParticlePool.draw', BenchParticleDraw),
+)
+
+
+class Timer:
+    '''
+    1回あたりの処理時間(ns)を計測するクラス
+    '''
+    def __init__(self, op, calls: int):
+        self.op = op
+        self.calls = calls
+        self.loops = 1
+        self.best = None
+
+        # MEASURE_TIME 程度かかるループ回数を決める
+        while self.Run() < MEASURE_TIME:
+            self.loops *= 2
+        self.best = None
+
+    def Run(self) -> float:
+        '''
+        1回計測して最小値を更新、かかった時間(秒)を返す
+        '''
+        op = self.op
+        start = time.perf_counter()
+        for _ in range(self.loops):
+            op()
+        elapsed = time.perf_counter() - start
+        ns = elapsed / (self.loops * self.calls) * 1e9
+        if self.best is None or ns < self.best:
+            self.best = ns
+        return elapsed
+
+
+def Measure(bench: tuple, calib: tuple, repeat: int) -> tuple:
+    '''
+    処理と基準ループを交互に repeat 回計測し、
+    (処理時間(ns), 基準ループとの比) を返す
+    (timeit と同じく計測中は GC を止める)
+    '''
+    gc.collect()
+    gc.disable()
+    try:
+        timer = Timer(*bench)
+        ref = Timer(*calib)
+        for _ in range(repeat):
+            ref.Run()
+            timer.Run()
+    finally:
+        gc.enable()
+    return timer.best, timer.best / ref.best
+
+
+def Calibration() -> tuple:
+    '''
+    マシンの速さを補正するための基準ループ
+    '''
+    data = list(range(64))
+
+    def op():
+        total = 0
+        for v in data:
+            if v & 1:
+                total += v
+        return total
+    return op, 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--update', action='store_true',
+                        help='計測結果で基準値を更新する')
+    parser.add_argument('--threshold', type=float, default=0.3,
+                        help='失敗とする基準値からの遅くなった割合')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='計測の繰り返し回数(最小値を採用)')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='遅くなったと判定された時に計測し直す回数')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help='基準値ファイル')
+    parser.add_argument('--filter', default='',
+                        help='名前にこの文字列を含むものだけ計測する')
+    args = parser.parse_args()
+
+    yakyuken.SNAPSHOTS.enabled = False
+    yakyuken.RNG.Seed(0)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'rt', encoding='utf-8') as fin:
+            baseline = json.loads(fin.read())
+
+    calib = Calibration()
+    results = {}    # 名前 -> 基準ループとの比
+    times = {}      # 名前 -> 処理時間(ns)
+    for name, make in BENCHES:
+        if args.filter not in name:
+            continue
+        bench = make()
+        for attempt in range(args.retries + 1):
+            ns, rel = Measure(bench, calib, args.repeat)
+            if name not in results or rel < results[name]:
+                times[name], results[name] = ns, rel
+            if args.update:
+                continue
+            # 基準値より遅くなっていなければ計測し直さない
+            if baseline is None or name not in baseline['results'] \
+                    or results[name] <= baseline['results'][name] \
+                    * (1 + args.threshold):
+                break
+
+    ok = True
+    print(f'{"routine":<22}{"ns/call":>10}{"relative":>10}'
+          f'{"baseline":>10}{"change":>9}')
+    for name, rel in results.items():
+        line = f'{name:<22}{times[name]:>10.1f}{rel:>10.3f}'
+        if baseline is not None and name in baseline['results']:
+            base = baseline['results'][name]
+            change = rel / base - 1
+            line += f'{base:>10.3f}{change:>+9.1%}'
+            if args.threshold < change:
+                line += '  NG'
+                ok = False
+        print(line)
+
+    if args.update:
+        if baseline is not None and args.filter:
+            # 一部だけ計測した場合は他の基準値を残す
+            merged = dict(baseline['results'])
+            merged.update(results)
+            results = merged
+        with open(args.baseline, 'wt', encoding='utf-8') as fout:
+            fout.write(json.dumps({'results': results}, indent=2))
+            fout.write('\n')
+        print(f'baseline updated: {args.baseline}')
+        return 0
+
+    if baseline is None:
+        print('no baseline (run with --update to create one)')
+        return 0
+    print('OK' if ok else 'NG: some routines regressed')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
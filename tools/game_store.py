@@ -0,0 +1,408 @@
+'''
+シミュレーション結果の列指向ストアと集計クエリ
+
+対戦結果を列ごとの生バイナリファイル(リトルエンディアンの NumPy 配列)
+として追記し、読む時は np.memmap でそのまま参照する。
+試合ごとの表 games と、ターンごとの表 turns の2つを持ち、
+games.turn_start / games.turns で turns の範囲を指す。
+
+    DIR/meta.json           ルール・列の型・確定した行数
+    DIR/games.<列名>.bin    試合ごとの列
+    DIR/turns.<列名>.bin    ターンごとの列
+
+追記は列ファイルへ書き足した後に meta.json を置き換えて確定する。
+途中で止まった場合、確定した行数より後ろは読まれず、次の追記時に切り詰める。
+
+試合は MatchSim をシード(RngStreams)から再現できる形で行い、
+シードも列として残す。(お互いに手札から一様ランダムに出す)
+
+    python tools/game_store.py simulate runs/base --games 1000000
+    python tools/game_store.py stats runs/base
+'''
+import argparse
+import json
+import os
+import sys
+import time
+from array import array
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import yakyuken  # noqa: E402
+
+STORE_VERSION = 1
+META_FILE = 'meta.json'
+
+# カード種類の番号 (0: G, 1: C, 2: P)
+CARD_TYPES = (yakyuken.GU, yakyuken.CH, yakyuken.PA)
+TYPE_INDEX = {t: i for i, t in enumerate(CARD_TYPES)}
+TYPE_NAMES = 'GCP'
+
+# 決着の理由
+END_COM_LIFE = 0        # COMのライフが0(プレイヤー勝ち)
+END_PLAYER_LIFE = 1     # プレイヤーのライフが0(COM勝ち)
+END_PILE = 2            # 山札が尽きた(決着なし)
+END_NAMES = ('COM life 0', 'player life 0', 'pile empty')
+
+# 列の定義 (列名, 型, 1行あたりの形)
+GAME_COLUMNS = (
+    ('seed', '<u8', ()),            # 試合の乱数シード(RngStreams)
+    ('winner', 'i1', ()),           # 1: プレイヤー, -1: COM, 0: 決着なし
+    ('end', 'i1', ()),              # 決着の理由 (END_*)
+    ('turns', '<i2', ()),           # ターン数
+    ('turn_start', '<i8', ()),      # turns 表での開始行
+    ('lives', 'i1', (2,)),          # 最終ライフ (プレイヤー, COM)
+    ('opening', 'i1', (2, 3)),      # 最初の手札の枚数 [側][G, C, P]
+)
+TURN_COLUMNS = (
+    ('cards', 'i1', (2,)),          # 出したカード (プレイヤー, COM)
+    ('result', 'i1', ()),           # App.Battle の結果
+    ('lives', 'i1', (2,)),          # 勝負後のライフ (プレイヤー, COM)
+)
+TABLES = {'games': GAME_COLUMNS, 'turns': TURN_COLUMNS}
+
+
+class GameStore:
+    '''
+    列指向ストアクラス
+
+    Append で列ごとの配列をまとめて追記し、Column で memmap を返す。
+    行数は meta.json に確定したものだけを使う。
+    '''
+    def __init__(self, path: str, rules: yakyuken.Rules = None):
+        self.path = path
+        self.meta = None
+        self.maps = {}      # (表, 列) -> memmap
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'rt', encoding='utf-8') as fin:
+                self.meta = json.loads(fin.read())
+            if self.meta.get('version') != STORE_VERSION:
+                raise ValueError(f'unsupported store version: {meta_path}')
+            if rules is not None and self.meta['rules'] != RulesDict(rules):
+                raise ValueError('rules differ from the existing store')
+        elif rules is not None:
+            os.makedirs(path, exist_ok=True)
+            self.meta = {
+                'version': STORE_VERSION,
+                'rules': RulesDict(rules),
+                'tables': {
+                    name: {'rows': 0,
+                           'columns': {col: {'dtype': dtype,
+                                             'shape': list(shape)}
+                                       for col, dtype, shape in cols}}
+                    for name, cols in TABLES.items()},
+            }
+            self.WriteMeta()
+        else:
+            raise FileNotFoundError(f'no store: {path}')
+
+    def Rules(self) -> yakyuken.Rules:
+        '''
+        ストアのルール
+        '''
+        r = self.meta['rules']
+        return yakyuken.Rules(r['card_num'], r['hand_max'], r['life_max'])
+
+    def Rows(self, table: str) -> int:
+        '''
+        確定した行数
+        '''
+        return self.meta['tables'][table]['rows']
+
+    def FilePath(self, table: str, col: str) -> str:
+        return os.path.join(self.path, f'{table}.{col}.bin')
+
+    def Column(self, table: str, col: str) -> np.ndarray:
+        '''
+        列を memmap で返す(確定した行数分)
+        '''
+        rows = self.Rows(table)
+        key = (table, col)
+        mm = self.maps.get(key)
+        if mm is not None and len(mm) == rows:
+            return mm
+        info = self.meta['tables'][table]['columns'][col]
+        shape = (rows,) + tuple(info['shape'])
+        if rows == 0:
+            mm = np.zeros(shape, dtype=info['dtype'])
+        else:
+            mm = np.memmap(self.FilePath(table, col), dtype=info['dtype'],
+                           mode='r', shape=shape)
+        self.maps[key] = mm
+        return mm
+
+    def Append(self, data: dict):
+        '''
+        {表: {列: 配列}} をまとめて追記して確定する
+        (games.turn_start は turns の確定済み行数からの相対値で渡す)
+        '''
+        self.Recover()
+        tables = self.meta['tables']
+        added = {}
+        for table, cols in data.items():
+            info = tables[table]['columns']
+            if set(cols) != set(info):
+                raise ValueError(f'{table}: columns must be {sorted(info)}')
+            rows = None
+            for col, values in cols.items():
+                dtype = np.dtype(info[col]['dtype'])
+                shape = tuple(info[col]['shape'])
+                arr = np.ascontiguousarray(values, dtype=dtype)
+                arr = arr.reshape((-1,) + shape)
+                if rows is not None and len(arr) != rows:
+                    raise ValueError(f'{table}.{col}: row count mismatch')
+                rows = len(arr)
+                if table == 'games' and col == 'turn_start':
+                    arr = arr + tables['turns']['rows']
+                with open(self.FilePath(table, col), 'ab') as fout:
+                    fout.write(arr.tobytes())
+                    fout.flush()
+                    os.fsync(fout.fileno())
+            added[table] = rows or 0
+
+        # 全ての列を書いてから行数を確定する
+        for table, rows in added.items():
+            tables[table]['rows'] += rows
+        self.WriteMeta()
+
+    def Recover(self):
+        '''
+        確定していない書きかけの行を切り詰める
+        '''
+        for table, info in self.meta['tables'].items():
+            for col, spec in info['columns'].items():
+                path = self.FilePath(table, col)
+                if not os.path.exists(path):
+                    continue
+                size = info['rows'] * np.dtype(spec['dtype']).itemsize \
+                    * int(np.prod(spec['shape'], dtype=np.int64))
+                if size < os.path.getsize(path):
+                    with open(path, 'r+b') as fout:
+                        fout.truncate(size)
+
+    def WriteMeta(self):
+        '''
+        meta.json を置き換える(書き込み途中で壊れないよう一時ファイル経由)
+        '''
+        path = os.path.join(self.path, META_FILE)
+        tmp = path + '.tmp'
+        with open(tmp, 'wt', encoding='utf-8') as fout:
+            fout.write(json.dumps(self.meta, indent=1))
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(tmp, path)
+
+    # 集計クエリ
+    def Games(self, col: str) -> np.ndarray:
+        return self.Column('games', col)
+
+    def Turns(self, col: str) -> np.ndarray:
+        return self.Column('turns', col)
+
+    def WinRate(self, mask: np.ndarray = None) -> dict:
+        '''
+        結果ごとの割合 {1: プレイヤー, -1: COM, 0: 決着なし}
+        '''
+        winner = self.Games('winner')
+        if mask is not None:
+            winner = winner[mask]
+        counts = np.bincount(winner + 1, minlength=3)
+        total = max(1, len(winner))
+        return {w: counts[w + 1] / total for w in (1, -1, 0)}
+
+    def GroupBy(self, keys: np.ndarray, mask: np.ndarray = None) -> list:
+        '''
+        キー(1行ごとの値または配列)ごとの [(キー, 試合数, プレイヤー勝率)]
+        '''
+        winner = self.Games('winner')
+        keys = np.asarray(keys).reshape(len(winner), -1)
+        if mask is not None:
+            winner = winner[mask]
+            keys = keys[mask]
+        uniq, inv = np.unique(keys, axis=0, return_inverse=True)
+        inv = inv.reshape(-1)
+        games = np.bincount(inv, minlength=len(uniq))
+        wins = np.bincount(inv, weights=winner == 1, minlength=len(uniq))
+        return [(tuple(int(v) for v in key), int(n), w / n)
+                for key, n, w in zip(uniq, games, wins)]
+
+    def WinRateByOpening(self, side: int = 0) -> list:
+        '''
+        最初の手札 (G, C, P の枚数) ごとのプレイヤー勝率
+        '''
+        return self.GroupBy(self.Games('opening')[:, side])
+
+    def WinRateByFirstCard(self) -> list:
+        '''
+        プレイヤーが1ターン目に出した種類ごとのプレイヤー勝率
+        '''
+        first = self.Turns('cards')[self.Games('turn_start'), 0]
+        return self.GroupBy(first)
+
+    def TurnsHistogram(self, mask: np.ndarray = None) -> np.ndarray:
+        '''
+        決着(IsEnd)までのターン数の分布(添字がターン数)
+        '''
+        turns = self.Games('turns')
+        if mask is not None:
+            turns = turns[mask]
+        return np.bincount(turns)
+
+    def EndReasons(self) -> np.ndarray:
+        '''
+        決着の理由 (END_*) ごとの試合数
+        '''
+        return np.bincount(self.Games('end'), minlength=len(END_NAMES))
+
+    def GameTurns(self, index: int) -> dict:
+        '''
+        index 番目の試合のターンごとの列
+        '''
+        start = int(self.Games('turn_start')[index])
+        end = start + int(self.Games('turns')[index])
+        return {col: self.Turns(col)[start:end]
+                for col, _, _ in TURN_COLUMNS}
+
+
+def RulesDict(rules: yakyuken.Rules) -> dict:
+    return {'card_num': rules.card_num, 'hand_max': rules.hand_max,
+            'life_max': rules.life_max}
+
+
+def PlayGame(seed: int, rules: yakyuken.Rules, turns: dict) -> tuple:
+    '''
+    シードから1試合行い、ターンごとの値を turns に追加する
+    (seed が同じなら同じ試合になる)
+    戻り値は (勝者, 決着の理由, ターン数, 最終ライフ, 最初の手札)
+    '''
+    rng = yakyuken.RngStreams(seed)
+    sim = yakyuken.MatchSim(rules, rng)
+    pick = rng.com
+    opening = [sim.hands[side].count(t) for side in range(2)
+               for t in CARD_TYPES]
+    cards = turns['cards']
+    results = turns['result']
+    lives = turns['lives']
+    while not sim.is_end:
+        p_idx = pick.randrange(len(sim.hands[0]))
+        c_idx = pick.randrange(len(sim.hands[1]))
+        cards.append(TYPE_INDEX[sim.hands[0][p_idx]])
+        cards.append(TYPE_INDEX[sim.hands[1][c_idx]])
+        results.append(sim.Step(p_idx, c_idx))
+        lives.extend(sim.lives)
+    winner = sim.Winner()
+    end = END_COM_LIFE if winner == 1 else \
+        END_PLAYER_LIFE if winner == -1 else END_PILE
+    return winner, end, sim.turn, sim.lives, opening
+
+
+def Simulate(store: GameStore, games: int, seed: int, chunk: int):
+    '''
+    games 試合行って chunk 試合ごとに追記する
+    (試合のシードはマスターシードと通し番号から導出する)
+    '''
+    master = yakyuken.RngStreams(seed)
+    rules = store.Rules()
+    first = store.Rows('games')
+    done = 0
+    start = time.perf_counter()
+    while done < games:
+        num = min(chunk, games - done)
+        g = {'seed': array('Q'), 'winner': array('b'), 'end': array('b'),
+             'turns': array('h'), 'turn_start': array('q'),
+             'lives': array('b'), 'opening': array('b')}
+        t = {'cards': array('b'), 'result': array('b'), 'lives': array('b')}
+        for i in range(first + done, first + done + num):
+            game_seed = master.Derive(f'game/{i}')
+            g['turn_start'].append(len(t['result']))
+            winner, end, turns, lives, opening = \
+                PlayGame(game_seed, rules, t)
+            g['seed'].append(game_seed)
+            g['winner'].append(winner)
+            g['end'].append(end)
+            g['turns'].append(turns)
+            g['lives'].extend(lives)
+            g['opening'].extend(opening)
+        store.Append({'games': g, 'turns': t})
+        done += num
+        elapsed = time.perf_counter() - start
+        print(f'{done}/{games} games  {done / elapsed:,.0f} games/s',
+              flush=True)
+
+
+def PrintStats(store: GameStore, top: int):
+    '''
+    主な集計結果を表示
+    '''
+    n = store.Rows('games')
+    rules = store.Rules()
+    print(f'{n} games, {store.Rows("turns")} turns  '
+          f'(card_num={rules.card_num} hand_max={rules.hand_max} '
+          f'life_max={rules.life_max})')
+    if n == 0:
+        return
+    start = time.perf_counter()
+    rate = store.WinRate()
+    print(f'player win {rate[1]:.4f}  COM win {rate[-1]:.4f}  '
+          f'no contest {rate[0]:.4f}')
+
+    print('end reason')
+    for name, cnt in zip(END_NAMES, store.EndReasons()):
+        print(f'  {name:<14}{cnt:>10}  {cnt / n:.4f}')
+
+    print('turns to IsEnd')
+    hist = store.TurnsHistogram()
+    for turns, cnt in enumerate(hist):
+        if 0 < cnt:
+            print(f'  {turns:>3}{cnt:>10}  {cnt / n:.4f}')
+
+    print('player win rate by first card')
+    for (t,), games, win in store.WinRateByFirstCard():
+        print(f'  {TYPE_NAMES[t]}{games:>10}  {win:.4f}')
+
+    rows = store.WinRateByOpening()
+    rows.sort(key=lambda r: r[2], reverse=True)
+    print(f'player win rate by opening hand (G, C, P), top/bottom {top}')
+    for key, games, win in rows[:top] + rows[-top:]:
+        print(f'  {key}{games:>10}  {win:.4f}')
+    print(f'queries in {time.perf_counter() - start:.3f}s')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    sim = sub.add_parser('simulate', help='対戦して結果を追記する')
+    sim.add_argument('store', help='ストアのディレクトリ')
+    sim.add_argument('--games', type=int, default=100000,
+                     help='試合数')
+    sim.add_argument('--seed', type=int, default=0,
+                     help='マスターシード')
+    sim.add_argument('--chunk', type=int, default=65536,
+                     help='まとめて追記する試合数')
+    sim.add_argument('--rules', default=None,
+                     help='ルール設定ファイル(JSON、新規作成時のみ)')
+    stats = sub.add_parser('stats', help='集計結果を表示する')
+    stats.add_argument('store', help='ストアのディレクトリ')
+    stats.add_argument('--top', type=int, default=5,
+                       help='最初の手札ごとの勝率を上下何件表示するか')
+    args = parser.parse_args()
+
+    if args.command == 'simulate':
+        rules = yakyuken.Rules()
+        if args.rules is not None:
+            rules.Load(args.rules)
+        store = GameStore(args.store, rules)
+        Simulate(store, args.games, args.seed, args.chunk)
+    else:
+        store = GameStore(args.store)
+        PrintStats(store, args.top)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
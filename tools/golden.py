@@ -0,0 +1,247 @@
+'''
+ゴールデン画像による画面の回帰テスト
+
+ウインドウなしで App を動かし、決まった操作で各 GameState の画面まで進めて
+App.draw の結果(パレット番号の 256x256 の画面)を NumPy 配列として取り出す。
+保存済みのゴールデン画像と配列のまま比較し、違う画素があれば失敗とする。
+
+    python tools/golden.py             # ゴールデン画像と比較
+    python tools/golden.py --update    # ゴールデン画像を作り直す
+
+作り直す時は、作り直す前の比較結果(どの画面で何画素がどの範囲で違うか)と
+その理由をコミットメッセージに書く。
+'''
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+# ウインドウ・音声なしで動かす
+os.environ.setdefault('SDL_VIDEODRIVER', 'offscreen')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pyxel  # noqa: E402
+import yakyuken  # noqa: E402
+from yakyuken import GameState, MsgState, LifeState  # noqa: E402
+from leak_check import Pilot, Settle  # noqa: E402
+
+GOLDEN_PATH = os.path.join(ROOT, 'tools', 'golden', 'frames.npz')
+# 画面を作る時の乱数のシード
+GOLDEN_SEED = 1
+# 状態が変わらない場合の保険
+SCENE_FRAME_MAX = 20000
+# 観戦モードを進めてから撮るフレーム数
+SPECTATE_FRAMES = 120
+
+
+class Screen:
+    '''
+    画面(pyxel.screen)を NumPy 配列として取り出すクラス
+
+    pyxel.screen のピクセルデータをコピーせずに参照する配列を
+    1つだけ作っておき、取り出す時にだけコピーする。
+    (data_ptr は呼ぶたびにメモリを確保するので1回だけ呼ぶ)
+    '''
+    def __init__(self):
+        self.view = np.ctypeslib.as_array(pyxel.screen.data_ptr()) \
+            .reshape(pyxel.height, pyxel.width)
+
+    def Grab(self, app: yakyuken.App) -> np.ndarray:
+        '''
+        App.draw で描画して画面を取り出す
+        '''
+        app.draw()
+        return self.view.copy()
+
+
+class Scenario:
+    '''
+    決まった操作で各画面まで進めるクラス
+    '''
+    def __init__(self, app: yakyuken.App):
+        self.app = app
+        self.pilot = Pilot(app)
+        self.screen = Screen()
+
+    def Until(self, cond):
+        '''
+        条件を満たすまでフレームを進める
+        '''
+        for _ in range(SCENE_FRAME_MAX):
+            if cond():
+                Settle()
+                return
+            self.pilot.Tick()
+        raise RuntimeError('scene not reached')
+
+    def Quiet(self) -> bool:
+        '''
+        メッセージ・ライフゲージの演出が終わっているか？
+        '''
+        app = self.app
+        return app.msg_box.state == MsgState.WAIT \
+            and app.player.life.state == LifeState.WAIT \
+            and app.com.life.state == LifeState.WAIT
+
+    def Loading(self):
+        '''
+        読み込み画面(App(run=False) は読み込みを済ませてから返るので、
+        読み込みタスクを作り直してフォントまで読み込んだところで止める)
+        '''
+        app = self.app
+        app.loader = app.ReadResources()
+        app.game_sate = GameState.LOADING
+        while app.loader.tasks[app.loader.done].name != 'assets/op.json':
+            app.UpdateLoading()
+        frame = self.screen.Grab(app)
+        app.loader.RunAll()
+        # 読み込み直しで引いた乱数の影響を残さない
+        yakyuken.RNG.Seed(GOLDEN_SEED)
+        app.DefineVariables()
+        return frame
+
+    def Run(self):
+        '''
+        画面の名前と画面を順に返す
+        '''
+        app = self.app
+        pilot = self.pilot
+        yield 'loading', self.Loading()
+
+        self.Until(lambda: True)
+        yield 'title', self.screen.Grab(app)
+
+        pilot.Click(app.start_btn)
+        self.Until(lambda: app.game_sate == GameState.INIT
+                   and self.Quiet())
+        yield 'init', self.screen.Grab(app)
+
+        self.Until(lambda: app.game_sate == GameState.SELECT
+                   and self.Quiet())
+        yield 'select', self.screen.Grab(app)
+
+        pilot.Click(app.player.deck.hands[0])
+        self.Until(lambda: app.choose is not None and self.Quiet())
+        yield 'ready', self.screen.Grab(app)
+
+        pilot.Click(app.choose.yes_btn)
+        self.Until(lambda: app.game_sate == GameState.OPEN
+                   and app.com.deck.selected_card.state
+                   == yakyuken.CardState.WAIT and self.Quiet())
+        yield 'open', self.screen.Grab(app)
+
+        self.Until(lambda: app.game_sate == GameState.RESULT
+                   and self.Quiet())
+        yield 'result', self.screen.Grab(app)
+
+        pilot.WaitState(GameState.GAME_SET)
+        self.Until(self.Quiet)
+        yield 'game_set', self.screen.Grab(app)
+
+        pilot.WaitState(GameState.END)
+        self.Until(self.Quiet)
+        yield 'end', self.screen.Grab(app)
+
+        pilot.WaitState(GameState.END_WAIT)
+        self.Until(self.Quiet)
+        yield 'end_wait', self.screen.Grab(app)
+
+        pilot.Click(app.choose.no_btn)
+        pilot.WaitState(GameState.TITLE)
+        if not app.gallary_btn.is_show:
+            pilot.Press(pyxel.KEY_D)
+        pilot.Click(app.gallary_btn)
+        self.Until(lambda: app.game_sate == GameState.GALLARY)
+        yield 'gallary', self.screen.Grab(app)
+
+        pilot.Click(app.return_btn)
+        pilot.WaitState(GameState.TITLE)
+        pilot.Press(pyxel.KEY_S)
+        self.Until(lambda: app.game_sate == GameState.SPECTATE)
+        for _ in range(SPECTATE_FRAMES):
+            pilot.Tick()
+        # 処理時間の表示は毎回変わるので消す
+        app.spectator.status = ''
+        yield 'spectate', self.screen.Grab(app)
+
+
+def Diff(expected: np.ndarray, actual: np.ndarray) -> tuple:
+    '''
+    違う画素の数と範囲 (x0, y0, x1, y1) を返す
+    '''
+    mask = expected != actual
+    count = int(np.count_nonzero(mask))
+    if count == 0:
+        return 0, None
+    ys = np.flatnonzero(mask.any(axis=1))
+    xs = np.flatnonzero(mask.any(axis=0))
+    return count, (int(xs[0]), int(ys[0]), int(xs[-1]), int(ys[-1]))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--update', action='store_true',
+                        help='ゴールデン画像を作り直す')
+    parser.add_argument('--golden', default=GOLDEN_PATH,
+                        help='ゴールデン画像ファイル(.npz)')
+    parser.add_argument('--out', default=None,
+                        help='失敗した画面の保存先(.npz)')
+    args = parser.parse_args()
+
+    # 毎回同じ展開・同じ画面にする
+    yakyuken.SNAPSHOTS.enabled = False
+    # 処理時間でパーティクルの数が変わらないようにする
+    yakyuken.PARTICLES.budget = None
+    yakyuken.RNG.Seed(GOLDEN_SEED)
+    app = yakyuken.App(run=False)
+    if not app.has_resources:
+        print('resources read error')
+        return 2
+
+    start = time.perf_counter()
+    frames = dict(Scenario(app).Run())
+    elapsed = time.perf_counter() - start
+
+    if args.update:
+        os.makedirs(os.path.dirname(args.golden), exist_ok=True)
+        np.savez_compressed(args.golden, **frames)
+        print(f'{len(frames)} frames saved: {args.golden}')
+        return 0
+
+    if not os.path.exists(args.golden):
+        print('no golden frames (run with --update to create them)')
+        return 2
+    golden = np.load(args.golden)
+
+    ok = True
+    failed = {}
+    for name, actual in frames.items():
+        if name not in golden:
+            print(f'{name:<10} missing in golden')
+            ok = False
+            continue
+        expected = golden[name]
+        count, box = Diff(expected, actual)
+        if count == 0:
+            print(f'{name:<10} ok')
+        else:
+            print(f'{name:<10} NG {count} pixels differ in {box}')
+            failed[f'{name}_expected'] = expected
+            failed[f'{name}_actual'] = actual
+            ok = False
+    print(f'{len(frames)} frames in {elapsed:.2f}s')
+
+    if failed and args.out is not None:
+        np.savez_compressed(args.out, **failed)
+        print(f'failed frames saved: {args.out}')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,334 @@
+'''
+リトライ・ギャラリー往復によるメモリリーク検出ツール
+
+実際の App を画面なしで動かし、END_WAIT → Yes/No のリトライと
+ギャラリーの出入りを繰り返す。GameState に入るたびに tracemalloc で
+yakyuken.py から確保された保持メモリを記録し、全体または確保した場所ごとに
+バイト数・ブロック数がサイクルごとに増え続けていれば失敗とする。
+
+    python tools/leak_check.py --cycles 8
+'''
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+# ウインドウ・音声なしで動かす
+os.environ.setdefault('SDL_VIDEODRIVER', 'offscreen')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pyxel  # noqa: E402
+import yakyuken  # noqa: E402
+from yakyuken import GameState, CardState, MsgState  # noqa: E402
+
+# 1サイクルで回す最大フレーム数(進行しない場合の保険)
+CYCLE_FRAME_MAX = 200000
+# サイクルごとに同じ対戦にする乱数のシード
+# (対戦の展開で保持メモリが変わらないようにし、増えた分だけを見る)
+CYCLE_SEED = 1
+
+
+class Pilot:
+    '''
+    App を自動操作するクラス
+
+    update/draw は直接呼び出し、クリックの時だけ pyxel.flip で
+    フレームを進めて押下状態をリセットする。
+    (flip 後はマウス座標がウインドウから読み直されるので、
+    クリック直前に毎回 set_mouse_pos する)
+    '''
+    def __init__(self, app: yakyuken.App):
+        self.app = app
+        self.on_state = None
+
+    def Tick(self):
+        '''
+        1フレーム分の更新・描画
+        '''
+        prev = self.app.game_sate
+        self.app.update()
+        self.app.draw()
+        if self.on_state is not None and prev != self.app.game_sate:
+            self.on_state(self.app.game_sate)
+
+    def Flip(self):
+        '''
+        入力処理のためにフレームを進める
+        '''
+        pyxel.flip()
+
+    def Press(self, key: int):
+        '''
+        キー(マウスボタン)を1回押す
+        '''
+        pyxel.set_btn(key, True)
+        self.Tick()
+        pyxel.set_btn(key, False)
+        self.Flip()
+        # メッセージ送りは frame_count % 4 で進むので揃えておく
+        while pyxel.frame_count % 4 != 0:
+            self.Flip()
+
+    def Click(self, obj):
+        '''
+        オブジェクトの中心をクリック
+        '''
+        pyxel.set_mouse_pos(obj.x + obj.w / 2, obj.y + obj.h / 2)
+        self.Press(pyxel.MOUSE_BUTTON_LEFT)
+
+    def WaitState(self, state: GameState):
+        '''
+        指定の状態になるまで自動で進める
+        '''
+        for _ in range(CYCLE_FRAME_MAX):
+            if self.app.game_sate == state:
+                return
+            self.Step()
+        raise RuntimeError(f'state {state} not reached')
+
+    def Step(self):
+        '''
+        状態に応じてプレイヤー操作を行う
+        '''
+        app = self.app
+        deck = app.player.deck
+        if GameState.SELECT == app.game_sate \
+                and app.msg_box.state == MsgState.WAIT:
+            if app.choose is not None:
+                self.Click(app.choose.yes_btn)
+                return
+            if deck.selected_card is None \
+                    and all(h.state == CardState.WAIT for h in deck.hands):
+                self.Click(deck.hands[0])
+                return
+        self.Tick()
+
+    def Match(self, retry: bool):
+        '''
+        タイトルから1試合行い、リトライ選択まで進める
+        '''
+        app = self.app
+        if app.game_sate == GameState.TITLE:
+            self.Click(app.start_btn)
+        self.WaitState(GameState.END_WAIT)
+        for _ in range(CYCLE_FRAME_MAX):
+            if app.msg_box.state == MsgState.WAIT:
+                break
+            self.Tick()
+        if retry:
+            self.Click(app.choose.yes_btn)
+        else:
+            self.Click(app.choose.no_btn)
+            self.WaitState(GameState.TITLE)
+
+    def Gallary(self):
+        '''
+        ギャラリーに入って全画像を送り、タイトルへ戻る
+        '''
+        app = self.app
+        if not app.gallary_btn.is_show:
+            self.Press(pyxel.KEY_D)
+        self.Click(app.gallary_btn)
+        for arw in (app.gal_arw_r, app.gal_arw_l):
+            for _ in range(yakyuken.RULES.life_max):
+                self.Click(arw)
+                for _ in range(10):
+                    self.Tick()
+        self.Click(app.return_btn)
+        self.WaitState(GameState.TITLE)
+
+
+def Settle():
+    '''
+    立ち絵の先読み中は確保途中のメモリがあるので終わるまで待つ
+    '''
+    cache = yakyuken.PORTRAITS
+    while cache.pending:
+        time.sleep(0.001)
+        cache.update()
+
+
+def Site(traceback: tracemalloc.Traceback) -> str:
+    '''
+    確保した場所(トレースバックの中で一番内側の yakyuken.py の行)
+    '''
+    # トレースバックは外側から順に並んでいる
+    for frame in reversed(traceback):
+        if frame.filename == yakyuken.__file__:
+            return f'yakyuken.py:{frame.lineno}'
+    return '?'
+
+
+class Recorder:
+    '''
+    GameState ごとの保持メモリを記録するクラス
+
+    スナップショットは yakyuken.py から確保されたもの(呼び出し元のどこかに
+    yakyuken.py があるもの)だけに絞るので、計測処理や pyxel 内部の確保は
+    含まれない。確保した場所ごとの保持バイト数・ブロック数を
+    最初のサイクルとの compare_to で求め、サイクルごとに記録する。
+    スナップショットを取る時の gc.collect で内部の空きリストが片付き、
+    確保した場所の付き方が数サイクルかけて変わるので、
+    計測しないウォームアップ中も同じ時点でスナップショットを取る。
+    '''
+    def __init__(self):
+        self.recording = False  # 計測中か(False: ウォームアップ中)
+        self.seen = set()       # このサイクルで記録済みの状態
+        self.cycle = 0
+        self.memory = {}    # state -> [サイクルごとの保持バイト数]
+        self.blocks = []    # サイクルごとの保持ブロック数
+        self.sites = {}     # 確保した場所 -> [サイクルごとの (バイト数, 数)]
+        self.first = None   # 最初のサイクルのスナップショット
+
+    def Take(self) -> tracemalloc.Snapshot:
+        '''
+        yakyuken.py からの確保だけのスナップショット
+        (上限のあるラベルのキャッシュは、いっぱいになるまで増えるので空にする。
+        立ち絵のキャッシュはギャラリーで全て読むので最初のサイクルで埋まる)
+        '''
+        Settle()
+        yakyuken.LABELS.Clear()
+        gc.collect()
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(True, yakyuken.__file__, all_frames=True),
+        ))
+
+    def OnState(self, state: GameState):
+        '''
+        状態遷移時に保持メモリを記録(サイクル内で最初の1回)
+        '''
+        if state in self.seen:
+            return
+        self.seen.add(state)
+        snap = self.Take()
+        if not self.recording:
+            return
+        values = self.memory.setdefault(state, [])
+        values.extend([None] * (self.cycle + 1 - len(values)))
+        values[self.cycle] = sum(st.size for st in snap.statistics('filename'))
+
+    def EndCycle(self):
+        '''
+        サイクル終了時に確保した場所ごとの保持量を記録する
+        '''
+        snap = self.Take()
+        self.seen.clear()
+        if not self.recording:
+            return
+        if self.first is None:
+            self.first = snap
+        sites = {}
+        for st in snap.compare_to(self.first, 'traceback'):
+            size, count = sites.get(Site(st.traceback), (0, 0))
+            sites[Site(st.traceback)] = (size + st.size, count + st.count)
+        for site, value in sites.items():
+            values = self.sites.setdefault(site, [])
+            values.extend([(0, 0)] * (self.cycle - len(values)))
+            values.append(value)
+        self.blocks.append(sum(count for _, count in sites.values()))
+        self.cycle += 1
+
+
+def Slope(values: list) -> float:
+    '''
+    最小二乗法によるサイクルあたりの増加量
+    '''
+    pts = [(i, v) for i, v in enumerate(values) if v is not None]
+    if len(pts) < 2:
+        return 0.0
+    n = len(pts)
+    mx = sum(p[0] for p in pts) / n
+    my = sum(p[1] for p in pts) / n
+    den = sum((p[0] - mx) ** 2 for p in pts)
+    return sum((p[0] - mx) * (p[1] - my) for p in pts) / den
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--cycles', type=int, default=8,
+                        help='計測するサイクル数')
+    parser.add_argument('--warmup', type=int, default=3,
+                        help='計測から除外する最初のサイクル数(キャッシュなどが埋まるまで)')
+    parser.add_argument('--bytes-tol', type=float, default=256,
+                        help='許容する1サイクルあたりの保持メモリ増加(byte)')
+    parser.add_argument('--blocks-tol', type=float, default=1,
+                        help='許容する1サイクルあたりの保持ブロック増加')
+    parser.add_argument('--depth', type=int, default=4,
+                        help='記録するトレースバックの深さ')
+    parser.add_argument('--top', type=int, default=10,
+                        help='表示する確保場所の数')
+    args = parser.parse_args()
+
+    # 計測中の対戦をスナップショットとして残さない
+    yakyuken.SNAPSHOTS.enabled = False
+    # 処理時間でパーティクルの数(=サイクルごとの展開)が変わらないようにする
+    yakyuken.PARTICLES.budget = None
+    tracemalloc.start(args.depth)
+    app = yakyuken.App(run=False)
+    if not app.has_resources:
+        print('resources read error')
+        return 2
+
+    pilot = Pilot(app)
+    rec = Recorder()
+    pilot.on_state = rec.OnState
+
+    total = args.warmup + args.cycles
+    for cycle in range(total):
+        # リトライ → タイトルへ戻る → ギャラリー往復 を1サイクルとする
+        yakyuken.RNG.Seed(CYCLE_SEED)
+        pilot.Match(retry=True)
+        pilot.Match(retry=False)
+        pilot.Gallary()
+        rec.EndCycle()
+        rec.recording = args.warmup <= cycle + 1
+        print(f'cycle {cycle + 1}/{total} done', flush=True)
+
+    ok = True
+    print(f'{"state":<20}{"first":>12}{"last":>12}{"byte/cycle":>12}')
+    for state, values in rec.memory.items():
+        slope = Slope(values)
+        known = [v for v in values if v is not None]
+        mark = ''
+        if args.bytes_tol < slope:
+            mark = '  NG'
+            ok = False
+        print(f'{state.name:<20}{known[0]:>12}{known[-1]:>12}'
+              f'{slope:>12.1f}{mark}')
+
+    slope = Slope(rec.blocks)
+    mark = ''
+    if args.blocks_tol < slope:
+        mark = '  NG'
+        ok = False
+    print(f'blocks: {" ".join(map(str, rec.blocks))} '
+          f'({slope:.1f}/cycle){mark}')
+
+    # 確保した場所ごとの増加量(増えている順)
+    growth = []
+    for site, values in rec.sites.items():
+        values += [(0, 0)] * (rec.cycle - len(values))
+        growth.append((Slope([v[0] for v in values]),
+                       Slope([v[1] for v in values]), site))
+    growth.sort(reverse=True)
+    print(f'{"site":<24}{"byte/cycle":>12}{"block/cycle":>12}')
+    for size, count, site in growth[:args.top]:
+        if size <= 0 and count <= 0:
+            break
+        mark = ''
+        if args.bytes_tol < size or args.blocks_tol < count:
+            mark = '  NG'
+            ok = False
+        print(f'{site:<24}{size:>12.1f}{count:>12.1f}{mark}')
+
+    print('OK' if ok else 'NG: retained memory grows across cycles')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
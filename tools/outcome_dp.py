@@ -0,0 +1,451 @@
+'''
+動的計画法による対戦結果の厳密な確率分布
+
+山札の並びを列挙せず、お互いの「まだ出ていないカードの種類ごとの枚数」・
+手札の種類ごとの枚数・ライフを状態として1ターンずつ確率を伝播する。
+手札の補充・勝負判定・決着判定は yakyuken の Deck.HandDrow / App.IsEnd
+(MatchSim) と同じ順序で行う。
+    - 勝負の後、決着していなければ出したカードを抜いて山札から1枚補充
+    - どちらかのライフが0、またはどちらかの山札が0で決着
+
+手札から一様ランダムに選ぶ方針(Deck.RandomPick)では、手札は
+まだ出ていないカードからの無作為な組み合わせのままなので(交換可能性)、
+種類 t を出す確率は未出カードに占める t の割合になる。
+この場合は手札を状態に持たず、未出カードの枚数だけで計算する。
+
+    python tools/outcome_dp.py
+    python tools/outcome_dp.py --player hint --life-max 3
+    python tools/outcome_dp.py --mc 100000     # モンテカルロと比較
+'''
+import argparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import yakyuken  # noqa: E402
+
+# カード種類の番号 (0: G, 1: C, 2: P)
+CARD_TYPES = (yakyuken.GU, yakyuken.CH, yakyuken.PA)
+
+# 勝負判定表 JUDGE[プレイヤー][COM] (1: プレイヤー勝ち, 0: あいこ, -1: 負け)
+JUDGE = tuple(tuple(yakyuken.Janken(pt, ct) for ct in CARD_TYPES)
+              for pt in CARD_TYPES)
+
+# 結果の種類(MatchSim.Winner の値)
+RESULT_NAMES = {1: 'player win', -1: 'COM win', 0: 'No contest'}
+
+
+def Sub(counts: tuple, t: int, n: int = 1) -> tuple:
+    '''
+    種類 t の枚数を n 枚減らす
+    '''
+    return tuple(v - n if i == t else v for i, v in enumerate(counts))
+
+
+def Add(counts: tuple, t: int) -> tuple:
+    '''
+    種類 t の枚数を1枚増やす
+    '''
+    return tuple(v + 1 if i == t else v for i, v in enumerate(counts))
+
+
+def HandDeals(rest: tuple, size: int) -> dict:
+    '''
+    未出カード rest から size 枚引いた手札の分布(多変量超幾何分布)
+    '''
+    dist = {(0, 0, 0): 1.0}
+    for k in range(size):
+        total = sum(rest) - k
+        nxt = defaultdict(float)
+        for hand, prob in dist.items():
+            for t in range(3):
+                left = rest[t] - hand[t]
+                if 0 < left:
+                    nxt[Add(hand, t)] += prob * left / total
+        dist = nxt
+    return dict(dist)
+
+
+class Policy:
+    '''
+    カードの出し方(方針)の基底クラス
+
+    uses_hand が False の方針は手札の中身を見ない(一様ランダム)ものとし、
+    手札を状態に持たずに計算する。
+    '''
+    uses_hand = True
+
+    def Probs(self, hand: tuple, rest: tuple, opp_rest: tuple) -> tuple:
+        '''
+        種類ごとの出す確率
+        hand: 手札の枚数 (uses_hand が False の時は None)
+        rest: 自分の未出カードの枚数(手札を含む)
+        opp_rest: 相手の未出カードの枚数(出たカードは公開されている)
+        '''
+        raise NotImplementedError
+
+    def Key(self, hand: tuple, rest: tuple, opp_rest: tuple) -> tuple:
+        '''
+        Probs の結果が同じになる状態をまとめるキー(計算結果のキャッシュ用)
+        '''
+        return hand, rest, opp_rest
+
+
+class RandomPolicy(Policy):
+    '''
+    手札から一様ランダムに選ぶ (Deck.RandomPick)
+    '''
+    uses_hand = False
+
+    def Probs(self, hand: tuple, rest: tuple, opp_rest: tuple) -> tuple:
+        counts = rest if hand is None else hand
+        total = sum(counts)
+        return tuple(v / total for v in counts)
+
+
+class HintPolicy(Policy):
+    '''
+    勝率ヒント (HintTable) に従い、勝ち - 負け の確率が一番高い種類を出す
+    (同点の種類は等確率)
+    '''
+    def Probs(self, hand: tuple, rest: tuple, opp_rest: tuple) -> tuple:
+        total = sum(opp_rest)
+        scores = []
+        for t in range(3):
+            if hand[t] <= 0:
+                scores.append(None)
+                continue
+            score = 0
+            for u in range(3):
+                score += JUDGE[t][u] * opp_rest[u]
+            scores.append(score / total if 0 < total else 0)
+        best = max(s for s in scores if s is not None)
+        picks = [s is not None and best - 1e-12 <= s for s in scores]
+        num = sum(picks)
+        return tuple(1 / num if pick else 0.0 for pick in picks)
+
+    def Key(self, hand: tuple, rest: tuple, opp_rest: tuple) -> tuple:
+        # 自分の未出カードは見ない
+        return hand, opp_rest
+
+
+POLICIES = {
+    'random': RandomPolicy,
+    'hint': HintPolicy,
+}
+
+
+class Side:
+    '''
+    片側(プレイヤー/COM)の状態遷移
+
+    状態は (未出カードの枚数, 手札の枚数) で、
+    方針が手札を見ない場合は手札を None にまとめる。
+    '''
+    def __init__(self, policy: Policy, rules: yakyuken.Rules):
+        self.policy = policy
+        self.rules = rules
+        self.cache = {}     # Policy.Key -> 出す確率
+
+    def Initial(self) -> dict:
+        '''
+        配り終えた時点の状態の分布
+        '''
+        n = self.rules.card_num
+        rest = (n, n, n)
+        size = min(self.rules.hand_max, sum(rest))
+        if not self.policy.uses_hand:
+            return {(rest, None): 1.0}
+        return {(rest, hand): prob
+                for hand, prob in HandDeals(rest, size).items()}
+
+    def PlayTable(self, states: list, opp_states: list) -> np.ndarray:
+        '''
+        (種類, 自分の状態, 相手の状態) ごとの出す確率
+        (方針が見るのは相手の未出カードだけなので、その種類ごとに計算する)
+        '''
+        rests = {}
+        opp_idx = [rests.setdefault(s[0], len(rests)) for s in opp_states]
+        policy = self.policy
+        cache = self.cache
+        rows = []
+        for rest, hand in states:
+            row = []
+            for opp_rest in rests:
+                key = policy.Key(hand, rest, opp_rest)
+                probs = cache.get(key)
+                if probs is None:
+                    probs = cache[key] = policy.Probs(hand, rest, opp_rest)
+                row.append(probs)
+            rows.append(row)
+        # (自分の状態, 相手の未出カード, 種類) -> (種類, 自分, 相手)
+        table = np.array(rows).transpose(2, 0, 1)
+        return table[:, :, opp_idx]
+
+    def Draws(self, state: tuple, t: int) -> list:
+        '''
+        種類 t を出して1枚補充した後の [(引いた種類, 状態, 確率)]
+        (山札が残っている時だけ呼ばれる)
+        '''
+        rest, hand = state
+        rest = Sub(rest, t)
+        if hand is None:
+            return [(None, (rest, None), 1.0)]
+        hand = Sub(hand, t)
+        # 山札 = 未出カード - 手札
+        pile = tuple(r - h for r, h in zip(rest, hand))
+        total = sum(pile)
+        return [(u, (rest, Add(hand, u)), pile[u] / total)
+                for u in range(3) if 0 < pile[u]]
+
+    def Moves(self, states: list) -> tuple:
+        '''
+        次のターンの状態一覧と、出した種類ごとの遷移
+        遷移は引いた種類ごとの (元の番号, 先の番号, 確率) の配列で、
+        出した種類と引いた種類が決まれば行き先は重ならない。
+        '''
+        index = {}
+        moves = []
+        for t in range(3):
+            groups = defaultdict(lambda: ([], [], []))
+            for i, state in enumerate(states):
+                rest, hand = state
+                if (rest if hand is None else hand)[t] <= 0:
+                    continue
+                for u, nxt, prob in self.Draws(state, t):
+                    src, dst, probs = groups[u]
+                    src.append(i)
+                    dst.append(index.setdefault(nxt, len(index)))
+                    probs.append(prob)
+            moves.append([(np.array(src), np.array(dst), np.array(probs))
+                          for src, dst, probs in groups.values()])
+        return list(index), moves
+
+
+class OutcomeDP:
+    '''
+    対戦結果の確率分布を計算するクラス
+
+    ターンごとに (プレイヤーの状態, COMの状態, プレイヤーのライフ,
+    COMのライフ) の確率を NumPy 配列で持ち、決着した確率を
+    (結果, ライフ差) ごとに集計する。
+    お互いの山札は同じ枚数ずつ減るので、ターン数から残り枚数が決まる。
+    '''
+    def __init__(self, rules: yakyuken.Rules, player: Policy, com: Policy):
+        self.rules = rules
+        self.sides = (Side(player, rules), Side(com, rules))
+        self.outcomes = defaultdict(float)  # (結果, ライフ差) -> 確率
+        self.turns = defaultdict(float)     # 決着したターン数 -> 確率
+        self.states = 0                     # 計算した状態の数
+
+    def Run(self) -> 'OutcomeDP':
+        '''
+        決着するまで確率を伝播する
+        '''
+        rules = self.rules
+        life = rules.life_max
+        hand = min(rules.hand_max, 3 * rules.card_num)
+        pile = 3 * rules.card_num - hand
+        player, com = self.sides
+
+        p_init = player.Initial()
+        c_init = com.Initial()
+        p_states = list(p_init)
+        c_states = list(c_init)
+        # ライフは 1..life を 0..life-1 の添字で持つ
+        dist = np.zeros((len(p_states), len(c_states), life, life))
+        dist[:, :, -1, -1] = np.outer(list(p_init.values()),
+                                      list(c_init.values()))
+
+        turn = 0
+        while True:
+            turn += 1
+            self.states += dist.size
+            p_probs = player.PlayTable(p_states, c_states)
+            c_probs = com.PlayTable(c_states, p_states).transpose(0, 2, 1)
+            if 0 < pile:
+                p_next, p_moves = player.Moves(p_states)
+                c_next, c_moves = com.Moves(c_states)
+                # プレイヤーが出した種類ごとの COM 補充後の確率
+                acc = np.zeros((3, len(p_states), len(c_next), life, life))
+
+            for pt in range(3):
+                for ct in range(3):
+                    w = p_probs[pt] * c_probs[ct]
+                    if not w.any():
+                        continue
+                    cur = dist * w[:, :, None, None]
+                    cur = self.Battle(turn, cur, JUDGE[pt][ct])
+                    # 決着判定 (App.IsEnd)
+                    if pile <= 0:
+                        self.Finish(turn, 0, cur.sum(axis=(0, 1)))
+                        continue
+                    # 手札を補充 (Deck.HandDrow)
+                    for src, dst, prob in c_moves[ct]:
+                        acc[pt][:, dst] += cur[:, src] \
+                            * prob[None, :, None, None]
+
+            if pile <= 0:
+                break
+            dist = np.zeros((len(p_next), len(c_next), life, life))
+            for pt in range(3):
+                for src, dst, prob in p_moves[pt]:
+                    dist[dst] += acc[pt][src] * prob[:, None, None, None]
+            p_states = p_next
+            c_states = c_next
+            pile -= 1
+        return self
+
+    def Battle(self, turn: int, cur: np.ndarray, result: int) -> np.ndarray:
+        '''
+        勝負の結果でライフを減らし、ライフが0になった分を集計して除く
+        '''
+        if result == 0:
+            return cur
+        axis = 3 if 0 < result else 2
+        moved = np.zeros_like(cur)
+        if 0 < result:
+            moved[:, :, :, :-1] = cur[:, :, :, 1:]
+            ended = cur[:, :, :, 0].sum(axis=(0, 1))
+        else:
+            moved[:, :, :-1, :] = cur[:, :, 1:, :]
+            ended = cur[:, :, 0, :].sum(axis=(0, 1))
+        # ended[i]: 残った側のライフ i + 1
+        for i, prob in enumerate(ended):
+            diff = i + 1 if axis == 3 else -(i + 1)
+            self.outcomes[(result, diff)] += prob
+            self.turns[turn] += prob
+        return moved
+
+    def Finish(self, turn: int, winner: int, lives: np.ndarray):
+        '''
+        山札が尽きて決着した分を集計
+        '''
+        for (lp, lc), prob in np.ndenumerate(lives):
+            self.outcomes[(winner, lp - lc)] += prob
+            self.turns[turn] += prob
+
+    def Result(self, winner: int) -> float:
+        '''
+        結果ごとの確率
+        '''
+        return sum(p for (w, _), p in self.outcomes.items() if w == winner)
+
+    def LifeDiff(self) -> dict:
+        '''
+        最終ライフ差(プレイヤー - COM) -> 確率
+        '''
+        diff = defaultdict(float)
+        for (_, d), p in self.outcomes.items():
+            diff[d] += p
+        return dict(sorted(diff.items()))
+
+    def MeanTurns(self) -> float:
+        '''
+        決着までの平均ターン数
+        '''
+        return sum(t * p for t, p in self.turns.items())
+
+
+def MonteCarlo(rules: yakyuken.Rules, player: Policy, com: Policy,
+               games: int, seed: int) -> dict:
+    '''
+    MatchSim による同じ方針での推定値(検算用)
+    '''
+    rng = yakyuken.RngStreams(seed)
+    pick = random.Random(rng.Derive('pick'))
+    results = defaultdict(int)
+    for _ in range(games):
+        sim = yakyuken.MatchSim(rules, rng)
+        while not sim.is_end:
+            idx = []
+            for side, policy in ((0, player), (1, com)):
+                hand = sim.hands[side]
+                counts = tuple(hand.count(t) for t in CARD_TYPES)
+                rest = Rest(rules, sim, side)
+                opp = Rest(rules, sim, 1 - side)
+                probs = policy.Probs(counts, rest, opp)
+                t = pick.choices(range(3), weights=probs)[0]
+                # その種類の手札から一様に選ぶ
+                slots = [i for i, h in enumerate(hand)
+                         if h == CARD_TYPES[t]]
+                idx.append(pick.choice(slots))
+            sim.Step(*idx)
+        results[sim.Winner()] += 1
+    return {w: v / games for w, v in results.items()}
+
+
+def Rest(rules: yakyuken.Rules, sim: yakyuken.MatchSim, side: int) -> tuple:
+    '''
+    MatchSim の手札と山札から未出カードの枚数を求める
+    '''
+    pile = sim.piles[side]
+    hand = sim.hands[side]
+    return tuple(pile.Count(t) + hand.count(t) for t in CARD_TYPES)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--player', choices=POLICIES, default='random',
+                        help='プレイヤーの方針')
+    parser.add_argument('--com', choices=POLICIES, default='random',
+                        help='COMの方針')
+    parser.add_argument('--rules', default=None,
+                        help='ルール設定ファイル(JSON)')
+    parser.add_argument('--card-num', type=int, default=None,
+                        help='各カードの枚数')
+    parser.add_argument('--hand-max', type=int, default=None,
+                        help='手札の枚数')
+    parser.add_argument('--life-max', type=int, default=None,
+                        help='ライフ最大値')
+    parser.add_argument('--mc', type=int, default=0, metavar='N',
+                        help='MatchSim で N 試合行って推定値と比較する')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='--mc の乱数シード')
+    args = parser.parse_args()
+
+    rules = yakyuken.Rules()
+    if args.rules is not None:
+        rules.Load(args.rules)
+    for name in ('card_num', 'hand_max', 'life_max'):
+        val = getattr(args, name)
+        if val is not None:
+            setattr(rules, name, val)
+    rules.Validate()
+    player = POLICIES[args.player]()
+    com = POLICIES[args.com]()
+
+    start = time.perf_counter()
+    dp = OutcomeDP(rules, player, com).Run()
+    elapsed = time.perf_counter() - start
+
+    print(f'rules: card_num={rules.card_num} hand_max={rules.hand_max} '
+          f'life_max={rules.life_max}  player={args.player} com={args.com}')
+    mc = None
+    if 0 < args.mc:
+        mc = MonteCarlo(rules, player, com, args.mc, args.seed)
+    for winner in (1, -1, 0):
+        line = f'{RESULT_NAMES[winner]:<12}{dp.Result(winner):>12.8f}'
+        if mc is not None:
+            line += f'   MC {mc.get(winner, 0.0):.4f}'
+        print(line)
+
+    print('life diff (player - COM)')
+    for diff, prob in dp.LifeDiff().items():
+        print(f'{diff:>+4d}  {prob:.8f}')
+    print(f'mean turns {dp.MeanTurns():.4f}  total prob '
+          f'{sum(dp.outcomes.values()):.12f}')
+    print(f'{dp.states} states in {elapsed:.2f}s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
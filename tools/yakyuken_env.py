@@ -0,0 +1,230 @@
+'''
+COM戦略の学習用 ベクトル化対戦環境
+
+N 試合分の状態を NumPy 配列で持ち、reset() / step(actions) で
+まとめて進める。ルールは yakyuken の Deck.HandDrow / App.IsEnd と同じ。
+    - 山札は種類ごとの残り枚数で持ち、残り枚数に比例して引く
+    - 出したカードを抜いて左詰めし、右端に山札から1枚補充する
+    - どちらかのライフが0、またはどちらかの山札が0で決着
+    - 決着した試合は自動で reset する
+
+相手(COM)は Deck.RandomPick と同じく手札から一様ランダムに選ぶ。
+
+    env = VecEnv(4096, seed=0)
+    obs = env.reset()
+    obs, reward, done, info = env.step(actions)
+'''
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import yakyuken  # noqa: E402
+
+# カード種類の番号 (0: G, 1: C, 2: P)
+CARD_TYPES = (yakyuken.GU, yakyuken.CH, yakyuken.PA)
+EMPTY = -1
+
+PLAYER = 0
+COM = 1
+
+
+def Judge(pt: np.ndarray, ct: np.ndarray) -> np.ndarray:
+    '''
+    じゃんけんの勝負判定(1: プレイヤー勝ち, 0: あいこ, -1: 負け)
+    G(0) > C(1) > P(2) > G(0) なので (ct - pt) % 3 で判定できる
+    '''
+    d = (ct.astype(np.int8) - pt.astype(np.int8)) % 3
+    return np.where(d == 1, 1, np.where(d == 2, -1, 0)).astype(np.int8)
+
+
+class VecEnv:
+    '''
+    ベクトル化対戦環境クラス
+
+    観測 (dict):
+        hand        (N, H)  プレイヤーの手札 (0: G, 1: C, 2: P, -1: 空き)
+        hand_counts (N, 3)  プレイヤーの手札の種類ごとの枚数
+        deck_counts (N, 3)  プレイヤーの山札の残り枚数 (Deck.DeckCount)
+        com_played  (N, 3)  COMがこれまでに出したカードの枚数
+        lives       (N, 2)  ライフ (プレイヤー, COM)
+        action_mask (N, H)  選択可能な手札
+    行動:
+        (N,) 出す手札の位置
+    報酬:
+        App.Battle の結果 (1: 勝ち, 0: あいこ, -1: 負け)
+    '''
+    def __init__(self, num_envs: int, rules: yakyuken.Rules = None,
+                 seed: int = None):
+        self.num_envs = num_envs
+        self.rules = rules if rules is not None else yakyuken.RULES
+        self.rng = np.random.default_rng(seed)
+
+        n = num_envs
+        h = self.rules.hand_max
+        self.piles = np.zeros((n, 2, 3), dtype=np.int32)
+        self.hands = np.full((n, 2, h), EMPTY, dtype=np.int8)
+        self.hand_len = np.zeros((n, 2), dtype=np.int32)
+        self.lives = np.zeros((n, 2), dtype=np.int32)
+        self.com_played = np.zeros((n, 3), dtype=np.int32)
+        self.turn = np.zeros(n, dtype=np.int32)
+
+    def reset(self, mask: np.ndarray = None) -> dict:
+        '''
+        試合を初期化して観測を返す(mask 指定時はその試合だけ)
+        '''
+        if mask is None:
+            mask = np.ones(self.num_envs, dtype=bool)
+        idx = np.flatnonzero(mask)
+        if len(idx) == 0:
+            return self.Observe()
+
+        self.piles[idx] = self.rules.card_num
+        self.hands[idx] = EMPTY
+        self.hand_len[idx] = 0
+        self.lives[idx] = self.rules.life_max
+        self.com_played[idx] = 0
+        self.turn[idx] = 0
+        for _ in range(self.rules.hand_max):
+            for side in (PLAYER, COM):
+                self.DrawCard(idx, side)
+        return self.Observe()
+
+    def step(self, actions) -> tuple:
+        '''
+        全試合を1手進める
+        '''
+        actions = np.asarray(actions, dtype=np.int64)
+        if actions.shape != (self.num_envs,):
+            raise ValueError(f'actions must have shape ({self.num_envs},)')
+        if np.any((actions < 0) | (self.hand_len[:, PLAYER] <= actions)):
+            raise ValueError('action selects an empty hand slot')
+
+        rows = np.arange(self.num_envs)
+        # COMは手札から一様ランダムに選ぶ (Deck.RandomPick)
+        com_actions = self.rng.integers(0, self.hand_len[:, COM])
+
+        pt = self.hands[rows, PLAYER, actions]
+        ct = self.hands[rows, COM, com_actions]
+        reward = Judge(pt, ct)
+        np.add.at(self.com_played, (rows, ct), 1)
+
+        # ダメージ
+        self.lives[:, COM] -= reward == 1
+        self.lives[:, PLAYER] -= reward == -1
+        np.maximum(self.lives, 0, out=self.lives)
+        self.turn += 1
+
+        # 決着判定 (App.IsEnd)
+        done = (self.lives <= 0).any(axis=1) \
+            | (self.piles.sum(axis=2) <= 0).any(axis=1)
+
+        # 決着していなければ手札を補充 (Deck.HandDrow)
+        live = np.flatnonzero(~done)
+        self.RemoveCard(live, PLAYER, actions[live])
+        self.RemoveCard(live, COM, com_actions[live])
+        self.DrawCard(live, PLAYER)
+        self.DrawCard(live, COM)
+
+        info = {
+            'com_action': com_actions,
+            'com_card': ct,
+            'winner': self.Winner(done),
+            'turns': self.turn.copy(),
+        }
+        obs = self.reset(done)
+        return obs, reward, done, info
+
+    def Winner(self, done: np.ndarray) -> np.ndarray:
+        '''
+        決着した試合の勝者(1: プレイヤー, -1: COM, 0: 決着なし)
+        '''
+        winner = np.zeros(self.num_envs, dtype=np.int8)
+        winner[self.lives[:, COM] <= 0] = 1
+        winner[self.lives[:, PLAYER] <= 0] = -1
+        winner[~done] = 0
+        return winner
+
+    def RemoveCard(self, idx: np.ndarray, side: int, slot: np.ndarray):
+        '''
+        出したカードを手札から抜いて左詰めする
+        '''
+        if len(idx) == 0:
+            return
+        h = self.rules.hand_max
+        pos = np.arange(h)[None, :]
+        src = pos + (slot[:, None] <= pos)
+        hands = self.hands[idx, side]
+        shifted = np.take_along_axis(hands, np.minimum(src, h - 1), axis=1)
+        shifted[src >= h] = EMPTY
+        self.hands[idx, side] = shifted
+        self.hand_len[idx, side] -= 1
+
+    def DrawCard(self, idx: np.ndarray, side: int):
+        '''
+        山札から1枚引いて手札の右端に加える(山札が無ければ何もしない)
+        '''
+        piles = self.piles[idx, side]
+        total = piles.sum(axis=1)
+        can = (0 < total) & (self.hand_len[idx, side] < self.rules.hand_max)
+        idx = idx[can]
+        if len(idx) == 0:
+            return
+        piles = piles[can]
+        total = total[can]
+
+        # 残り枚数に比例して種類を選ぶ
+        r = self.rng.integers(0, total)
+        cum = np.cumsum(piles, axis=1)
+        card = (cum[:, 0] <= r).astype(np.int8) + (cum[:, 1] <= r)
+        self.piles[idx, side, card] -= 1
+        self.hands[idx, side, self.hand_len[idx, side]] = card
+        self.hand_len[idx, side] += 1
+
+    def Observe(self) -> dict:
+        '''
+        プレイヤーから見える情報
+        '''
+        hand = self.hands[:, PLAYER].copy()
+        hand_counts = np.stack([(hand == t).sum(axis=1) for t in range(3)],
+                               axis=1)
+        mask = np.arange(self.rules.hand_max)[None, :] \
+            < self.hand_len[:, PLAYER, None]
+        return {
+            'hand': hand,
+            'hand_counts': hand_counts,
+            'deck_counts': self.piles[:, PLAYER].copy(),
+            'com_played': self.com_played.copy(),
+            'lives': self.lives.copy(),
+            'action_mask': mask,
+        }
+
+
+def RandomActions(rng: np.random.Generator, obs: dict) -> np.ndarray:
+    '''
+    手札から一様ランダムに選ぶ行動
+    '''
+    return rng.integers(0, obs['action_mask'].sum(axis=1))
+
+
+if __name__ == '__main__':
+    # ランダム同士での処理速度計測
+    env = VecEnv(4096, seed=0)
+    rng = np.random.default_rng(1)
+    obs = env.reset()
+    steps = 200
+    games = 0
+    wins = 0
+    start = time.perf_counter()
+    for _ in range(steps):
+        obs, reward, done, info = env.step(RandomActions(rng, obs))
+        games += int(done.sum())
+        wins += int((info['winner'] == 1).sum())
+    elapsed = time.perf_counter() - start
+    print(f'{env.num_envs * steps / elapsed:,.0f} env steps/sec, '
+          f'{games} games, player win rate {wins / max(1, games):.3f}')
@@ -1,10 +1,20 @@
 import pyxel
 import random
 from enum import Enum
-from math import sqrt
+from math import sqrt, log, pi, cos, sin
 import platform
 import json
 import os
+import argparse
+import hashlib
+import importlib
+import importlib.util
+import multiprocessing
+import atexit
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 
 
 # マウスカーソルの有無を設定するために
@@ -25,23 +35,22 @@ FPS = 60
 GU = pyxel.COLOR_RED            # グー
 CH = pyxel.COLOR_GREEN          # チョキ
 PA = pyxel.COLOR_LIGHT_BLUE     # パー
+CARD_NAMES = {GU: 'G', CH: 'C', PA: 'P'}   # 外部の戦略へ渡す時の名前
 
 # カードの大きさ
 CARD_W = 13.5
 CARD_H = 24
 
-# 各カードの枚数
+# 各カードの枚数(デフォルトルール)
 CARD_NUM = 10
-# 手札の枚数
+# 手札の枚数(デフォルトルール)
 HAND_MAX = 5
 # 手札表示幅
 HAND_W = (CARD_W + 5) * HAND_MAX + 5
 
-# テキスト表示用フォント読み込み
-try:
-    FONT_JP = pyxel.Font('assets/umplus_j10r.bdf')
-except Exception:
-    FONT_JP = None
+# テキスト表示用フォント(リソース読み込み時に読み込む)
+FONT_PATH = 'assets/umplus_j10r.bdf'
+FONT_JP = None
 
 # メッセージボックスの上辺の位置
 MSG_BOX_TOP = WINDOW_HEIGHT - 50
@@ -55,7 +64,7 @@ CTRL_COM = 2
 CARD_OPEN_OFFSET = sqrt(CARD_W)
 CARD_OP_ADD = CARD_OPEN_OFFSET / (FPS / 2)
 
-# ライフ最大値
+# ライフ最大値(デフォルトルール)
 LIFE_MAX = 5
 ONE_LIFE_W = 15
 LIFE_H = 15
@@ -64,6 +73,92 @@ LIFE_W = ONE_LIFE_W * LIFE_MAX + 2
 # ダメージ表現実施時間
 DAMAGE_WAIT = 60
 
+# ルール設定の上限
+# (観戦モード・集計ツールの配列の型と、画面に収まる大きさに合わせる)
+RULES_CARD_MAX = 1000                       # 山札・ターン数が 16bit に収まる
+RULES_HAND_MAX = int((HAND_W - 5) / 2)      # 手札の間隔が 2px 以上
+RULES_LIFE_MAX = int(LIFE_W - 2)            # ライフ1つ分が 1px 以上
+
+# ルール設定ファイル
+RULES_PATH = 'assets/rules.json'
+
+# カードスプライトシート設定
+CARD_SHEET_BANK = 1                 # 使用するイメージバンク
+CARD_COLKEY = pyxel.COLOR_NAVY      # 透明色
+CARD_BACK = -1                      # 裏面を表すキー
+CARD_FLIP_LEVELS = int(CARD_W) + 2  # めくり時の潰れ具合の段階数
+
+# BGM1曲あたりのチャンネル数
+BGM_CH_NUM = 4
+
+# COM立ち絵設定
+PORTRAIT_W = 144
+PORTRAIT_H = 256
+PORTRAIT_CACHE_MAX = 4  # デコード済み画像の保持数
+
+# ギャラリーのサムネイル設定
+THUMB_BANK = 2                          # 縮小画像を焼き込むイメージバンク
+THUMB_SCALE = 8                         # 立ち絵からの縮小率
+THUMB_W = PORTRAIT_W // THUMB_SCALE
+THUMB_H = PORTRAIT_H // THUMB_SCALE
+THUMB_GAP = 4                           # サムネイルの間隔
+
+# アセット
+ASSET_DIR = 'assets'
+PALETTE_PATH = 'assets/Pallet.png'
+ASSET_WATCH_INTERVAL = 30   # 開発モードでの更新確認の間隔(フレーム)
+LOAD_WORKERS = 4            # リソース読み込みのスレッド数
+IDLE_FRAMES = 30            # 動きも入力も無いまま何フレームで待機中とするか
+IDLE_REDRAW_MAX = 60        # 待機中でも最低限描き直す間隔(フレーム)
+# 入力として扱うボタン・キー(ゲームで使うもの全て、待機中の判定用)
+INPUT_KEYS = (pyxel.MOUSE_BUTTON_LEFT, pyxel.KEY_D, pyxel.KEY_H, pyxel.KEY_S)
+QUALITY_MAX = 3             # 画質の段階(この値で全ての演出あり)
+QUALITY_MOTION = 3          # ゆらゆら・矢印の動きを行う画質
+QUALITY_DITHER = 2          # 仮表示をディザで塗る画質
+QUALITY_OUTLINE = 1         # 文字を8方向で縁取りする画質
+QUALITY_PARTICLE = 2        # パーティクルを全て出す画質(未満は1/4)
+QUALITY_DOWN_RATIO = 1.2    # フレーム間隔がこの倍率を超えたら処理落ち
+QUALITY_UP_RATIO = 0.5      # 処理時間がこの倍率を下回ったら余裕あり
+QUALITY_DOWN_FRAMES = 30    # 処理落ちが続いたら画質を下げるフレーム数
+QUALITY_UP_FRAMES = 180     # 余裕が続いたら画質を上げるフレーム数
+
+# COMの思考
+COM_RANDOM = 'random'           # 手札から一様ランダム
+COM_UCB = 'ucb'                 # 原始モンテカルロ(手の選択だけ UCB1)
+COM_THINK_PLAYOUTS = 2000       # 1手あたりの試行回数の上限
+COM_THINK_STEP = 64             # 1フレームあたりの試行回数の上限
+COM_THINK_BUDGET = 0.003        # 1フレームあたりの探索時間の上限(秒)
+COM_UCB_C = 1.4                 # UCB1 の探索係数
+COM_STRATEGY_DEADLINE = 0.2     # 外部の戦略の1手あたりの制限時間(秒)
+COM_STRATEGY_HANG = 2.0         # この時間返らない戦略は止まっているとみなす
+COM_STRATEGY_START_MAX = 10.0   # 戦略モジュールの読み込みを待つ時間(秒)
+COM_STRATEGY_RESTART_MAX = 3    # 戦略のプロセスが続けて落ちたら諦める回数
+
+# 観戦モード
+SPECTATE_NUM = 16               # 並べる試合数
+SPECTATE_STEP = 20              # 1手進める間隔(フレーム)
+SPECTATE_END_WAIT = 90          # 決着を表示しておく時間(フレーム)
+SPECTATE_STATUS_INTERVAL = 30   # 処理時間表示の更新間隔(フレーム)
+
+# パーティクル
+PARTICLE_MAX = 4096             # 同時に出せる最大数(確保する配列の大きさ)
+PARTICLE_BUDGET = 0.002         # 更新・描画にかけてよい時間(秒/フレーム)
+PARTICLE_DAMAGE = 160           # キャラクタのダメージ1回で出す火花の数
+PARTICLE_GAUGE = 40             # ライフゲージが減る時に出す数
+PARTICLE_WIN = 1200             # 勝った時の紙吹雪の数
+PARTICLE_LOSE = 400             # 負けた時に出す数
+
+# 縁取りテキストの描画キャッシュ
+LABEL_CACHE_MAX = 64    # 保持するラベル画像の数
+LABEL_H = 13            # ラベル画像の高さ(文字 + 上下の縁取り)
+
+# 対戦途中のスナップショット
+SNAPSHOT_VERSION = 3
+SNAPSHOT_VENDOR = 'nakatsup3'
+SNAPSHOT_APP = 'yakyuken'
+SNAPSHOT_FILE = 'snapshot.json'
+SNAPSHOT_KEY = 'yakyuken_snapshot'  # Web版の localStorage のキー
+
 
 class DeviceChecker:
     '''
@@ -103,6 +198,8 @@ class GameState(Enum):
     END = 6         # 
     END_WAIT = 7    #
     GALLARY = 8     #
+    LOADING = 9     # リソース読み込み中
+    SPECTATE = 10   # 観戦モード(COM vs COM を並べて表示)
 
 class CardState(Enum):
     '''
@@ -138,86 +235,2059 @@ class MsgState(Enum):
     DISPLAYING = 1  # メッセージ表示中
 
 
-class ObjectBase:
+class Rules:
     '''
-    いろんなオブジェクトのペース
+    ゲームルール設定クラス
     '''
-    def __init__(self, x: float, y: float,
-                 w: float, h: float):
-        self.x = x
-        self.y = y
-        self.w = w
-        self.h = h
-        self.is_mouse_over = False
+    def __init__(self, card_num: int = CARD_NUM,
+                 hand_max: int = HAND_MAX, life_max: int = LIFE_MAX):
+        self.card_num = card_num    # 各カードの枚数
+        self.hand_max = hand_max    # 手札の枚数
+        self.life_max = life_max    # ライフ最大値
+        self.Validate()
+
+    def Load(self, path: str) -> 'Rules':
+        '''
+        JSONファイルからルールを読み込む
+        '''
+        with open(path, 'rt', encoding='utf-8') as fin:
+            data = json.loads(fin.read())
+        self.card_num = data.get('card_num', self.card_num)
+        self.hand_max = data.get('hand_max', self.hand_max)
+        self.life_max = data.get('life_max', self.life_max)
+        self.Validate()
+        return self
+
+    def Validate(self):
+        '''
+        設定値チェック
+        '''
+        limits = {'card_num': RULES_CARD_MAX, 'hand_max': RULES_HAND_MAX,
+                  'life_max': RULES_LIFE_MAX}
+        for name, limit in limits.items():
+            val = getattr(self, name)
+            if not isinstance(val, int) or val <= 0:
+                raise ValueError(f'{name} must be a positive int: {val}')
+            if limit < val:
+                raise ValueError(f'{name} must be {limit} or less: {val}')
+
+    def HandPitch(self) -> float:
+        '''
+        手札1枚あたりの表示間隔(手札表示幅に収める)
+        '''
+        return min(CARD_W + 5, (HAND_W - 5) / self.hand_max)
 
-    def IsOverMouse(self) -> bool:
+    def OneLifeWidth(self) -> float:
         '''
-        オブジェクト上にマウスがあるか？
+        ライフ1つ分のゲージ幅
         '''
-        return self.x < pyxel.mouse_x < self.x + self.w \
-            and self.y < pyxel.mouse_y < self.y + self.h
+        return (LIFE_W - 2) / self.life_max
 
-    def LineRect(self, inner_color: int, outer_color: int):
+
+# 現在のルール
+RULES = Rules()
+
+
+class RunOption:
+    '''
+    実行オプション(早送り・自動対戦)
+    '''
+    def __init__(self):
+        self.fast = False       # 演出を最小にする
+        self.turbo = 1          # 1フレームあたりの update 回数
+        self.draw_every = 1     # 何フレームごとに描画するか
+        self.autoplay = False   # プレイヤー側も自動で選ぶ(COM vs COM)
+        self.dev = False        # アセットの更新を監視して読み直す
+        self.trace = None       # Chrome trace の出力先
+        self.com = COM_RANDOM   # COMの思考方法
+        self.com_deadline = COM_STRATEGY_DEADLINE  # 戦略の1手の制限時間(秒)
+        self.com_fixed = False  # COMの探索を時間でなく回数で区切る(再現用)
+        self.hint = False       # 手札に勝率のヒントを表示する
+        self.matches = 0        # 自動対戦で終了するまでの試合数(0: 無制限)
+        self.spectate = 0       # 起動時に観戦モードにする試合数(0: しない)
+
+    def Wait(self, frames: int) -> int:
         '''
-        枠線のある四角を描画
+        演出の待ち時間(早送り中は1フレーム)
         '''
-        pyxel.rectb(self.x, self.y, self.w, self.h, outer_color)
-        pyxel.rect(self.x + 1, self.y + 1, self.w - 2, self.h - 2, inner_color)
+        return 1 if self.fast else frames
 
-    def TextWidth(self, txt: str) -> int:
+
+# 現在の実行オプション
+OPTION = RunOption()
+
+
+class QualityGovernor:
+    '''
+    実際のフレーム時間に合わせて演出の画質を切り替えるクラス
+
+    draw の呼び出し間隔(フレーム時間)と、update/draw にかかった時間を
+    計測する。フレーム時間が予算(1/FPS)を超え続けたら画質を1段階下げ、
+    処理時間に余裕がある状態が続いたら1段階上げる。
+    下げる判定は短く、上げる判定は長くしてバタつかないようにし、
+    上げてすぐ下がった場合は次に上げるまでの待ちを倍にする。
+    '''
+    def __init__(self):
+        self.enabled = True     # --quality で固定した場合は無効
+        self.active = False     # pyxel.run で動かしている時だけ計測する
+        self.level = QUALITY_MAX
+        self.last = None        # 前回の draw の開始時刻
+        self.work = 0.0         # 前回の draw から update/draw にかかった時間
+        self.interval = None    # フレーム時間(指数移動平均)
+        self.cost = None        # 処理時間(指数移動平均)
+        self.over = 0           # 処理落ちが続いているフレーム数
+        self.under = 0          # 余裕がある状態が続いているフレーム数
+        self.up_frames = QUALITY_UP_FRAMES
+        self.since_up = None    # 画質を上げてからのフレーム数
+
+    def Start(self):
         '''
-        文字列の幅を計算
+        計測を開始(早送り中は負荷が変わるので計測しない)
         '''
-        if FONT_JP is not None:
-            return FONT_JP.text_width(txt)
+        self.active = self.enabled and OPTION.turbo == 1 \
+            and OPTION.draw_every == 1
+
+    def AddWork(self, sec: float):
+        '''
+        update にかかった時間を加える
+        '''
+        self.work += sec
+
+    def Sample(self, start: float, end: float):
+        '''
+        draw 1回分の計測結果から画質を判定
+        '''
+        if not self.active:
+            return
+        self.work += end - start
+        last = self.last
+        self.last = start
+        work = self.work
+        self.work = 0.0
+        if last is None:
+            return
+
+        # 一瞬の遅れ(GCなど)で切り替わらないよう平均をとる
+        interval = start - last
+        if self.interval is None:
+            self.interval, self.cost = interval, work
+        self.interval += (interval - self.interval) * 0.1
+        self.cost += (work - self.cost) * 0.1
+        if self.since_up is not None:
+            self.since_up += 1
+
+        budget = 1 / FPS
+        if budget * QUALITY_DOWN_RATIO < self.interval:
+            self.over += 1
+            self.under = 0
+        elif self.cost < budget * QUALITY_UP_RATIO:
+            self.over = 0
+            self.under += 1
         else:
-            return len(txt) * 4
+            self.over = 0
+            self.under = 0
+
+        if QUALITY_DOWN_FRAMES <= self.over and 0 < self.level:
+            # 上げた直後に下がるなら次に上げるまでの待ちを延ばす
+            if self.since_up is not None and self.since_up < self.up_frames:
+                self.up_frames *= 2
+            self.Change(self.level - 1)
+            self.since_up = None
+        elif self.up_frames <= self.under and self.level < QUALITY_MAX:
+            self.Change(self.level + 1)
+            self.since_up = 0
+
+    def Change(self, level: int):
+        '''
+        画質を切り替える
+        '''
+        self.level = level
+        self.over = 0
+        self.under = 0
+        # 切り替え前の計測値は使わない
+        self.interval = None
 
-    def DrawTextCenter(self, y: float, s: str,
-                       col: int, bcol: int = None):
+    def Fix(self, level: int):
         '''
-        縁取りテキスト描画中央寄せ
+        画質を固定する(計測しない)
         '''
-        # 中央寄せ
-        x = (pyxel.width / 2) - (self.TextWidth(s) / 2)
-        self.DrawText(x, y, s, col, bcol)
+        self.level = level
+        self.enabled = False
 
-    def DrawText(self, x: float,  y: float, s: str,
-                 col: int, bcol: int = None):
+    def Motion(self) -> bool:
+        '''
+        ゆらゆら・矢印の動きを行うか？
+        '''
+        return QUALITY_MOTION <= self.level
+
+    def Dither(self) -> bool:
+        '''
+        仮表示をディザで塗るか？
+        '''
+        return QUALITY_DITHER <= self.level
+
+    def Outline(self) -> bool:
+        '''
+        文字を8方向で縁取りするか？(しない場合は影だけ)
+        '''
+        return QUALITY_OUTLINE <= self.level
+
+    def Particles(self) -> bool:
+        '''
+        パーティクルを全て出すか？(出さない場合は1/4)
+        '''
+        return QUALITY_PARTICLE <= self.level
+
+
+# 現在の画質
+QUALITY = QualityGovernor()
+
+
+class SnapshotStore:
+    '''
+    対戦途中のスナップショットの保存先
+
+    ローカルでは pyxel.user_data_dir のファイル、
+    Web版ではブラウザの localStorage に1つだけ保存する。
+    '''
+    def __init__(self):
+        self.enabled = True     # 自動対戦・ツールからの実行時は保存しない
+        self.path = None
+        self.exists = None
+
+    def Path(self) -> str:
+        '''
+        保存先ファイル(初回に作成)
+        '''
+        if self.path is None:
+            data_dir = pyxel.user_data_dir(SNAPSHOT_VENDOR, SNAPSHOT_APP)
+            self.path = os.path.join(data_dir, SNAPSHOT_FILE)
+        return self.path
+
+    def Exists(self) -> bool:
+        '''
+        保存済みのスナップショットがあるか？
+        '''
+        if self.exists is None:
+            self.exists = self.Read() is not None
+        return self.exists
+
+    def Read(self) -> str:
+        '''
+        スナップショットを読み込む(無ければ None)
+        '''
+        if not self.enabled:
+            return None
+        try:
+            if is_web_launcher:
+                from js import localStorage
+                return localStorage.getItem(SNAPSHOT_KEY)
+            with open(self.Path(), 'rt', encoding='utf-8') as fin:
+                return fin.read()
+        except Exception:
+            return None
+
+    def Write(self, text: str):
+        '''
+        スナップショットを書き込む
+        '''
+        if not self.enabled:
+            return
+        try:
+            if is_web_launcher:
+                from js import localStorage
+                localStorage.setItem(SNAPSHOT_KEY, text)
+            else:
+                # 書き込み途中で落ちても壊れないよう置き換える
+                tmp = self.Path() + '.tmp'
+                with open(tmp, 'wt', encoding='utf-8') as fout:
+                    fout.write(text)
+                os.replace(tmp, self.Path())
+            self.exists = True
+        except Exception:
+            pass
+
+    def Delete(self):
+        '''
+        スナップショットを削除
+        '''
+        self.exists = False
+        if not self.enabled:
+            return
+        try:
+            if is_web_launcher:
+                from js import localStorage
+                localStorage.removeItem(SNAPSHOT_KEY)
+            elif os.path.exists(self.Path()):
+                os.remove(self.Path())
+        except Exception:
+            pass
+
+
+# スナップショットの保存先
+SNAPSHOTS = SnapshotStore()
+
+
+class RngStreams:
+    '''
+    用途ごとに独立した乱数列
+
+    1つのマスターシードから名前ごとのシードをハッシュで導出するので、
+    どれかの用途で乱数を引く回数が変わっても他の用途の乱数列は変わらない。
+        deck:   山札から引くカード
+        com:    COM(自動対戦時はプレイヤーも)の手札選択
+        motion: キャラクタの揺れなど見た目だけの動き
+        particle: パーティクル(出す数が処理時間で変わるので他と分ける)
+    Spawn(i) は i だけで決まる子の乱数列を作るので、並列実行時に
+    i 番目の試合をどのワーカーで処理しても同じ結果になる。
+    '''
+    NAMES = ('deck', 'com', 'motion', 'particle')
+
+    def __init__(self, seed: int = None):
+        self.seed = None
+        self.deck = random.Random()
+        self.com = random.Random()
+        self.motion = random.Random()
+        self.particle = random.Random()
+        self.Seed(seed)
+
+    def Seed(self, seed: int = None):
+        '''
+        マスターシードを設定して全ての乱数列を初期化する
+        (None の場合はOSの乱数から決める)
+        '''
+        if seed is None:
+            seed = int.from_bytes(os.urandom(8), 'little')
+        self.seed = seed
+        # 乱数列のオブジェクトは作り直さない(参照を持っている側があるため)
+        self.seeds = {}
+        for name in self.NAMES:
+            self.seeds[name] = self.Derive(name)
+            getattr(self, name).seed(self.seeds[name])
+
+    def Derive(self, name: str) -> int:
+        '''
+        マスターシードと名前から64bitのシードを導出
+        '''
+        key = f'{self.seed}/{name}'.encode('utf-8')
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+
+    def Spawn(self, index: int) -> 'RngStreams':
+        '''
+        index 番目の子の乱数列を作成
+        '''
+        return RngStreams(self.Derive(f'spawn/{index}'))
+
+    def Reseed(self):
+        '''
+        各乱数列を自分の出力した64bitで再シードする(ターンの区切りで呼ぶ)
+
+        乱数列の内部状態(1つ2.5KB)をそのまま保存すると重いので、
+        区切りごとにシードから作り直し、スナップショットにはシードだけを
+        保存する。スナップショットを取るかどうかに関係なく呼ぶので、
+        保存の有無で乱数列は変わらない。
+        '''
+        for name in self.NAMES:
+            rng = getattr(self, name)
+            self.seeds[name] = rng.getrandbits(64)
+            rng.seed(self.seeds[name])
+
+    def Checkpoint(self) -> dict:
+        '''
+        最後に再シードした時のシード(スナップショット用、状態は変えない)
+        '''
+        return dict(self.seeds)
+
+    def Restore(self, state: dict):
+        '''
+        Checkpoint の時点(最後の再シード直後)の状態に戻す
+        '''
+        for name in self.NAMES:
+            self.seeds[name] = state[name]
+            getattr(self, name).seed(state[name])
+
+
+# ゲーム本体の乱数列
+RNG = RngStreams()
+
+
+class CardPile:
+    '''
+    山札クラス
+
+    カードの並びは持たず、種類ごとの残り枚数だけを保持する。
+    引くときに残り枚数に比例してランダムに選ぶので
+    シャッフル済みの山札の上から引くのと同じ確率になる。
+    '''
+    def __init__(self, g: int, c: int, p: int, rng: random.Random = None):
+        self.counts = {GU: g, CH: c, PA: p}
+        self.total = g + c + p
+        self.rng = rng if rng is not None else RNG.deck
+
+    def __len__(self) -> int:
+        return self.total
+
+    def Count(self, type: int) -> int:
+        '''
+        指定した種類の残り枚数
+        '''
+        return self.counts[type]
+
+    def Draw(self) -> int:
+        '''
+        山札から1枚引く
+        '''
+        r = self.rng.randrange(self.total)
+        for type, cnt in self.counts.items():
+            if r < cnt:
+                self.counts[type] = cnt - 1
+                self.total -= 1
+                return type
+            r -= cnt
+        raise IndexError('draw from empty pile')
+
+
+def Janken(pt: int, ct: int) -> int:
+    '''
+    じゃんけんの勝負判定(1: プレイヤー勝ち, 0: あいこ, -1: 負け)
+    '''
+    # あいこ
+    if pt == ct:
+        return 0
+
+    # プレイヤーの勝ちパターン
+    if pt == GU and ct == CH:
+        return 1
+    if pt == CH and ct == PA:
+        return 1
+    if pt == PA and ct == GU:
+        return 1
+
+    # それ以外は負け
+    return -1
+
+
+class MatchSim:
+    '''
+    画面を使わない対戦処理クラス(シミュレーション用)
+
+    手札の補充・勝負判定・決着判定は Deck, App と同じ順序で行う。
+    '''
+    def __init__(self, rules: Rules = None, rng: RngStreams = None,
+                 deal: bool = True):
+        self.rules = rules if rules is not None else RULES
+        self.rng = rng if rng is not None else RNG
+        n = self.rules.card_num
+        self.piles = [CardPile(n, n, n, self.rng.deck),
+                      CardPile(n, n, n, self.rng.deck)]
+        self.hands = [[], []]
+        # deal=False の場合は呼び出し側で手札・山札を設定する
+        for side in range(2 if deal else 0):
+            for _ in range(self.rules.hand_max):
+                if 0 < len(self.piles[side]):
+                    self.hands[side].append(self.piles[side].Draw())
+        self.lives = [self.rules.life_max, self.rules.life_max]
+        self.turn = 0
+        self.is_end = False     # 最後の勝負で決着したか
+
+    def Step(self, p_idx: int, c_idx: int) -> int:
+        '''
+        お互いに手札を1枚出して勝負する
+        '''
+        result = Janken(self.hands[0][p_idx], self.hands[1][c_idx])
+        if 0 < result:
+            self.lives[1] = max(0, self.lives[1] - 1)
+        if result < 0:
+            self.lives[0] = max(0, self.lives[0] - 1)
+        self.turn += 1
+
+        # 決着していなければ手札を補充
+        # (補充で山札が尽きても、次の勝負までは決着しない: App と同じ)
+        self.is_end = self.IsEnd()
+        if not self.is_end:
+            for side, idx in ((0, p_idx), (1, c_idx)):
+                self.hands[side].pop(idx)
+                if 0 < len(self.piles[side]):
+                    self.hands[side].append(self.piles[side].Draw())
+        return result
+
+    def IsEnd(self) -> bool:
+        '''
+        決着がついたか？
+        '''
+        if self.lives[0] <= 0 or self.lives[1] <= 0:
+            return True
+        return len(self.piles[0]) <= 0 or len(self.piles[1]) <= 0
+
+    def Winner(self) -> int:
+        '''
+        勝者(1: プレイヤー, -1: COM, 0: 決着なし)
+        '''
+        if self.lives[0] <= 0:
+            return -1
+        if self.lives[1] <= 0:
+            return 1
+        return 0
+
+
+class ComView:
+    '''
+    COMから見える対戦の情報
+
+    COMが知っているのは自分の手札と山札の残り枚数、
+    プレイヤーが出したカード、お互いの手札・山札の枚数とライフ。
+    プレイヤーの手札と山札の中身は「まだ出ていないプレイヤーのカード」
+    としてまとめてしか分からない。
+    '''
+    def __init__(self, app: 'App'):
+        com = app.com.deck
+        player = app.player.deck
+        self.hand = [h.type for h in com.hands]
+        g, c, p = com.DeckCount()
+        self.com_pile = (g, c, p)
+        n = RULES.card_num
+        unseen = {GU: n, CH: n, PA: n}
+        for pt, _, _ in app.history:
+            unseen[pt] -= 1
+        self.player_unseen = unseen
+        self.player_hand_num = len(player.hands)
+        self.lives = (app.player.life.life, app.com.life.life)
+        self.history = list(app.history)
+
+    def Dict(self) -> dict:
+        '''
+        外部の戦略へ渡す形(カードは 'G', 'C', 'P' の名前、組み込み型だけ)
+        '''
+        def counts(d: dict) -> dict:
+            return {CARD_NAMES[t]: n for t, n in d.items()}
+        return {
+            'hand': [CARD_NAMES[t] for t in self.hand],
+            'com_pile': counts(dict(zip((GU, CH, PA), self.com_pile))),
+            'player_unseen': counts(self.player_unseen),
+            'player_hand_num': self.player_hand_num,
+            'lives': {'player': self.lives[0], 'com': self.lives[1]},
+            'history': [(CARD_NAMES[pt], CARD_NAMES[ct], result)
+                        for pt, ct, result in self.history],
+            'rules': {'card_num': RULES.card_num,
+                      'hand_max': RULES.hand_max,
+                      'life_max': RULES.life_max},
+        }
+
+
+class ComSearch:
+    '''
+    COM用、フレームをまたいで少しずつ進める原始モンテカルロ探索
+
+    プレイヤーの手札をまだ出ていないカードから無作為に決めて(決定化)、
+    COMの手ごとに最後までランダムに対戦した結果を UCB1 で集計する。
+    木は作らず、UCB1 で選ぶのは最初の手(根)だけ。
+    Think 1回(1フレーム)で COM_THINK_BUDGET 秒まで、最大 COM_THINK_STEP 回
+    進め、1手あたり COM_THINK_PLAYOUTS 回で止める。
+    プレイヤーが手を決めたら、その時点までの結果で Best を返す。
+    OPTION.com_fixed (シード指定・早送り時) の場合は時間で打ち切らず、
+    COM_THINK_STEP 回ずつ進めて COM_THINK_PLAYOUTS 回終わるまで手を出さない。
+    (処理速度によらず同じシードなら同じ手になる)
+    Best で一番試行回数の多い手を返す。
+    '''
+    def __init__(self, c: float = COM_UCB_C):
+        self.c = c
+        self.view = None
+        self.rng = random.Random()
+        self.visits = []
+        self.wins = []
+        self.total = 0
+
+    def Start(self, view: ComView):
+        '''
+        探索を始める
+        '''
+        self.view = view
+        self.rng.seed(RNG.com.getrandbits(64))
+        self.visits = [0] * len(view.hand)
+        self.wins = [0.0] * len(view.hand)
+        self.total = 0
+
+    def Stop(self):
+        '''
+        探索を終える
+        '''
+        self.view = None
+
+    def IsActive(self) -> bool:
+        '''
+        探索中か？
+        '''
+        return self.view is not None
+
+    def IsReady(self) -> bool:
+        '''
+        手を出せるか？(回数固定の場合は決まった回数の試行が終わったか)
+        '''
+        return not OPTION.com_fixed or not self.visits \
+            or COM_THINK_PLAYOUTS <= self.total
+
+    def Think(self):
+        '''
+        探索を1フレーム分進める(COM_THINK_BUDGET 秒まで)
+        '''
+        if self.view is None or not self.visits:
+            return
+        end = min(COM_THINK_PLAYOUTS, self.total + COM_THINK_STEP)
+        if OPTION.com_fixed:
+            while self.total < end:
+                self.Iterate()
+            return
+        limit = time.perf_counter() + COM_THINK_BUDGET
+        while self.total < end and time.perf_counter() < limit:
+            self.Iterate()
+
+    def Best(self) -> int:
+        '''
+        現時点で一番良い手(手札の位置)
+        '''
+        if not self.visits or self.total == 0:
+            return self.rng.randrange(max(1, len(self.visits)))
+        return max(range(len(self.visits)), key=self.visits.__getitem__)
+
+    def Iterate(self):
+        '''
+        1回分の試行
+        '''
+        # UCB1 で試す手を選ぶ(未試行の手を優先)
+        idx = -1
+        best = -1.0
+        log_total = log(self.total) if 0 < self.total else 0.0
+        for i, n in enumerate(self.visits):
+            if n == 0:
+                idx = i
+                break
+            score = self.wins[i] / n + self.c * sqrt(log_total / n)
+            if best < score:
+                best = score
+                idx = i
+        self.wins[idx] += self.Rollout(idx)
+        self.visits[idx] += 1
+        self.total += 1
+
+    def Rollout(self, idx: int) -> float:
+        '''
+        決定化した局面で COM が idx を出し、あとはランダムに最後まで対戦
+        (COMから見て 勝ち: 1, 決着なし: 0.5, 負け: 0)
+        '''
+        view = self.view
+        rng = self.rng
+        sim = MatchSim(deal=False)
+        # プレイヤーの手札を未出のカードから無作為に選び、残りを山札にする
+        pool = CardPile(view.player_unseen[GU], view.player_unseen[CH],
+                        view.player_unseen[PA], rng)
+        hand = [pool.Draw() for _ in range(view.player_hand_num)]
+        sim.piles = [pool, CardPile(*view.com_pile, rng)]
+        sim.hands = [hand, list(view.hand)]
+        sim.lives = list(view.lives)
+
+        p_idx = rng.randrange(len(hand))
+        sim.Step(p_idx, idx)
+        while not sim.is_end:
+            sim.Step(rng.randrange(len(sim.hands[0])),
+                     rng.randrange(len(sim.hands[1])))
+        return (1 - sim.Winner()) / 2
+
+
+def LoadStrategy(spec: str):
+    '''
+    戦略モジュールを読み込む(.py のパス、またはモジュール名)
+    '''
+    if spec.endswith('.py') or os.sep in spec or '/' in spec:
+        mod_spec = importlib.util.spec_from_file_location('com_strategy', spec)
+        if mod_spec is None:
+            raise ImportError(f'cannot load strategy: {spec}')
+        mod = importlib.util.module_from_spec(mod_spec)
+        mod_spec.loader.exec_module(mod)
+    else:
+        mod = importlib.import_module(spec)
+    if not callable(getattr(mod, 'choose', None)):
+        raise ImportError(f'strategy has no choose(view): {spec}')
+    return mod
+
+
+def StrategyExists(spec: str) -> bool:
+    '''
+    戦略モジュールが見つかるか？(読み込みはしない、コマンドライン引数の確認用)
+    '''
+    if spec.endswith('.py') or os.sep in spec or '/' in spec:
+        return os.path.isfile(spec)
+    try:
+        return importlib.util.find_spec(spec) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def StrategyWorker(spec: str, conn):
+    '''
+    戦略のプロセスの処理
+    (seq, 手札の位置, エラー) を返す。seq 0 は準備完了、-1 は読み込み失敗
+    '''
+    try:
+        choose = LoadStrategy(spec).choose
+    except Exception as e:
+        conn.send((-1, None, f'{type(e).__name__}: {e}'))
+        return
+    conn.send((0, None, None))
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            return
+        if msg is None:
+            return
+        seq, view = msg
+        try:
+            idx = int(choose(view))
+            err = None
+        except Exception as e:
+            idx = None
+            err = f'{type(e).__name__}: {e}'
+        conn.send((seq, idx, err))
+
+
+class ComStrategy:
+    '''
+    COM用、外部の戦略モジュールで手を決めるクラス
+
+    戦略モジュールは choose(view: dict) -> int (手札の位置) を持つ。
+    view は ComView.Dict() の形(手札・山札の残り・ライフ・対戦履歴)。
+    戦略は別プロセスで動かし、結果はフレームごとに待たずに確認するだけなので
+    重い・止まる・例外を出す戦略でも App.update は止まらない。
+    制限時間までに手が届かなければランダムに出す。
+    前の手をまだ考えている間は新しい手を頼まず、前の手の結果が届いた時点で
+    頼む(制限時間に間に合わなければランダム)。
+    COM_STRATEGY_HANG を過ぎても返らなければプロセスを作り直す。
+    (モジュールの読み込みも別プロセスで行う)
+    ComSearch と同じく Start / Think / Best / Stop で使う。
+    '''
+    def __init__(self, spec: str, deadline: float = COM_STRATEGY_DEADLINE):
+        self.spec = spec
+        self.deadline = deadline
+        self.proc = None
+        self.conn = None
+        self.enabled = True
+        self.ready = False      # 戦略モジュールの読み込みが終わったか
+        self.opened = 0.0       # プロセスを起動した時刻
+        self.seq = 0
+        self.waiting = False    # 頼んだ手の結果待ちか
+        self.sent = 0.0         # 頼んだ時刻
+        self.asked = 0          # 頼んだ手の番号(decisions)
+        self.answered = 0       # 結果が届いた手の番号
+        self.view = None
+        self.result = None
+        self.limit = 0.0
+        self.crashes = 0        # 続けてプロセスを作り直した回数
+        self.decisions = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.error = None       # 最後のエラー・停止の理由(trace・デバッグ表示用)
+        self.Open()
+
+    def Open(self):
+        '''
+        戦略のプロセスを起動
+        '''
+        self.ready = False
+        self.waiting = False
+        self.opened = time.perf_counter()
+        try:
+            ctx = multiprocessing.get_context('spawn')
+            self.conn, child = ctx.Pipe()
+            self.proc = ctx.Process(target=StrategyWorker,
+                                    args=(self.spec, child), daemon=True)
+            self.proc.start()
+            child.close()
+        except (OSError, ValueError, ImportError, RuntimeError,
+                NotImplementedError) as e:
+            # プロセス非対応環境(Web launcher など)
+            self.Disable(str(e))
+
+    def Close(self):
+        '''
+        戦略のプロセスを止める
+        '''
+        if self.proc is not None:
+            if self.proc.is_alive():
+                self.proc.kill()
+            self.proc.join(1)
+            self.proc = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def Disable(self, reason: str):
+        '''
+        戦略を使うのをやめる(以降はランダム)
+        '''
+        self.error = f'disabled: {reason}'
+        self.Close()
+        self.enabled = False
+
+    def Restart(self):
+        '''
+        戦略のプロセスを作り直す(繰り返す場合は諦める)
+        '''
+        self.Close()
+        self.crashes += 1
+        self.error = f'restarted: {self.spec}'
+        if COM_STRATEGY_RESTART_MAX <= self.crashes:
+            self.Disable(f'{self.spec} keeps failing')
+            return
+        self.Open()
+
+    def Poll(self):
+        '''
+        届いている結果を受け取る(待たない)
+        '''
+        try:
+            while self.enabled and self.conn.poll():
+                seq, idx, err = self.conn.recv()
+                if seq < 0:
+                    self.Disable(err)
+                elif seq == 0:
+                    self.ready = True
+                elif seq == self.seq:
+                    self.Answer(idx, err)
+        except (EOFError, OSError):
+            # プロセスが落ちた
+            self.Restart()
+        # 前の手の結果待ち・起動待ちで頼めなかった今の手をすぐ頼む
+        if self.enabled and self.ready and not self.waiting \
+                and self.view is not None and self.asked != self.decisions:
+            self.Send()
+
+    def Answer(self, idx: int, err: str):
+        '''
+        頼んだ手の結果を受け取る(前の手の結果なら使わない)
+        '''
+        self.waiting = False
+        self.crashes = 0
+        self.answered = self.asked
+        if err is not None:
+            self.errors += 1
+            self.error = err
+        elif self.asked != self.decisions or self.view is None:
+            pass
+        elif 0 <= idx < len(self.view.hand):
+            self.result = idx
+        else:
+            self.errors += 1
+
+    def Start(self, view: ComView):
+        '''
+        手を考え始める
+        '''
+        now = time.perf_counter()
+        self.view = view
+        self.result = None
+        self.decisions += 1
+        self.limit = now + self.deadline
+        if self.enabled:
+            self.Poll()
+        if not self.enabled:
+            return
+        if not self.ready:
+            if COM_STRATEGY_START_MAX < now - self.opened:
+                self.Disable(f'{self.spec} did not start')
+            return
+        if self.waiting:
+            # 前の手をまだ考えている(結果が届いたら Poll で頼む)
+            if COM_STRATEGY_HANG < now - self.sent:
+                self.Restart()
+            return
+        self.Send()
+
+    def Send(self):
+        '''
+        今の手を頼む
+        '''
+        self.seq += 1
+        try:
+            self.conn.send((self.seq, self.view.Dict()))
+        except (OSError, ValueError):
+            self.Restart()
+            return
+        self.waiting = True
+        self.sent = time.perf_counter()
+        self.asked = self.decisions
+
+    def Stop(self):
+        '''
+        手を決め終える(結果が後から届いても使わない)
+        '''
+        self.view = None
+
+    def IsActive(self) -> bool:
+        '''
+        思考中か？
+        '''
+        return self.view is not None
+
+    def IsReady(self) -> bool:
+        '''
+        手を出せるか？(結果が届いた・制限時間を過ぎた・戦略が使えない)
+        '''
+        self.Poll()
+        return not self.enabled or self.answered == self.decisions \
+            or self.limit <= time.perf_counter()
+
+    def Think(self):
+        '''
+        結果が届いていないか確認する(考えるのは別プロセス)
+        '''
+        self.Poll()
+
+    def Best(self) -> int:
+        '''
+        戦略の手、届いていなければランダムな手(手札の位置)
+        '''
+        if self.result is not None:
+            return self.result
+        if self.enabled and self.answered != self.decisions:
+            self.timeouts += 1
+        return RNG.com.randrange(max(1, len(self.view.hand)))
+
+
+class HintTable:
+    '''
+    手札ごとの勝ち・あいこ・負け確率のテーブル
+
+    COMの手札は「まだ出ていないCOMのカード」からの無作為な組み合わせで、
+    COMはその手札から一様に1枚選ぶ。このとき種類 t が出る確率は
+    手札の組み合わせごとの確率を足し合わせる代わりに、
+    超幾何分布の期待値 E[手札中の t の枚数] / 手札枚数 で置き換えられ、
+    未出のカードに占める t の割合と一致する。
+    そのため未出カードの枚数だけを持ち、COMのカードが公開されるたびに
+    差分更新して確率と表示用のバー幅をキャッシュする。
+
+    この置き換えは COM が手札から一様に選ぶ(COM_RANDOM)場合だけ成り立つ。
+    ucb や戦略モジュールは手札や状況を見て選ぶので確率が合わず、
+    その場合は表示しない(IsAvailable)。
+    '''
+    def __init__(self):
+        self.unseen = {}
+        self.table = {}
+        self.bars = {}
+        self.Reset()
+
+    def Reset(self):
+        '''
+        試合開始時の状態に戻す
+        '''
+        n = RULES.card_num
+        self.unseen = {GU: n, CH: n, PA: n}
+        self.Build()
+
+    def Reveal(self, type: int):
+        '''
+        COMが出したカードを反映
+        '''
+        if 0 < self.unseen[type]:
+            self.unseen[type] -= 1
+            self.Build()
+
+    def Build(self):
+        '''
+        確率と表示用のバー幅を計算
+        '''
+        total = sum(self.unseen.values())
+        w = int(CARD_W)
+        for pt in (GU, CH, PA):
+            prob = [0.0, 0.0, 0.0]     # 勝ち, あいこ, 負け
+            for ct, cnt in self.unseen.items():
+                if 0 < total:
+                    prob[1 - Janken(pt, ct)] += cnt / total
+            self.table[pt] = tuple(prob)
+            win_w = round(w * prob[0])
+            drow_w = round(w * (prob[0] + prob[1])) - win_w
+            self.bars[pt] = (win_w, drow_w, w - win_w - drow_w)
+
+    @staticmethod
+    def IsAvailable() -> bool:
+        '''
+        ヒントの確率が正しいか(COMが一様ランダムに選ぶ場合だけ)
+        '''
+        return OPTION.com == COM_RANDOM
+
+    def Probability(self, type: int) -> tuple[float, float, float]:
+        '''
+        手札の種類ごとの (勝ち, あいこ, 負け) の確率
+        '''
+        return self.table[type]
+
+    def Draw(self, card):
+        '''
+        カードの下に勝ち(緑)・あいこ(灰)・負け(赤)のバーを描画
+        '''
+        win_w, drow_w, lose_w = self.bars[card.type]
+        x = card.x
+        y = card.y + card.h + 2
+        if 0 < win_w:
+            pyxel.rect(x, y, win_w, 2, pyxel.COLOR_GREEN)
+        if 0 < drow_w:
+            pyxel.rect(x + win_w, y, drow_w, 2, pyxel.COLOR_GRAY)
+        if 0 < lose_w:
+            pyxel.rect(x + win_w + drow_w, y, lose_w, 2, pyxel.COLOR_RED)
+
+
+class LabelCache:
+    '''
+    縁取りテキストの描画キャッシュ
+
+    (文字列, 文字色, 縁取り色) ごとに縁取り済みの画像を作っておき、
+    描画は blt 1回で済ませる。文字列が変わった時だけ新しく作り、
+    古いものから捨てる。文字列の幅もここで覚えておく。
+    表示途中のメッセージのようにすぐ変わる文字列は DrawDirect で描き、
+    キャッシュには入れない(決まった文字列を追い出さないように)。
+    画質を下げている間は縁取りの代わりに右下の影だけを描く。
+    '''
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # (文字列, 文字色, 縁取り色, 縁取りするか) -> ラベル
+        self.labels = OrderedDict()
+        self.widths = OrderedDict()     # 文字列 -> 幅
+
+    def Clear(self):
+        '''
+        キャッシュを全て破棄(フォントの変更時)
+        '''
+        self.labels.clear()
+        self.widths.clear()
+
+    def Width(self, txt: str) -> int:
+        '''
+        文字列の幅(計算済みならそれを返す)
+        '''
+        w = self.widths.get(txt)
+        if w is not None:
+            self.widths.move_to_end(txt)
+            return w
+        if FONT_JP is not None:
+            w = FONT_JP.text_width(txt)
+        else:
+            w = len(txt) * 4
+        self.widths[txt] = w
+        if self.max_size < len(self.widths):
+            self.widths.popitem(last=False)
+        return w
+
+    def Get(self, txt: str, col: int, bcol: int) -> tuple:
+        '''
+        ラベル (画像, 透明色) を取得(無ければ作る)
+        '''
+        outline = QUALITY.Outline()
+        key = (txt, col, bcol, outline)
+        label = self.labels.get(key)
+        if label is not None:
+            self.labels.move_to_end(key)
+            return label
+        label = self.Render(txt, col, bcol, outline)
+        self.labels[key] = label
+        if self.max_size < len(self.labels):
+            self.labels.popitem(last=False)
+        return label
+
+    def Render(self, txt: str, col: int, bcol: int,
+               outline: bool = True) -> tuple:
+        '''
+        縁取りテキストを画像に描く
+        '''
+        # 文字色・縁取り色と被らない色を透明色にする
+        colkey = next(c for c in range(3) if c != col and c != bcol)
+        img = pyxel.Image(self.Width(txt) + 2, LABEL_H)
+        img.cls(colkey)
+        if outline:
+            for dx in range(3):
+                for dy in range(3):
+                    if dx != 1 or dy != 1:
+                        img.text(dx, dy, txt, bcol, FONT_JP)
+        else:
+            img.text(2, 2, txt, bcol, FONT_JP)
+        img.text(1, 1, txt, col, FONT_JP)
+        return img, colkey
+
+    def Draw(self, x: float, y: float, txt: str, col: int, bcol: int):
+        '''
+        縁取りテキスト描画
+        '''
+        if not txt:
+            return
+        img, colkey = self.Get(txt, col, bcol)
+        pyxel.blt(x - 1, y - 1, img, 0, 0, img.width, img.height, colkey)
+
+    def DrawDirect(self, x: float, y: float, txt: str, col: int, bcol: int):
+        '''
+        縁取りテキストをキャッシュせずに画面へ直接描画
+        (表示途中のメッセージなど、すぐに変わる文字列用)
+        '''
+        if not txt:
+            return
+        if QUALITY.Outline():
+            for dx in range(-1, 2):
+                for dy in range(-1, 2):
+                    if dx != 0 or dy != 0:
+                        pyxel.text(x + dx, y + dy, txt, bcol, FONT_JP)
+        else:
+            pyxel.text(x + 1, y + 1, txt, bcol, FONT_JP)
+        pyxel.text(x, y, txt, col, FONT_JP)
+
+
+LABELS = LabelCache(LABEL_CACHE_MAX)
+
+
+class ObjectBase:
+    '''
+    いろんなオブジェクトのペース
+    '''
+    def __init__(self, x: float, y: float,
+                 w: float, h: float):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.is_mouse_over = False
+
+    def IsOverMouse(self) -> bool:
+        '''
+        オブジェクト上にマウスがあるか？
+        '''
+        return self.x < pyxel.mouse_x < self.x + self.w \
+            and self.y < pyxel.mouse_y < self.y + self.h
+
+    def LineRect(self, inner_color: int, outer_color: int):
+        '''
+        枠線のある四角を描画
+        '''
+        pyxel.rectb(self.x, self.y, self.w, self.h, outer_color)
+        pyxel.rect(self.x + 1, self.y + 1, self.w - 2, self.h - 2, inner_color)
+
+    def TextWidth(self, txt: str) -> int:
+        '''
+        文字列の幅を計算
+        '''
+        return LABELS.Width(txt)
+
+    def DrawTextCenter(self, y: float, s: str,
+                       col: int, bcol: int = None):
+        '''
+        縁取りテキスト描画中央寄せ
+        '''
+        # 中央寄せ
+        x = (pyxel.width / 2) - (self.TextWidth(s) / 2)
+        self.DrawText(x, y, s, col, bcol)
+
+    def DrawText(self, x: float,  y: float, s: str,
+                 col: int, bcol: int = None):
+        '''
+        縁取りテキスト描画
+        '''
+        if bcol is None:
+            bcol = pyxel.COLOR_BLACK
+
+        # アウトライン描画済みの画像を貼るだけ
+        LABELS.Draw(x, y, s, col, bcol)
+
+    def MusicRead(self, bgm_path: str) -> any:
+        if os.path.exists(bgm_path):
+            with open(bgm_path, "rt", encoding="utf-8") as fin:
+                return json.loads(fin.read())
+        else:
+            return None
+
+    def BGMLoad(self, music, slot: int) -> int:
+        '''
+        BGMを専用のサウンド・ミュージックスロットへ事前に変換する
+        '''
+        if music is None:
+            return None
+
+        # 曲ごとにサウンドスロットを BGM_CH_NUM 個ずつ予約
+        seqs = []
+        for ch, sound in enumerate(music[:BGM_CH_NUM]):
+            snd = slot * BGM_CH_NUM + ch
+            pyxel.sounds[snd].set(*sound)
+            seqs.append([snd])
+        pyxel.musics[slot].set(*seqs)
+        return slot
+
+    def BGMChange(self, music: int):
+        '''
+        BGM変更
+        '''
+        # 全チャンネルBGM　OFF
+        pyxel.stop()
+        self.current_bgm = music
+        if music is None:
+            return
+
+        # 変換済みのスロットを再生するだけ
+        pyxel.playm(music, loop=True)
+
+
+class CardSheet:
+    '''
+    カード描画用スプライトシート
+
+    小さいカード・大きいカードの各面(G/C/P/裏)とハイライト、
+    めくり中の潰れたフレームを起動時に1度だけイメージバンクへ焼き込む。
+    各フレームは (u, v, w, h, dx, dy) で保持し、
+    dx, dy はカード左上からの描画オフセット。
+    '''
+    def __init__(self):
+        self.small = {}
+        self.big = {}
+        self.is_built = False
+
+    def Build(self):
+        '''
+        スプライトシート作成
+        '''
+        self.img = pyxel.images[CARD_SHEET_BANK]
+        self.img.cls(CARD_COLKEY)
+        self.u = 0
+        self.v = 0
+        self.row_h = 0
+
+        faces = [GU, CH, PA, CARD_BACK]
+        # 対決用の大きいカード(めくりフレーム込み)
+        for face in faces:
+            for level in range(CARD_FLIP_LEVELS):
+                self.big[face, level] = \
+                    self.Bake(CARD_W * 2, CARD_H * 2, face, level, False)
+        # 手札用の小さいカード(通常・ハイライト)
+        for face in faces:
+            for highlight in (False, True):
+                self.small[face, highlight] = \
+                    self.Bake(CARD_W, CARD_H, face, 0, highlight)
+        self.is_built = True
+
+    def Bake(self, w: float, h: float, face: int,
+             level: int, highlight: bool) -> tuple:
+        '''
+        カード1枚分をシートへ描画し、フレーム情報を返す
+        '''
+        offset = min(level, w / 2)
+        txt = self.FaceText(face)
+        txt_x = w / 2 - 3
+        txt_w = FONT_JP.text_width(txt) if FONT_JP is not None \
+            else len(txt) * 4
+
+        # 描画範囲(カード左上からの相対位置)
+        left = int(min(offset, txt_x) - 1)
+        right = int(max(w - offset, txt_x + txt_w) + 2)
+        top = -1
+        bottom = int(h) + 1
+        cw = right - left
+        ch = bottom - top
+
+        # 空いている位置へ詰めて配置
+        if 256 < self.u + cw:
+            self.u = 0
+            self.v += self.row_h
+            self.row_h = 0
+        u = self.u
+        v = self.v
+        self.u += cw
+        self.row_h = max(self.row_h, ch)
+
+        # シート上のカード原点
+        x = u - left
+        y = v - top
+        img = self.img
+        color = pyxel.COLOR_PURPLE if face == CARD_BACK else face
+        if offset * 2 < w:
+            img.rect(x + offset, y, w - (offset * 2), h, pyxel.COLOR_GRAY)
+            img.rect(x + 1 + offset, y + 1,
+                     w - 2 - (offset * 2), h - 2, color)
+        # 縁取りテキスト
+        for dx in range(-1, 2):
+            for dy in range(-1, 2):
+                if dx != 0 or dy != 0:
+                    img.text(x + txt_x + dx, y + h / 2 - 4 + dy, txt,
+                             pyxel.COLOR_BLACK, FONT_JP)
+        img.text(x + txt_x, y + h / 2 - 4, txt, pyxel.COLOR_WHITE, FONT_JP)
+        if highlight:
+            img.rectb(x - 1, y - 1, w + 2, h + 2, pyxel.COLOR_WHITE)
+        return (u, v, cw, ch, left, top)
+
+    def FaceText(self, face: int) -> str:
+        '''
+        カードの柄
+        '''
+        if face == GU:
+            return 'G'
+        elif face == CH:
+            return 'C'
+        elif face == PA:
+            return 'P'
+        return '?'
+
+    def Draw(self, x: float, y: float, frame: tuple):
+        '''
+        フレームを1回のbltで描画
+        '''
+        u, v, w, h, dx, dy = frame
+        pyxel.blt(x + dx, y + dy, CARD_SHEET_BANK, u, v, w, h, CARD_COLKEY)
+
+
+# カードスプライトシート(リソース読み込み時に作成)
+CARD_SHEET = CardSheet()
+
+
+class PortraitCache:
+    '''
+    COM立ち絵の読み込み・キャッシュクラス
+
+    読み込み予約した立ち絵を pyxel.Image.load でフレームごとに1枚ずつ
+    メインスレッドで読み込む。(pyxel.Image は生成したスレッドでしか
+    扱えず、ネイティブの読み込みは1枚1ms程度なのでスレッドは使わない)
+    読み込んだ画像はLRUで保持数を制限し、破棄した画像は
+    使い回して pyxel.Image の生成を保持数分だけに抑える。
+    読み込んだ立ち絵は縮小してイメージバンク(THUMB_BANK)へ焼き込み、
+    ギャラリーのサムネイルとして使う。(PNGを読み直さずに済むように)
+    '''
+    def __init__(self, cache_max: int):
+        self.cache_max = cache_max
+        self.paths = []
+        self.images = OrderedDict()
+        self.free = []      # 使い回し用の画像
+        self.ptrs = {}      # 画像ごとのピクセルデータ(data_ptr)
+        self.pending = []
+        self.thumbs = set()     # サムネイル作成済みの立ち絵
+        self.thumb_only = set()  # サムネイルのためだけに読み込む立ち絵
+        self.thumb_ptr = None
+
+    def Scan(self):
+        '''
+        立ち絵ファイルを連番で探す
+        '''
+        self.paths = []
+        while True:
+            img_path = f'assets/{len(self.paths):04}.png'
+            if not os.path.exists(img_path):
+                break
+            self.paths.append(img_path)
+
+    def Count(self) -> int:
+        '''
+        立ち絵の枚数
+        '''
+        return len(self.paths)
+
+    def Get(self, idx: int) -> pyxel.Image:
+        '''
+        読み込み済みの立ち絵を取得、無ければ読み込み予約してNoneを返す
+        '''
+        img = self.images.get(idx)
+        if img is not None:
+            self.images.move_to_end(idx)
+            return img
+        self.Request(idx)
+        return None
+
+    def Prefetch(self, idx: int):
+        '''
+        表示中の立ち絵と前後の立ち絵を先読み
+        '''
+        for i in (idx, idx + 1, idx - 1):
+            self.Request(i)
+
+    def Request(self, idx: int):
+        '''
+        読み込みを予約
+        '''
+        if not (0 <= idx < len(self.paths)):
+            return
+        # 表示に使うのでキャッシュに残す
+        self.thumb_only.discard(idx)
+        if idx in self.images or idx in self.pending:
+            return
+        self.Enqueue(idx)
+
+    def Invalidate(self, idx: int):
+        '''
+        立ち絵を読み直す(元ファイルの更新時)
+        読み直しが終わるまでは古い画像を表示する
+        '''
+        if not (0 <= idx < len(self.paths)):
+            return
+        if idx in self.pending:
+            # まだ読み込んでいないので更新後のファイルが読まれる
+            return
+        if idx in self.images:
+            self.Enqueue(idx)
+        else:
+            # サムネイルだけ残っている場合は次の RequestThumbs で作り直す
+            self.thumbs.discard(idx)
+
+    def InvalidateAll(self):
+        '''
+        読み込み済みの立ち絵を全て読み直す(パレットの更新時)
+        '''
+        # 読み直さない立ち絵のサムネイルは作り直しが必要
+        self.thumbs &= set(self.images) | set(self.pending)
+        for idx in list(self.images) + self.pending:
+            self.Invalidate(idx)
+
+    def RequestThumbs(self, indices: list):
+        '''
+        サムネイルが無い立ち絵の読み込みを予約
+        (表示中の立ち絵をキャッシュから追い出さないよう、縮小後は破棄する)
+        '''
+        for idx in indices:
+            if not (0 <= idx < len(self.paths)) or idx in self.thumbs:
+                continue
+            if idx in self.images or idx in self.pending:
+                continue
+            self.thumb_only.add(idx)
+            self.Enqueue(idx)
+
+    def HasThumb(self, idx: int) -> bool:
+        '''
+        サムネイル作成済みか？
+        '''
+        return idx in self.thumbs
+
+    def ThumbPos(self, idx: int) -> tuple:
+        '''
+        イメージバンク上のサムネイルの位置(入りきらない場合は None)
+        '''
+        cols = 256 // THUMB_W
+        u = idx % cols * THUMB_W
+        v = idx // cols * THUMB_H
+        if 256 < v + THUMB_H:
+            return None
+        return u, v
+
+    def BakeThumb(self, idx: int, img: pyxel.Image):
+        '''
+        立ち絵を縮小(各区画の中央の画素)してイメージバンクへ書き込む
+        '''
+        pos = self.ThumbPos(idx)
+        if pos is None:
+            return
+        if self.thumb_ptr is None:
+            self.thumb_ptr = pyxel.images[THUMB_BANK].data_ptr()
+        src = self.ImagePtr(img)
+        dst = self.thumb_ptr
+        u, v = pos
+        half = THUMB_SCALE // 2
+        for ty in range(THUMB_H):
+            row = (ty * THUMB_SCALE + half) * PORTRAIT_W + half
+            line = src[row:row + THUMB_W * THUMB_SCALE:THUMB_SCALE]
+            o = (v + ty) * 256 + u
+            dst[o:o + THUMB_W] = line
+        self.thumbs.add(idx)
+
+    def ImagePtr(self, img: pyxel.Image):
+        '''
+        画像のピクセルデータ
+        (data_ptr は呼ぶたびにメモリを確保するので画像ごとに保持)
+        '''
+        ptr = self.ptrs.get(id(img))
+        if ptr is None:
+            ptr = img.data_ptr()
+            self.ptrs[id(img)] = ptr
+        return ptr
+
+    def Enqueue(self, idx: int):
+        '''
+        読み込み待ちに追加
+        '''
+        self.pending.append(idx)
+
+    def update(self):
+        '''
+        データ更新(予約された立ち絵を1枚読み込む)
+        '''
+        if not self.pending:
+            return
+        idx = self.pending[0]
+        img = self.NewImage()
+        try:
+            img.load(x=0, y=0, filename=self.paths[idx])
+        except Exception:
+            self.free.append(img)
+            img = None
+        self.Store(idx, img)
+
+    def NewImage(self) -> pyxel.Image:
+        '''
+        破棄済みの画像を使い回し、無ければ作成
+        '''
+        if self.free:
+            return self.free.pop()
+        return pyxel.Image(PORTRAIT_W, PORTRAIT_H)
+
+    def Store(self, idx: int, img: pyxel.Image):
+        '''
+        読み込み結果を保持し、古いものから破棄する
+        '''
+        if idx in self.pending:
+            self.pending.remove(idx)
+        if img is None:
+            self.thumb_only.discard(idx)
+            return
+        self.BakeThumb(idx, img)
+        if idx in self.thumb_only:
+            # サムネイルだけ必要だったのでキャッシュには入れない
+            self.thumb_only.discard(idx)
+            self.free.append(img)
+            return
+        old = self.images.get(idx)
+        if old is not None and old is not img:
+            self.free.append(old)
+        self.images[idx] = img
+        self.images.move_to_end(idx)
+        while self.cache_max < len(self.images):
+            _, old = self.images.popitem(last=False)
+            self.free.append(old)
+
+
+# COM立ち絵のキャッシュ
+PORTRAITS = PortraitCache(PORTRAIT_CACHE_MAX)
+
+
+class ParticlePool:
+    '''
+    パーティクル(火花・紙吹雪)の管理クラス
+
+    位置・速度・重力・寿命・色・大きさを項目ごとの配列(array)として
+    最大数分だけ最初に確保し、生きているものを先頭から count 個に詰めて持つ。
+    消えたものは末尾と入れ替えるので、出す時も消す時もメモリを確保しない。
+    update / draw はそれぞれ1回のループで全てまとめて処理する。
+    1個あたりの処理時間を計測しておき、1フレームの処理時間が
+    PARTICLE_BUDGET に収まる数までしか出さない。
+    '''
+    def __init__(self, num: int):
+        self.num = num
+        self.x = array('f', [0.0]) * num
+        self.y = array('f', [0.0]) * num
+        self.vx = array('f', [0.0]) * num
+        self.vy = array('f', [0.0]) * num
+        self.g = array('f', [0.0]) * num
+        self.life = array('h', [0]) * num
+        self.col = array('b', [0]) * num
+        self.size = array('b', [0]) * num
+        self.count = 0
+        self.budget = PARTICLE_BUDGET  # 処理時間の上限(None: 最大数まで)
+        self.dropped = 0        # 上限を超えて出さなかった数
+        self.cost = 0.0         # 1個あたりの更新+描画時間(秒)
+        self.update_time = 0.0
+        self.draw_time = 0.0
+
+    def Capacity(self) -> int:
+        '''
+        処理時間の上限に収まる数
+        '''
+        if self.budget is None or self.cost <= 0:
+            return self.num
+        return min(self.num, int(self.budget / self.cost))
+
+    def Reserve(self, num: int) -> int:
+        '''
+        これから出す数を画質と上限に合わせて減らす
+        '''
+        if not QUALITY.Particles():
+            num //= 4
+        room = max(0, self.Capacity() - self.count)
+        if room < num:
+            self.dropped += num - room
+            num = room
+        return num
+
+    def Add(self, x: float, y: float, vx: float, vy: float, g: float,
+            life: int, col: int, size: int):
+        '''
+        1個追加(空きがあることは呼び出し側で確認済み)
+        '''
+        i = self.count
+        self.x[i] = x
+        self.y[i] = y
+        self.vx[i] = vx
+        self.vy[i] = vy
+        self.g[i] = g
+        self.life[i] = life
+        self.col[i] = col
+        self.size[i] = size
+        self.count = i + 1
+
+    def Burst(self, x: float, y: float, num: int, cols: tuple,
+              speed: float, life: int, g: float = 0.12):
+        '''
+        1点から全方向へ飛び散らせる
+        '''
+        rnd = RNG.particle.random
+        for _ in range(self.Reserve(num)):
+            a = rnd() * 2 * pi
+            v = speed * (0.3 + rnd() * 0.7)
+            self.Add(x, y, cos(a) * v, sin(a) * v - speed / 2, g,
+                     int(life * (0.5 + rnd() * 0.5)),
+                     cols[int(rnd() * len(cols))], 1)
+
+    def Rain(self, num: int, cols: tuple, life: int, g: float = 0.01):
+        '''
+        画面の上から降らせる(出る時間は少しずつずらす)
+        '''
+        rnd = RNG.particle.random
+        for _ in range(self.Reserve(num)):
+            self.Add(rnd() * pyxel.width, -rnd() * pyxel.height / 2,
+                     rnd() - 0.5, 0.5 + rnd(), g,
+                     life, cols[int(rnd() * len(cols))], 2)
+
+    def Clear(self):
+        self.count = 0
+
+    def update(self):
+        '''
+        データ更新(寿命が尽きたもの・画面の下へ出たものは末尾と入れ替え)
+        '''
+        n = self.count
+        if n == 0:
+            return
+        start = time.perf_counter()
+        x, y, vx, vy, g = self.x, self.y, self.vx, self.vy, self.g
+        life, col, size = self.life, self.col, self.size
+        bottom = pyxel.height + 4
+        i = 0
+        while i < n:
+            t = life[i] - 1
+            py = y[i] + vy[i]
+            if t <= 0 or bottom < py:
+                n -= 1
+                x[i] = x[n]
+                y[i] = y[n]
+                vx[i] = vx[n]
+                vy[i] = vy[n]
+                g[i] = g[n]
+                life[i] = life[n]
+                col[i] = col[n]
+                size[i] = size[n]
+                continue
+            life[i] = t
+            x[i] += vx[i]
+            y[i] = py
+            vy[i] += g[i]
+            i += 1
+        self.update_time = time.perf_counter() - start
+        self.Measure(self.count)
+        self.count = n
+
+    def draw(self):
+        '''
+        描画(1個につき pset か rect 1回)
+        '''
+        n = self.count
+        if n == 0:
+            return
+        start = time.perf_counter()
+        x, y, col, size = self.x, self.y, self.col, self.size
+        pset = pyxel.pset
+        rect = pyxel.rect
+        for i in range(n):
+            s = size[i]
+            if s == 1:
+                pset(x[i], y[i], col[i])
+            else:
+                rect(x[i], y[i], s, s, col[i])
+        self.draw_time = time.perf_counter() - start
+        self.Measure(n)
+
+    def Measure(self, n: int):
+        '''
+        1個あたりの処理時間を更新(数が少ない時は誤差が大きいので使わない)
+        '''
+        if n < 64:
+            return
+        cost = (self.update_time + self.draw_time) / n
+        if self.cost <= 0:
+            self.cost = cost
+        else:
+            self.cost += (cost - self.cost) * 0.1
+
+
+# 演出用パーティクル
+PARTICLES = ParticlePool(PARTICLE_MAX)
+
+
+class Tracer:
+    '''
+    演出の待ち時間を確認するための Chrome trace 出力クラス
+
+    update 1回ごとに App の状態を見て、GameState の遷移と
+    各演出(カード移動・COMのめくり・ライフ減少・メッセージ表示・
+    wait のカウントダウン)の期間を記録する。
+    時刻は update の回数から求めたゲーム内の時間(1フレーム = 1/FPS 秒)。
+    演出ごとに別のトラックにするので、重なっている演出が一目で分かる。
+    出力は chrome://tracing や Perfetto で開ける。
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.tick = 0
+        self.events = []
+        self.tracks = {}    # トラック名 -> tid
+        self.starts = {}    # 実行中の期間のトラック名 -> (開始時刻, 名前)
+        self.state = None
+        self.wait = None
+        self.com_error = None
+
+    def Time(self) -> float:
+        '''
+        現在のゲーム内時間(マイクロ秒)
+        '''
+        return self.tick * 1000000 / FPS
+
+    def Track(self, name: str) -> int:
+        '''
+        トラック名から tid を取得(初めての場合は名前を登録)
+        '''
+        tid = self.tracks.get(name)
+        if tid is None:
+            tid = len(self.tracks) + 1
+            self.tracks[name] = tid
+            self.events.append({'name': 'thread_name', 'ph': 'M',
+                                'pid': 1, 'tid': tid,
+                                'args': {'name': name}})
+        return tid
+
+    def Span(self, track: str, name: str, active: bool):
+        '''
+        期間の開始・終了を記録
+        '''
+        started = self.starts.get(track)
+        if active and started is None:
+            self.starts[track] = (self.Time(), name)
+        elif not active and started is not None:
+            del self.starts[track]
+            start, name = started
+            self.events.append({'name': name, 'ph': 'X', 'ts': start,
+                                'dur': self.Time() - start, 'pid': 1,
+                                'tid': self.Track(track)})
+
+    def Sample(self, app: 'App'):
+        '''
+        update 1回分の状態を記録
+        '''
+        self.tick += 1
+
+        # GameState の遷移
+        if app.game_sate != self.state:
+            self.Span('GameState', None, False)
+            self.state = app.game_sate
+            self.events.append({'name': self.state.name, 'ph': 'i',
+                                's': 'g', 'ts': self.Time(), 'pid': 1,
+                                'tid': self.Track('GameState')})
+            self.Span('GameState', self.state.name, True)
+
+        # COMの戦略モジュールのエラー・停止
+        error = getattr(app.com_ai, 'error', None)
+        if error is not None and error != self.com_error:
+            self.events.append({'name': error, 'ph': 'i', 's': 't',
+                                'ts': self.Time(), 'pid': 1,
+                                'tid': self.Track('COM strategy')})
+        self.com_error = error
+
+        # 各演出
+        for side, player in (('Player', app.player), ('COM', app.com)):
+            deck = player.deck
+            moving = any(h.state == CardState.MOVING for h in deck.hands)
+            sel = deck.selected_card
+            if sel is not None and sel.state == CardState.MOVING:
+                moving = True
+            self.Span(f'{side} card slide', 'card slide', moving)
+            self.Span(f'{side} life drain', 'life drain',
+                      player.life.state == LifeState.DECRASE)
+            self.Span(f'{side} damage shake', 'damage shake',
+                      player.chara.state == CharaState.DAMAGE)
+        sel = app.com.deck.selected_card
+        self.Span('COM flip', 'COM flip',
+                  sel is not None and sel.state == CardState.ROTATION)
+        self.Span('Message typing', 'message typing',
+                  app.msg_box.state == MsgState.DISPLAYING)
+        # wait が減っている間
+        counting = self.wait is not None and app.wait < self.wait
+        self.Span('Wait', 'wait', counting)
+        self.wait = app.wait
+
+    def Write(self):
+        '''
+        実行中の期間を閉じてファイルへ出力
+        '''
+        for track in list(self.starts):
+            self.Span(track, None, False)
+        with open(self.path, 'wt', encoding='utf-8') as fout:
+            fout.write(json.dumps({'traceEvents': self.events,
+                                   'displayTimeUnit': 'ms'}))
+
+
+class IdleDetector:
+    '''
+    待機中(演出・入力・メッセージ表示が無い状態)の検出クラス
+
+    待機中は画面に見える位置(キャラクタのゆらゆら、ギャラリーの矢印)が
+    ピクセル単位で変わった時だけ描き直し、それ以外の描画を省く。
+    入力があればそのフレームから毎フレームの描画に戻る。
+    '''
+    def __init__(self):
+        self.quiet = 0          # 動きも入力も無いフレーム数
+        self.mouse = None       # 前回のマウス座標
+        self.state = None       # 前回の GameState
+        self.wait = None        # 前回の待ち時間
+        self.view = None        # 最後に描画した時の見た目
+        self.skipped = 0        # 描画を省いたフレーム数
+
+    def IsInput(self) -> bool:
+        '''
+        入力があったか？(マウス移動・ホイール・INPUT_KEYS のボタン・キー)
+        '''
+        mouse = (pyxel.mouse_x, pyxel.mouse_y)
+        moved = self.mouse is not None and mouse != self.mouse
+        self.mouse = mouse
+        return moved or pyxel.mouse_wheel != 0 \
+            or any(pyxel.btn(key) for key in INPUT_KEYS)
+
+    def IsBusy(self, app: 'App') -> bool:
+        '''
+        演出中か？
+        '''
+        if OPTION.autoplay or not app.loader.IsDone() or PORTRAITS.pending:
+            return True
+        if PARTICLES.count:
+            return True
+        if app.game_sate in (GameState.LOADING, GameState.TITLE,
+                             GameState.GALLARY, GameState.SPECTATE):
+            return app.game_sate in (GameState.LOADING, GameState.SPECTATE)
+        if app.msg_box.state != MsgState.WAIT:
+            return True
+        for player in (app.player, app.com):
+            if player.life.state != LifeState.WAIT \
+                    or player.chara.state != CharaState.WAIT:
+                return True
+            deck = player.deck
+            sel = deck.selected_card
+            if sel is not None and sel.state != CardState.WAIT:
+                return True
+            if any(h.state != CardState.WAIT for h in deck.hands):
+                return True
+        return False
+
+    def Sample(self, app: 'App'):
+        '''
+        update 後の状態から待機中かを更新
+        '''
+        # 読み込み中(DefineVariables の前)は常に描き直す
+        if GameState.LOADING == app.game_sate:
+            self.state = app.game_sate
+            self.quiet = 0
+            return
+        changed = app.game_sate != self.state or app.wait != self.wait
+        self.state = app.game_sate
+        self.wait = app.wait
+        if self.IsInput() or changed or self.IsBusy(app):
+            self.quiet = 0
+        else:
+            self.quiet += 1
+
+    def IsIdle(self) -> bool:
+        '''
+        待機中か？
+        '''
+        return IDLE_FRAMES <= self.quiet
+
+    def View(self, app: 'App') -> tuple:
+        '''
+        待機中に動くものの描画位置
+        '''
+        view = (int(app.com.chara.x), int(app.com.chara.y),
+                int(app.player.chara.x), int(app.player.chara.y))
+        if GameState.GALLARY == app.game_sate:
+            view += (int(app.gal_arw_l.x), int(app.gal_arw_r.x),
+                     int(app.gal_strip.scroll), app.gal_strip.current,
+                     len(PORTRAITS.thumbs))
+        return view
+
+    def NeedDraw(self, app: 'App') -> bool:
+        '''
+        描き直しが必要か？
+        '''
+        if not self.IsIdle() or GameState.LOADING == app.game_sate:
+            self.view = None
+            return True
+        view = self.View(app)
+        if view != self.view or IDLE_REDRAW_MAX <= self.skipped:
+            self.view = view
+            self.skipped = 0
+            return True
+        self.skipped += 1
+        return False
+
+
+class LoadTask:
+    '''
+    リソース読み込みの1単位
+
+    read はスレッドプールで実行するファイル読み込み・解析処理(無くても良い)、
+    apply は read の結果を受け取ってメインスレッドで行う処理。
+    (pyxel のオブジェクトは作ったスレッドでしか扱えないため分ける)
+    '''
+    def __init__(self, name: str, read, apply):
+        self.name = name
+        self.read = read
+        self.apply = apply
+        self.future = None
+
+
+class Loader:
+    '''
+    リソース読み込みクラス
+
+    各タスクの read をスレッドプールで並列に実行し、
+    apply は登録順に1フレームに1つずつ実行する。
+    (登録順が依存関係の順番になる。読み込み中も画面を更新できる)
+    スレッドが使えない環境(Web launcher)では read もメインスレッドで行う。
+    '''
+    def __init__(self):
+        self.tasks = []
+        self.done = 0
+        self.executor = None
+        self.error = None
+
+    def Add(self, name: str, read, apply):
+        '''
+        タスクを登録
+        '''
+        self.tasks.append(LoadTask(name, read, apply))
+
+    def Start(self):
+        '''
+        read の並列実行を開始
+        '''
+        try:
+            self.executor = ThreadPoolExecutor(max_workers=LOAD_WORKERS)
+            for task in self.tasks:
+                if task.read is not None:
+                    task.future = self.executor.submit(task.read)
+        except RuntimeError:
+            # スレッド非対応環境
+            self.executor = None
+            for task in self.tasks:
+                task.future = None
+
+    def Step(self):
+        '''
+        次のタスクの read が終わっていれば apply を1つ実行
+        '''
+        if self.IsDone() or self.error is not None:
+            return
+        task = self.tasks[self.done]
+        try:
+            if task.read is None:
+                data = None
+            elif task.future is None:
+                data = task.read()
+            elif task.future.done():
+                data = task.future.result()
+            else:
+                return
+            task.apply(data)
+        except Exception as e:
+            self.error = e
+            self.Shutdown()
+            return
+        self.done += 1
+        if self.IsDone():
+            self.Shutdown()
+
+    def RunAll(self):
+        '''
+        全てのタスクをその場で実行する(ツール用)
+        '''
+        while not self.IsDone() and self.error is None:
+            self.Step()
+
+    def Shutdown(self):
+        '''
+        スレッドプールを終了
+        '''
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def IsDone(self) -> bool:
+        '''
+        全て読み込んだか？
+        '''
+        return len(self.tasks) <= self.done
+
+    def Progress(self) -> float:
         '''
-        縁取りテキスト描画
+        進み具合(0.0 - 1.0)
         '''
-        if bcol is None:
-            bcol = pyxel.COLOR_BLACK
+        if not self.tasks:
+            return 1.0
+        return self.done / len(self.tasks)
 
-        # アウトライン描画
-        for dx in range(-1, 2):
-            for dy in range(-1, 2):
-                if dx != 0 or dy != 0:
-                    pyxel.text(x + dx, y + dy, s, bcol, FONT_JP)
-        pyxel.text(x, y, s, col, FONT_JP)
 
-    def MusicRead(self, bgm_path: str) -> any:
-        if os.path.exists(bgm_path):
-            with open(bgm_path, "rt", encoding="utf-8") as fin:
-                return json.loads(fin.read())
-        else:
-            return None
+class AssetWatcher:
+    '''
+    開発用、アセットの更新監視クラス
 
-    def BGMChange(self, music):
+    ファイルの更新日時とサイズを覚えておき、変わったファイルだけ
+    内容のハッシュを計算し直す。保存し直しただけで内容が同じ場合は
+    更新として扱わない。
+    '''
+    def __init__(self, root: str):
+        self.root = root
+        self.stats = {}     # パス -> (更新日時, サイズ)
+        self.hashes = {}    # パス -> 内容のハッシュ
+        self.is_ready = False
+        self.Poll()
+        self.is_ready = True
+
+    def Poll(self) -> list:
         '''
-        BGM変更
+        前回から内容が変わったファイル(新しく追加されたものを含む)
         '''
-        # 全チャンネルBGM　OFF
-        pyxel.stop()
-        if music is None:
-            return
-
-        # if pyxel.play_pos(0) is None:
-        # BGM再生
-        for ch, sound in enumerate(music):
-            pyxel.sound(ch).set(*sound)
-            pyxel.play(ch, ch, loop=True)
+        changed = []
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return changed
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            path = f'{self.root}/{entry.name}'
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            stat = (st.st_mtime_ns, st.st_size)
+            if self.stats.get(path) == stat:
+                continue
+            self.stats[path] = stat
+            digest = self.Hash(path)
+            if digest is None or self.hashes.get(path) == digest:
+                continue
+            if self.is_ready:
+                changed.append(path)
+            self.hashes[path] = digest
+        return changed
+
+    def Hash(self, path: str) -> bytes:
+        '''
+        ファイル内容のハッシュ
+        '''
+        try:
+            with open(path, 'rb') as fin:
+                return hashlib.blake2b(fin.read(), digest_size=16).digest()
+        except OSError:
+            return None
 
 
 class Card(ObjectBase):
@@ -238,7 +2308,7 @@ class Card(ObjectBase):
             super().__init__(dx, y, CARD_W * 2, CARD_H * 2)
         else:
             # 表示位置をずらして配置
-            self.x_pos = x + (CARD_W + 5) * pos + 5
+            self.x_pos = x + RULES.HandPitch() * pos + 5
             super().__init__(x - CARD_W, y + 5, CARD_W, CARD_H)
 
         self.type = type            # グー/チョキ/パー
@@ -246,6 +2316,7 @@ class Card(ObjectBase):
         self.state = CardState.MOVING
         self.is_selected = False    # 手札から選択中
         self.x_offset = CARD_OPEN_OFFSET * -1
+        self.flip_level = 0         # めくり中の潰れ具合
 
     def update(self):
         '''
@@ -253,6 +2324,8 @@ class Card(ObjectBase):
         '''
         if CardState.MOVING == self.state:
             # 所定の位置へ移動
+            if OPTION.fast:
+                self.x = self.x_pos
             dx = abs(self.x_pos - self.x) / 10.0
             if self.is_show is False and self.is_big:
                 self.x -= dx    # COM
@@ -275,6 +2348,8 @@ class Card(ObjectBase):
 
         elif CardState.ROTATION == self.state:
             # COMのカード捲り動作中
+            if OPTION.fast:
+                self.x_offset = CARD_OPEN_OFFSET
             if self.x_offset < CARD_OPEN_OFFSET:
                 self.x_offset += CARD_OP_ADD
             else:
@@ -284,6 +2359,7 @@ class Card(ObjectBase):
 
             if 0 < self.x_offset:
                 self.is_show = True
+            self.UpdateFlip()
 
     def draw(self):
         '''
@@ -292,45 +2368,51 @@ class Card(ObjectBase):
         if self.is_selected:
             return
 
-        # 非表示の色
-        color = pyxel.COLOR_PURPLE
+        # 表裏の判定
+        face = CARD_BACK
         if self.is_show:
-            # 表示の場合、各々の色を設定
-            color = self.type
-
-        # COM用めくりのオフセット計算
-        offset = 0
-        if CardState.ROTATION == self.state:
-            offset = (-1 * (self.x_offset * self.x_offset)) + CARD_W
-        # カード本体
-        pyxel.rect(self.x + offset, self.y, self.w - (offset * 2),
-                   self.h, pyxel.COLOR_GRAY)
-        pyxel.rect(self.x + 1 + offset, self.y + 1,
-                   self.w - 2 - (offset * 2), self.h - 2, color)
-        # カードの柄
-        txt = '?'
-        if self.is_show:
-            if self.type == GU:
-                txt = 'G'
-            elif self.type == CH:
-                txt = 'C'
-            else:
-                txt = 'P'
-        self.DrawText(self.x + self.w / 2 - 3,
-                      self.y + self.h / 2 - 4,
-                      txt, pyxel.COLOR_WHITE)
+            face = self.type
+
+        # スプライトシートから1回で描画
+        if self.is_big:
+            level = 0
+            if CardState.ROTATION == self.state:
+                level = self.flip_level
+            frame = CARD_SHEET.big[face, level]
+        else:
+            highlight = self.is_mouse_over and self.is_show
+            frame = CARD_SHEET.small[face, highlight]
+        CARD_SHEET.Draw(self.x, self.y, frame)
+
+    def UpdateFlip(self):
+        '''
+        COM用めくりの潰れ具合を更新
+        '''
+        offset = (-1 * (self.x_offset * self.x_offset)) + CARD_W
+        self.flip_level = min(CARD_FLIP_LEVELS - 1,
+                              max(0, int(offset + 0.5)))
+
+    def Dump(self) -> list:
+        '''
+        スナップショット用の状態
+        '''
+        return [self.type, self.x, self.y, self.x_pos, self.state.value,
+                self.is_selected, self.is_show, self.x_offset,
+                self.flip_level]
 
-        # ハイライト表示
-        if self.is_mouse_over and self.is_show:
-            pyxel.rectb(self.x - 1, self.y - 1,
-                        self.w + 2, self.h + 2,
-                        pyxel.COLOR_WHITE)
+    def Restore(self, data: list):
+        '''
+        スナップショットから状態を戻す
+        '''
+        (self.type, self.x, self.y, self.x_pos, state, self.is_selected,
+         self.is_show, self.x_offset, self.flip_level) = data
+        self.state = CardState(state)
 
     def ResetPos(self, x, pos):
         '''
         カード位置変更
         '''
-        self.x = x + (CARD_W + 5) * pos + 5
+        self.x = x + RULES.HandPitch() * pos + 5
 
     def SetLock(self, islock: bool):
         '''
@@ -350,18 +2432,16 @@ class Deck(ObjectBase):
         h = CARD_H + 10
         super().__init__(x, y, HAND_W, h)
 
-        g = [GU] * CARD_NUM
-        c = [CH] * CARD_NUM
-        p = [PA] * CARD_NUM
-        # シャッフルして山札へセット
-        self.cards = self.Shuffle(g, c, p)
+        # 山札をセット
+        self.cards = self.Shuffle(RULES.card_num, RULES.card_num,
+                                  RULES.card_num)
 
         # 山札から手札をドローする
         self.hands = []
         cnt = 0
-        for _ in range(HAND_MAX):
+        for _ in range(RULES.hand_max):
             if 0 < len(self.cards):
-                card = self.cards.pop()
+                card = self.cards.Draw()
                 self.hands.append(Card(self.x, self.y, cnt,
                                        card, side == CTRL_PLAYER))
                 cnt += 1
@@ -374,7 +2454,8 @@ class Deck(ObjectBase):
         '''
         データ更新
         '''
-        if side == CTRL_COM:
+        if (side == CTRL_COM and OPTION.com == COM_RANDOM) \
+                or (side == CTRL_PLAYER and OPTION.autoplay):
             self.RandomPick()
 
         select_cnt = 0
@@ -396,6 +2477,11 @@ class Deck(ObjectBase):
                     self.selected_idx = idx
                 select_cnt += 1
 
+        if 1 < select_cnt:
+            # 手札が重なっている場合は上にあるカードだけ選択する
+            for i, hnd in enumerate(self.hands):
+                hnd.is_selected = i == self.selected_idx
+
         if select_cnt <= 0:
             # 何も選んでないときは表示しない
             self.selected_card = None
@@ -423,19 +2509,12 @@ class Deck(ObjectBase):
         return Card(x, pyxel.height / 2 - CARD_H * 2, 0,
                     type, self.side == CTRL_PLAYER, True)
 
-    def Shuffle(self, g: list[int], c: list[int],
-                p: list[int]) -> list[int]:
+    def Shuffle(self, g: int, c: int, p: int) -> CardPile:
         '''
-        シャッフル
+        シャッフル済みの山札を作成
+        (引くときにランダムに選ぶので並べ替えは不要)
         '''
-        random.seed()
-        ary = g + c + p
-        rand_ary = []
-        for item in ary:
-            rand_ary.append({'key': item,
-                             'value': random.randrange(255)})
-        sort_ary = sorted(rand_ary, key=lambda x: x['value'])
-        return [d.get('key') for d in sort_ary]
+        return CardPile(g, c, p)
 
     def RandomPick(self):
         '''
@@ -446,10 +2525,14 @@ class Deck(ObjectBase):
         if self.IsAllInit() is False:
             return
 
-        hand_cnt = len(self.hands)
-        idx = pyxel.rndi(0, hand_cnt - 1)
-        for i in range(hand_cnt):
-            self.hands[i].is_selected = i == idx
+        self.Pick(RNG.com.randrange(len(self.hands)))
+
+    def Pick(self, idx: int):
+        '''
+        指定した位置の手札を選ぶ
+        '''
+        for i, hnd in enumerate(self.hands):
+            hnd.is_selected = i == idx
 
     def IsAllInit(self) -> bool:
         '''
@@ -469,6 +2552,7 @@ class Deck(ObjectBase):
         if self.side == CTRL_COM and self.selected_card is not None:
             self.selected_card.state = CardState.ROTATION
             self.selected_card.x_offset = CARD_OPEN_OFFSET * -1
+            self.selected_card.UpdateFlip()
 
     def SelectClear(self):
         '''
@@ -496,7 +2580,7 @@ class Deck(ObjectBase):
 
         # 右端に山札からのカードをセットする
         if 0 < len(self.cards):
-            card = self.cards.pop()
+            card = self.cards.Draw()
             self.hands.append(Card(self.x, self.y, len(self.hands),
                                    card, self.side == CTRL_PLAYER))
 
@@ -520,17 +2604,35 @@ class Deck(ObjectBase):
         '''
         デッキ残り枚数カウント
         '''
-        g = 0
-        c = 0
-        p = 0
-        for crd in self.cards:
-            if crd == GU:
-                g += 1
-            if crd == CH:
-                c += 1
-            if crd == PA:
-                p += 1
-        return g, c, p
+        return (self.cards.Count(GU), self.cards.Count(CH),
+                self.cards.Count(PA))
+
+    def Dump(self) -> list:
+        '''
+        スナップショット用の状態
+        (山札の残り枚数, 手札, 選択中の手札の位置, 場に出したカード)
+        '''
+        big = None
+        if self.selected_card is not None:
+            big = self.selected_card.Dump()
+        return [list(self.DeckCount()), [h.Dump() for h in self.hands],
+                self.selected_idx, big]
+
+    def Restore(self, data: list):
+        '''
+        スナップショットから状態を戻す
+        '''
+        pile, hands, self.selected_idx, big = data
+        self.cards = CardPile(*pile)
+        self.hands = []
+        for h in hands:
+            card = Card(self.x, self.y, 0, h[0], self.side == CTRL_PLAYER)
+            card.Restore(h)
+            self.hands.append(card)
+        self.selected_card = None
+        if big is not None:
+            self.selected_card = self.CreateBigCard(0, big[0])
+            self.selected_card.Restore(big)
 
 
 class LifeBox(ObjectBase):
@@ -539,16 +2641,19 @@ class LifeBox(ObjectBase):
     '''
     def __init__(self, x, y):
         super().__init__(x, y, LIFE_W, LIFE_H)
-        self.life = LIFE_MAX
+        self.life = RULES.life_max
         self.offset = 0
         self.next = 0
         self.state = LifeState.WAIT
+        self.is_show = True
 
     def update(self):
         '''
         データ更新
         '''
         if self.state == LifeState.DECRASE:
+            if OPTION.fast:
+                self.offset = self.next
             if self.offset < self.next:
                 self.offset += 0.1
             else:
@@ -570,20 +2675,41 @@ class LifeBox(ObjectBase):
                    pyxel.COLOR_GREEN)
         # ラベル
         self.DrawText(self.x + 3, self.y + 2,
-                      f'Life {self.life}/{LIFE_MAX}',
+                      f'Life {self.life}/{RULES.life_max}',
                       pyxel.COLOR_WHITE)
 
     def Damege(self, dmg: int):
         '''
         ライフゲージをダメージ分減らす
         '''
+        prev = self.next
         if dmg < 0:
-            self.life = min(LIFE_MAX, self.life - dmg)
+            self.life = min(RULES.life_max, self.life - dmg)
         else:
             self.life = max(0, self.life - dmg)
-        self.next = (LIFE_MAX - self.life) * ONE_LIFE_W
+        self.next = (RULES.life_max - self.life) * RULES.OneLifeWidth()
         self.state = LifeState.DECRASE
 
+        # 減った部分から火花を出す
+        if self.is_show and prev < self.next:
+            x = self.x + self.w - 1 - (prev + self.next) / 2
+            PARTICLES.Burst(x, self.y + self.h / 2, PARTICLE_GAUGE,
+                            (pyxel.COLOR_GREEN, pyxel.COLOR_LIME,
+                             pyxel.COLOR_WHITE), 1.5, 30)
+
+    def Dump(self) -> list:
+        '''
+        スナップショット用の状態
+        '''
+        return [self.life, self.offset, self.next, self.state.value]
+
+    def Restore(self, data: list):
+        '''
+        スナップショットから状態を戻す
+        '''
+        self.life, self.offset, self.next, state = data
+        self.state = LifeState(state)
+
 
 class Character(ObjectBase):
     '''
@@ -592,21 +2718,14 @@ class Character(ObjectBase):
     def __init__(self, x: float, y: float, side: int):
         super().__init__(x, y, 60, 128)
         self.side = side
-        self.e_val_a = pyxel.rndi(-60, 60)
+        self.e_val_a = RNG.motion.randint(-60, 60)
         self.y_base = y
         self.x_base = x
         self.state = CharaState.WAIT
 
         self.e_val_b = 0        # 横揺れ変数
         self.cnt = DAMAGE_WAIT  # 横揺れ時間
-        if side == CTRL_COM:
-            self.com_images = []
-            for i in range(6):
-                img_path = f'assets/{i:04}.png'
-                if os.path.exists(img_path):
-                    img = pyxel.Image(144, 256)
-                    img.load(x=0, y=0, filename=img_path)
-                    self.com_images.append(img)
+        self.image_idx = -1     # 表示中の立ち絵番号
 
     def update(self):
         '''
@@ -616,7 +2735,10 @@ class Character(ObjectBase):
         self.e_val_a += 1
         if FPS < self.e_val_a:
             self.e_val_a = FPS * -1
-        self.y = self.Wave(self.y_base, self.e_val_a, 1200)
+        if QUALITY.Motion():
+            self.y = self.Wave(self.y_base, self.e_val_a, 1200)
+        else:
+            self.y = self.y_base
 
         # ダメージ横揺れ
         if self.state == CharaState.DAMAGE:
@@ -632,28 +2754,49 @@ class Character(ObjectBase):
         '''
         描画
         '''
-        idx = LIFE_MAX - lifebox.life
+        idx = self.PortraitIndex(lifebox.life)
 
         if self.side == CTRL_PLAYER:
             # debug Todo: プレイヤーの画像を用意する
-            pyxel.dither(0.5)
-            pyxel.rect(self.x, self.y,
-                       self.w, self.h, pyxel.COLOR_WHITE + idx)
-            pyxel.dither(1.0)
+            self.DrawPlaceholder(idx)
             self.DrawText(self.x + 4, self.y + 4, 'Player', pyxel.COLOR_WHITE)
 
         else:
-            if idx < len(self.com_images):
-                pyxel.blt(self.x - 40, self.y, self.com_images[idx],
-                          0, 0, 144, 256, colkey=16)
+            # 立ち絵が変わったら前後を先読み
+            if self.image_idx != idx:
+                self.image_idx = idx
+                PORTRAITS.Prefetch(idx)
+
+            img = PORTRAITS.Get(idx)
+            if img is not None:
+                pyxel.blt(self.x - 40, self.y, img,
+                          0, 0, PORTRAIT_W, PORTRAIT_H, colkey=16)
             else:
-                # 画像読めなかった時
-                pyxel.dither(0.5)
-                pyxel.rect(self.x, self.y,
-                           self.w, self.h, pyxel.COLOR_WHITE + idx)
-                pyxel.dither(1.0)
+                # 画像読めなかった時・読み込み中
+                self.DrawPlaceholder(idx)
             self.DrawText(self.x + 4, self.y + 4, 'COM', pyxel.COLOR_WHITE)
 
+    def DrawPlaceholder(self, idx: int):
+        '''
+        立ち絵の代わりの仮表示(画質を下げている間は枠だけ)
+        '''
+        col = pyxel.COLOR_WHITE + idx
+        if QUALITY.Dither():
+            pyxel.dither(0.5)
+            pyxel.rect(self.x, self.y, self.w, self.h, col)
+            pyxel.dither(1.0)
+        else:
+            pyxel.rectb(self.x, self.y, self.w, self.h, col)
+
+    def PortraitIndex(self, life: int) -> int:
+        '''
+        ライフから立ち絵の番号を求める(ライフ最大値に合わせて按分)
+        '''
+        damage = RULES.life_max - life
+        if RULES.life_max == LIFE_MAX:
+            return damage
+        return damage * max(0, PORTRAITS.Count() - 1) // RULES.life_max
+
     def Wave(self, offset: float, a: float, b: float) -> float:
         '''
         ゆらゆら揺れる位置情報の計算
@@ -664,8 +2807,27 @@ class Character(ObjectBase):
         '''
         ダメージ演出セット
         '''
-        self.cnt = DAMAGE_WAIT
+        self.cnt = OPTION.Wait(DAMAGE_WAIT)
         self.state = CharaState.DAMAGE
+        PARTICLES.Burst(self.x + self.w / 2, self.y + self.h / 3,
+                        PARTICLE_DAMAGE,
+                        (pyxel.COLOR_RED, pyxel.COLOR_ORANGE,
+                         pyxel.COLOR_YELLOW, pyxel.COLOR_WHITE), 3, 45)
+
+    def Dump(self) -> list:
+        '''
+        スナップショット用の状態
+        '''
+        return [self.x, self.e_val_a, self.e_val_b, self.cnt,
+                self.state.value]
+
+    def Restore(self, data: list):
+        '''
+        スナップショットから状態を戻す
+        '''
+        self.x, self.e_val_a, self.e_val_b, self.cnt, state = data
+        self.state = CharaState(state)
+        self.y = self.Wave(self.y_base, self.e_val_a, 1200)
 
 
 class Player(ObjectBase):
@@ -747,6 +2909,23 @@ class Player(ObjectBase):
         UI非表示
         '''
         self.show_ui = False
+        self.life.is_show = False
+
+    def Dump(self) -> list:
+        '''
+        スナップショット用の状態
+        '''
+        return [self.deck.Dump(), self.life.Dump(), self.chara.Dump()]
+
+    def Restore(self, data: list):
+        '''
+        スナップショットから状態を戻す
+        '''
+        deck, life, chara = data
+        self.deck.Restore(deck)
+        self.life.Restore(life)
+        self.chara.Restore(chara)
+        self.g, self.c, self.p = self.deck.DeckCount()
 
 
 class Button(ObjectBase):
@@ -864,14 +3043,24 @@ class MessageBox(ObjectBase):
         描画
         '''
         self.LineRect(pyxel.COLOR_WHITE, pyxel.COLOR_GRAY)
-        self.DrawText(self.x + 5, self.y + 3, self.disp,
-                      pyxel.COLOR_GRAY)
+        if MsgState.DISPLAYING == self.state:
+            # 1文字ずつ変わる途中の文字列はキャッシュに入れない
+            LABELS.DrawDirect(self.x + 5, self.y + 3, self.disp,
+                              pyxel.COLOR_GRAY, pyxel.COLOR_BLACK)
+        else:
+            self.DrawText(self.x + 5, self.y + 3, self.disp,
+                          pyxel.COLOR_GRAY)
 
     def SetMessage(self, msg: str):
         '''
         メッセージをセットする
         '''
         self.msg.clear()
+        if OPTION.fast:
+            # 早送り中は一度に表示
+            self.disp = msg
+            self.state = MsgState.WAIT
+            return
         for s in msg:
             self.msg.append(s)
         self.state = MsgState.DISPLAYING
@@ -885,6 +3074,20 @@ class MessageBox(ObjectBase):
         self.state = MsgState.WAIT
         self.disp = ''
 
+    def Dump(self) -> list:
+        '''
+        スナップショット用の状態
+        '''
+        return [''.join(self.msg), self.disp, self.state.value]
+
+    def Restore(self, data: list):
+        '''
+        スナップショットから状態を戻す
+        '''
+        msg, self.disp, state = data
+        self.msg = list(msg)
+        self.state = MsgState(state)
+
 
 class GallaryArrow(ObjectBase):
     def __init__(self, direction: int):
@@ -897,7 +3100,7 @@ class GallaryArrow(ObjectBase):
         self.base_x = x
 
     def update(self):
-        if self.enabled:
+        if self.enabled and QUALITY.Motion():
             if pyxel.frame_count % 60 == 0:
                 if self.direction == 0:
                     self.x = self.base_x - 5
@@ -927,52 +3130,472 @@ class GallaryArrow(ObjectBase):
                       col)
 
 
-class App(ObjectBase):
+class ThumbnailStrip(ObjectBase):
+    '''
+    ギャラリー下部のサムネイル一覧クラス
+
+    サムネイルは PortraitCache が縮小済みの画像をイメージバンクから
+    1枚1回の blt で描くだけ。
+    表示中の立ち絵が見える位置へスクロールし、ホイールでも動かせる。
+    '''
     def __init__(self):
+        y = pyxel.height - THUMB_H - 8
+        super().__init__(24, y, pyxel.width - 48, THUMB_H)
+        self.items = []         # 並べる立ち絵の番号
+        self.current = -1       # 表示中の立ち絵の番号
+        self.scroll = 0.0
+        self.target = 0.0
+
+    def Pitch(self) -> int:
+        return THUMB_W + THUMB_GAP
+
+    def Left(self) -> float:
+        '''
+        先頭のサムネイルの位置(全て収まる時は中央寄せ)
+        '''
+        total = len(self.items) * self.Pitch() - THUMB_GAP
+        return self.x + max(0, (self.w - total) // 2) - int(self.scroll)
+
+    def update(self, items: list, current: int):
+        '''
+        データ更新
+        '''
+        self.items = items
+        pitch = self.Pitch()
+        if current != self.current and current in items:
+            # 表示中の立ち絵を真ん中へ
+            self.current = current
+            self.target = items.index(current) * pitch \
+                - (self.w - THUMB_W) / 2
+        wheel = pyxel.mouse_wheel
+        if wheel != 0 and self.IsOverMouse():
+            self.target -= wheel * pitch
+        scroll_max = max(0, len(items) * pitch - THUMB_GAP - self.w)
+        self.target = min(max(0, self.target), scroll_max)
+
+        if QUALITY.Motion() and 0.5 < abs(self.target - self.scroll):
+            self.scroll += (self.target - self.scroll) / 4
+        else:
+            self.scroll = self.target
+
+    def Clicked(self) -> int:
+        '''
+        クリックされたサムネイルの立ち絵の番号(無ければ None)
+        '''
+        if not (pyxel.btnp(pyxel.MOUSE_BUTTON_LEFT) and self.IsOverMouse()):
+            return None
+        pos = pyxel.mouse_x - self.Left()
+        i = int(pos // self.Pitch())
+        if 0 <= i < len(self.items) and pos - i * self.Pitch() < THUMB_W:
+            return self.items[i]
+        return None
+
+    def draw(self):
+        '''
+        描画
+        '''
+        pyxel.rect(self.x - 2, self.y - 2, self.w + 4, self.h + 4,
+                   pyxel.COLOR_BLACK)
+        pyxel.clip(self.x - 1, self.y - 1, self.w + 2, self.h + 2)
+        pitch = self.Pitch()
+        left = self.Left()
+        for i, idx in enumerate(self.items):
+            x = left + i * pitch
+            if x + THUMB_W < self.x or self.x + self.w < x:
+                continue
+            pos = PORTRAITS.ThumbPos(idx)
+            if PORTRAITS.HasThumb(idx) and pos is not None:
+                pyxel.blt(x, self.y, THUMB_BANK, pos[0], pos[1],
+                          THUMB_W, THUMB_H, colkey=16)
+            else:
+                # 読み込み中
+                pyxel.rectb(x, self.y, THUMB_W, THUMB_H, pyxel.COLOR_GRAY)
+            if idx == self.current:
+                pyxel.rectb(x - 1, self.y - 1, THUMB_W + 2, THUMB_H + 2,
+                            pyxel.COLOR_YELLOW)
+        pyxel.clip()
+
+
+class SpectatorGrid(ObjectBase):
+    '''
+    観戦モード、COM vs COM の対戦を縮小表示で並べるクラス
+
+    試合ごとに Player/Deck/LifeBox を作らず、全試合の状態を項目ごとの
+    配列(array)に並べて持ち、update 1回で全試合をまとめて進める。
+    カードの種類は 0: G, 1: C, 2: P の番号で持つ。
+    対戦の進め方は MatchSim と同じ(お互い手札から一様ランダムに出す)。
+    '''
+    EMPTY = -1
+    TYPES = (GU, CH, PA)
+    # 勝負判定表 JUDGE[下側][上側]
+    JUDGE = tuple(tuple(Janken(a, b) for b in (GU, CH, PA))
+                  for a in (GU, CH, PA))
+
+    def __init__(self, num: int):
+        super().__init__(0, 0, pyxel.width, pyxel.height)
+        self.num = num
+        self.rng = random.Random(RNG.Derive('spectate'))
+        h = RULES.hand_max
+        # [試合, 側(0: 下, 1: 上), ...] の順に並べる
+        self.piles = array('h', [0]) * (num * 2 * 3)        # 山札の残り枚数
+        self.hands = array('b', [self.EMPTY]) * (num * 2 * h)
+        self.hand_len = array('b', [0]) * (num * 2)
+        self.lives = array('h', [0]) * (num * 2)
+        self.played = array('b', [self.EMPTY]) * (num * 2)  # 直前に出した種類
+        self.timer = array('h', [0]) * num      # 次に進めるまでのフレーム数
+        self.winner = array('b', [0]) * num     # 1: 下, -1: 上, 0: 決着なし
+        self.is_end = array('b', [0]) * num
+        self.results = {1: 0, -1: 0, 0: 0}      # 勝敗の集計
+        self.update_time = 0.0                  # update の処理時間(秒)
+        self.draw_time = 0.0                    # draw の処理時間(秒)
+        self.status = ''
+        for m in range(num):
+            self.Reset(m)
+            # 一斉に動かないよう開始をずらす
+            self.timer[m] = self.rng.randrange(OPTION.Wait(SPECTATE_STEP)) + 1
+
+    def Reset(self, m: int):
+        '''
+        試合を最初から始める
+        '''
+        n = RULES.card_num
+        h = RULES.hand_max
+        for side in range(2):
+            i = m * 2 + side
+            for t in range(3):
+                self.piles[i * 3 + t] = n
+            self.hand_len[i] = 0
+            for k in range(h):
+                self.hands[i * h + k] = self.EMPTY
+            for _ in range(h):
+                t = self.DrawCard(i)
+                if t != self.EMPTY:
+                    self.hands[i * h + self.hand_len[i]] = t
+                    self.hand_len[i] += 1
+            self.lives[i] = RULES.life_max
+            self.played[i] = self.EMPTY
+        self.winner[m] = 0
+        self.is_end[m] = 0
+        self.timer[m] = OPTION.Wait(SPECTATE_STEP)
+
+    def DrawCard(self, i: int) -> int:
+        '''
+        山札から1枚引く(残り枚数に比例して種類を選ぶ: CardPile.Draw)
+        '''
+        piles = self.piles
+        base = i * 3
+        total = piles[base] + piles[base + 1] + piles[base + 2]
+        if total <= 0:
+            return self.EMPTY
+        r = self.rng.randrange(total)
+        for t in range(3):
+            if r < piles[base + t]:
+                piles[base + t] -= 1
+                return t
+            r -= piles[base + t]
+        return self.EMPTY
+
+    def update(self):
+        '''
+        全試合をまとめて進める
+        '''
+        start = time.perf_counter()
+        timer = self.timer
+        for m in range(self.num):
+            timer[m] -= 1
+            if 0 < timer[m]:
+                continue
+            if self.is_end[m]:
+                self.Reset(m)
+            else:
+                self.Step(m)
+        self.update_time += (time.perf_counter() - start
+                             - self.update_time) * 0.1
+
+        if pyxel.frame_count % SPECTATE_STATUS_INTERVAL == 0:
+            self.status = f'{self.num} matches  ' \
+                f'upd {self.update_time * 1e6:.0f}us  ' \
+                f'drw {self.draw_time * 1e6:.0f}us'
+
+    def Step(self, m: int):
+        '''
+        お互いに手札を1枚出して勝負する(MatchSim.Step)
+        '''
+        h = RULES.hand_max
+        hands = self.hands
+        lo = m * 2
+        up = lo + 1
+        lo_k = self.rng.randrange(self.hand_len[lo])
+        up_k = self.rng.randrange(self.hand_len[up])
+        lo_t = hands[lo * h + lo_k]
+        up_t = hands[up * h + up_k]
+        self.played[lo] = lo_t
+        self.played[up] = up_t
+        result = self.JUDGE[lo_t][up_t]
+        if 0 < result:
+            self.lives[up] -= 1
+        if result < 0:
+            self.lives[lo] -= 1
+
+        # 決着判定(補充前の山札で判定する: App.IsEnd)
+        piles = self.piles
+        if self.lives[lo] <= 0 or self.lives[up] <= 0 \
+                or sum(piles[lo * 3:lo * 3 + 3]) <= 0 \
+                or sum(piles[up * 3:up * 3 + 3]) <= 0:
+            winner = -1 if self.lives[lo] <= 0 else \
+                1 if self.lives[up] <= 0 else 0
+            self.winner[m] = winner
+            self.results[winner] += 1
+            self.is_end[m] = 1
+            self.timer[m] = OPTION.Wait(SPECTATE_END_WAIT)
+            return
+
+        # 出したカードを抜いて左詰めし、右端に補充(Deck.HandDrow)
+        for i, k in ((lo, lo_k), (up, up_k)):
+            base = i * h
+            num = self.hand_len[i]
+            for j in range(k, num - 1):
+                hands[base + j] = hands[base + j + 1]
+            t = self.DrawCard(i)
+            hands[base + num - 1] = t
+            if t == self.EMPTY:
+                self.hand_len[i] = num - 1
+        self.timer[m] = OPTION.Wait(SPECTATE_STEP)
+
+    def draw(self):
+        '''
+        全試合をマス目に並べて描画
+        '''
+        start = time.perf_counter()
+        cols = 1
+        while cols * cols < self.num:
+            cols += 1
+        size = (min(pyxel.width, pyxel.height - 14)) // cols
+        left = (pyxel.width - size * cols) // 2
+        for m in range(self.num):
+            self.DrawMatch(m, left + m % cols * size, m // cols * size, size)
+
+        w, lose, drow = self.results[1], self.results[-1], self.results[0]
+        self.DrawText(4, pyxel.height - 13,
+                      f'{w}-{lose}-{drow}  {self.status}',
+                      pyxel.COLOR_WHITE)
+        self.draw_time += (time.perf_counter() - start
+                           - self.draw_time) * 0.1
+
+    def DrawMatch(self, m: int, x: int, y: int, size: int):
+        '''
+        1試合分の縮小表示(上下に手札とライフ、中央に出したカード)
+        '''
+        h = RULES.hand_max
+        pad = 2
+        inner = size - 1 - pad * 2
+        card_w = max(1, inner // h - 1)
+        card_h = max(2, size // 6)
+        life_h = max(1, size // 24)
+
+        # 枠(決着したら勝った側の色)
+        col = pyxel.COLOR_GRAY
+        if self.is_end[m]:
+            col = (pyxel.COLOR_GRAY, pyxel.COLOR_LIME,
+                   pyxel.COLOR_RED)[self.winner[m]]
+        pyxel.rectb(x, y, size - 1, size - 1, col)
+
+        for side in range(2):
+            i = m * 2 + side
+            # 上側(side 1)は上から、下側(side 0)は下から並べる
+            if side == 1:
+                hand_y = y + pad
+                life_y = hand_y + card_h + 1
+            else:
+                hand_y = y + size - 1 - pad - card_h
+                life_y = hand_y - 1 - life_h
+            base = i * h
+            for k in range(self.hand_len[i]):
+                pyxel.rect(x + pad + k * (card_w + 1), hand_y,
+                           card_w, card_h, self.TYPES[self.hands[base + k]])
+            life_w = inner * self.lives[i] // RULES.life_max
+            pyxel.rect(x + pad, life_y, inner, life_h, pyxel.COLOR_RED)
+            if 0 < life_w:
+                pyxel.rect(x + pad, life_y, life_w, life_h,
+                           pyxel.COLOR_GREEN)
+
+            # 出したカード
+            t = self.played[i]
+            if t != self.EMPTY:
+                mid_y = y + size // 2 - card_h // 2
+                mid_x = x + size // 2 + (1 if side == 1 else -card_w - 2)
+                pyxel.rect(mid_x, mid_y, card_w + 1, card_h,
+                           self.TYPES[t])
+
+
+class App(ObjectBase):
+    def __init__(self, rules: Rules = None, run: bool = True):
         super().__init__(0, 0, 0, 0)
+        # ルール設定(指定が無ければ設定ファイルから読み込む)
+        global RULES
+        if rules is not None:
+            RULES = rules
+        elif os.path.exists(RULES_PATH):
+            RULES = Rules().Load(RULES_PATH)
+
         pyxel.init(WINDOW_WIDTH, WINDOW_HEIGHT,
                    title=TITLE, fps=FPS, display_scale=2)
         deviceChecker = DeviceChecker()
         pyxel.mouse(deviceChecker.is_pc())
-        has_resources = self.ReadResources()
-        self.DefineVariables()
 
-        if has_resources:
-            pyxel.run(self.update, self.draw)
-        else:
-            pyxel.run(self.err_update, self.err_draw)
+        # リソースはタイトル画面に必要なものから順に読み込む
+        self.game_sate = GameState.LOADING
+        self.has_resources = True
+        self.bgm_slots = {}     # ファイル -> スロット(読み直し用)
+        self.opening_bgm = None
+        self.battle_bgm = None
+        self.hp1_bgm = None
+        self.win_bgm = None
+        self.make_bgm = None
+        self.current_bgm = None
+        self.is_debug_view = False
+        self.idle = IdleDetector()
+        self.spectator = None
+        self.auto_spectate = 0 < OPTION.spectate
+        self.loader = self.ReadResources()
+
+        # 演出のタイムラインを記録(終了時に出力)
+        self.tracer = None
+        if OPTION.trace is not None:
+            self.tracer = Tracer(OPTION.trace)
+            atexit.register(self.tracer.Write)
+
+        # 開発モード: アセットの更新を監視
+        self.watcher = None
+        if OPTION.dev:
+            self.watcher = AssetWatcher(ASSET_DIR)
+
+        # run=False の場合はその場で読み込み、
+        # 呼び出し側で update/draw を回す(ツール用)
+        if not run:
+            self.loader.RunAll()
+            self.UpdateLoading()
+            return
+        self.loader.Start()
+        QUALITY.Start()
+        pyxel.run(self.update, self.draw)
 
-    def ReadResources(self) -> bool:
+    def ReadResources(self) -> Loader:
         '''
-        リソースファイルの読み込み
+        リソースファイルの読み込みタスクを作成
         '''
-        try:
-            # 色のパレットデータ読み込み
-            pyxel.images[0].load(0, 0, 'assets/Pallet.png', incl_colors=True)
-
-            # bgm ファイル読み込み
-            bgm_path = 'assets/op.json'
-            self.opening_bgm = self.MusicRead(bgm_path)
-            self.BGMChange(self.opening_bgm)
+        loader = Loader()
+
+        # タイトル画面に必要なもの
+        # 色のパレットデータ読み込み
+        loader.Add('palette', None,
+                   lambda _: pyxel.images[0].load(0, 0, PALETTE_PATH,
+                                                  incl_colors=True))
+        # pyxel.Font は作ったスレッドでしか使えないので、
+        # フォント(BDF)の解析はメインスレッドで行う
+        loader.Add('font', None, lambda _: self.LoadFont())
+        loader.Add('assets/op.json',
+                   lambda: self.MusicRead('assets/op.json'),
+                   lambda music: self.SetOpeningBGM(music))
+        loader.Add('title', None, lambda _: self.DefineVariables())
+
+        # 対戦に必要なもの
+        # bgm ファイル読み込み、曲ごとのスロットへ変換
+        loader.Add('assets/battle.json',
+                   lambda: self.MusicRead('assets/battle.json'),
+                   lambda music: self.SetBGM(
+                       'battle_bgm', 'assets/battle.json', music, 1))
+        loader.Add('assets/hp1.json',
+                   lambda: self.MusicRead('assets/hp1.json'),
+                   lambda music: self.SetBGM(
+                       'hp1_bgm', 'assets/hp1.json', music, 2))
+        loader.Add('assets/win.json',
+                   lambda: self.MusicRead('assets/win.json'),
+                   lambda music: self.SetBGM(
+                       'win_bgm', 'assets/win.json', music, 3))
+        loader.Add('assets/make.json',
+                   lambda: self.MusicRead('assets/make.json'),
+                   lambda music: self.SetBGM(
+                       'make_bgm', 'assets/make.json', music, 4))
+
+        # カードのスプライトシート作成
+        loader.Add('card sheet', None, lambda _: CARD_SHEET.Build())
+
+        # COM立ち絵の先読み開始(1フレームに1枚ずつ PortraitCache.update で読む)
+        loader.Add('portraits', None, lambda _: self.ScanPortraits())
+        return loader
+
+    def LoadFont(self):
+        '''
+        テキスト表示用フォント読み込み
+        (pyxel.Font は別スレッドで作ると使えないのでメインスレッドで解析する。
+        1MB ほどあるので読み込み画面の1フレームが 30ms ほど長くなる)
+        '''
+        global FONT_JP
+        FONT_JP = pyxel.Font(FONT_PATH)
+        # フォント無しで計算した文字幅を捨てる
+        LABELS.Clear()
 
-            bgm_path = 'assets/battle.json'
-            self.battle_bgm = self.MusicRead(bgm_path)
+    def SetOpeningBGM(self, music):
+        '''
+        タイトル画面のBGMを変換して再生
+        '''
+        self.SetBGM('opening_bgm', 'assets/op.json', music, 0)
+        self.BGMChange(self.opening_bgm)
 
-            bgm_path = 'assets/hp1.json'
-            self.hp1_bgm = self.MusicRead(bgm_path)
+    def SetBGM(self, name: str, path: str, music, slot: int):
+        '''
+        読み込んだBGMをスロットへ変換
+        '''
+        self.bgm_slots[path] = slot
+        setattr(self, name, self.BGMLoad(music, slot))
 
-            bgm_path = 'assets/win.json'
-            self.win_bgm = self.MusicRead(bgm_path)
+    def ScanPortraits(self):
+        '''
+        COM立ち絵の一覧を作成して最初の1枚を先読み
+        '''
+        PORTRAITS.Scan()
+        PORTRAITS.Prefetch(0)
 
-            bgm_path = 'assets/make.json'
-            self.make_bgm = self.MusicRead(bgm_path)
+    def UpdateLoading(self):
+        '''
+        リソース読み込みを1つ進める
+        '''
+        self.loader.Step()
+        if self.loader.error is not None:
+            print(f'resources read error: {self.loader.error}')
+            self.has_resources = False
 
-            # フォント読み込みチェック
-            if FONT_JP is None:
-                return False
-        except Exception:
-            return False
-        return True
+    def ReloadAsset(self, path: str):
+        '''
+        開発用、更新されたアセットだけを読み直す(ゲームの状態はそのまま)
+        '''
+        try:
+            if path == PALETTE_PATH:
+                # 立ち絵はパレット番号へ変換しているので全て読み直す
+                pyxel.images[0].load(0, 0, PALETTE_PATH, incl_colors=True)
+                PORTRAITS.InvalidateAll()
+            elif path in PORTRAITS.paths:
+                PORTRAITS.Invalidate(PORTRAITS.paths.index(path))
+            elif path == f'{ASSET_DIR}/{len(PORTRAITS.paths):04}.png':
+                # 次の番号の立ち絵が追加された
+                PORTRAITS.Scan()
+            elif path in self.bgm_slots:
+                slot = self.bgm_slots[path]
+                music = self.BGMLoad(self.MusicRead(path), slot)
+                # 再生中の曲なら頭から再生し直す
+                if music is not None and self.current_bgm == slot:
+                    self.BGMChange(slot)
+            else:
+                return
+        except Exception as e:
+            # 保存途中のファイルなどは次の更新まで古いものを使う
+            print(f'reload failed: {path}: {e}')
+            return
+        if self.game_sate == GameState.GALLARY:
+            # 捨てたサムネイル・追加された立ち絵のサムネイルを作り直す
+            PORTRAITS.RequestThumbs(self.GallaryItems())
+        print(f'reloaded: {path}')
 
     def DefineVariables(self):
         '''
@@ -984,6 +3607,14 @@ class App(ObjectBase):
         self.game_sate = GameState.TITLE
         self.choose = None
         self.wait = 0
+        self.results = {1: 0, -1: 0, 0: 0}    # 勝敗の集計
+        self.history = []                     # 対戦履歴(プレイヤー, COM, 結果)
+        self.hint = HintTable()
+        self.com_ai = None                    # COMの探索(ランダムの時は無し)
+        if OPTION.com == COM_UCB:
+            self.com_ai = ComSearch()
+        elif OPTION.com != COM_RANDOM:
+            self.com_ai = ComStrategy(OPTION.com, OPTION.com_deadline)
         txt = 'Start'
         txt_w = self.TextWidth(txt) / 2
         self.start_btn = Button(pyxel.width / 2 - txt_w,
@@ -994,21 +3625,60 @@ class App(ObjectBase):
         self.gallary_btn = Button(pyxel.width / 2 - txt_w,
                                   pyxel.height / 2 + 40,
                                   txt, False)
+        txt = 'Continue'
+        txt_w = self.TextWidth(txt) / 2
+        self.continue_btn = Button(pyxel.width / 2 - txt_w,
+                                   pyxel.height / 2 + 65,
+                                   txt, SNAPSHOTS.Exists())
         txt = '←'
         txt_w = self.TextWidth(txt) / 2
         self.return_btn = Button(10, 10, txt)
         self.gal_arw_l = GallaryArrow(0)
         self.gal_arw_r = GallaryArrow(1)
+        self.gal_strip = ThumbnailStrip()
         
         # debug
         self.is_debug_view = False
 
     def update(self):
         '''
-        データ更新
+        データ更新(早送り中は1フレームに複数回)
+        '''
+        start = time.perf_counter()
+        for _ in range(OPTION.turbo):
+            if not self.has_resources:
+                self.err_update()
+                return
+            prev = self.game_sate
+            self.UpdateFrame()
+            if prev != self.game_sate:
+                self.OnStateChange()
+            if self.tracer is not None \
+                    and GameState.LOADING != self.game_sate:
+                self.tracer.Sample(self)
+        self.idle.Sample(self)
+        QUALITY.AddWork(time.perf_counter() - start)
+
+    def UpdateFrame(self):
         '''
+        1フレーム分のデータ更新
+        '''
+        if self.watcher is not None \
+                and pyxel.frame_count % ASSET_WATCH_INTERVAL == 0:
+            for path in self.watcher.Poll():
+                self.ReloadAsset(path)
+        PORTRAITS.update()
+        PARTICLES.update()
+
+        # リソース読み込み(タイトル画面の表示後も残りを読み込む)
+        if not self.loader.IsDone():
+            self.UpdateLoading()
+        if GameState.LOADING == self.game_sate:
+            return
+
         if GameState.TITLE != self.game_sate \
-                and GameState.GALLARY != self.game_sate:
+                and GameState.GALLARY != self.game_sate \
+                and GameState.SPECTATE != self.game_sate:
             self.player.update()
             self.com.update()
             self.msg_box.update()
@@ -1016,6 +3686,7 @@ class App(ObjectBase):
         if GameState.TITLE == self.game_sate:
             self.start_btn.update()
             self.gallary_btn.update()
+            self.continue_btn.update()
 
             # debug
             if pyxel.btnp(pyxel.KEY_D):
@@ -1024,19 +3695,43 @@ class App(ObjectBase):
                 else:
                     self.gallary_btn.Show()
 
+            # 対戦・ギャラリーは全て読み込むまで待つ
+            is_loaded = self.loader.IsDone()
+
             # ゲーム画面へ移行
-            if self.start_btn.IsClick():
-                self.wait = 60
+            if is_loaded and (self.start_btn.IsClick() or OPTION.autoplay):
+                self.wait = OPTION.Wait(60)
                 self.BGMChange(self.battle_bgm)
                 self.msg_box.SetMessage('Hand card drow')
                 self.game_sate = GameState.INIT
 
+            # 中断した対戦を再開
+            if is_loaded and self.continue_btn.IsClick():
+                if self.LoadSnapshot():
+                    if self.player.life.life == 1:
+                        self.BGMChange(self.hp1_bgm)
+                    else:
+                        self.BGMChange(self.battle_bgm)
+                else:
+                    self.continue_btn.Hide()
+
+            # 観戦モードへ移行
+            if is_loaded and (pyxel.btnp(pyxel.KEY_S) or self.auto_spectate):
+                self.auto_spectate = False
+                self.spectator = SpectatorGrid(OPTION.spectate or SPECTATE_NUM)
+                self.BGMChange(self.battle_bgm)
+                self.game_sate = GameState.SPECTATE
+
             # ギャラリーモードへ移行
-            if self.gallary_btn.IsClick():
+            if is_loaded and self.gallary_btn.IsClick():
                 self.com.chara.x = \
                     pyxel.width / 2 - self.com.chara.w / 2
                 self.com.chara.y = 15
                 self.com.UIHide()
+                items = self.GallaryItems()
+                PORTRAITS.RequestThumbs(items)
+                self.gal_strip.update(
+                    items, self.com.chara.PortraitIndex(self.com.life.life))
                 self.game_sate = GameState.GALLARY
 
         elif GameState.INIT == self.game_sate:
@@ -1052,6 +3747,14 @@ class App(ObjectBase):
             # debug
             self.is_debug_view = pyxel.btn(pyxel.KEY_D)
 
+            # ヒント表示切り替え
+            if pyxel.btnp(pyxel.KEY_H):
+                OPTION.hint = not OPTION.hint
+
+            # COMの思考(プレイヤーが選ぶまで毎フレーム少しずつ進める)
+            if self.com_ai is not None:
+                self.ComThink()
+
             # 初期動作、カードを選択するまでの処理
             if self.choose is None:
                 # 選択肢表示するか？
@@ -1069,10 +3772,10 @@ class App(ObjectBase):
                 else:
                     # 選択肢での選択処理
                     self.choose.update()
-                    if self.choose.IsYes():
+                    if self.choose.IsYes() or OPTION.autoplay:
                         self.msg_box.SetMessage('Battle Start!')
                         self.com.deck.CardOpen()
-                        self.wait = 60
+                        self.wait = OPTION.Wait(60)
                         self.choose = None
                         self.player.deck.HandLock()
                         self.game_sate = GameState.OPEN
@@ -1088,6 +3791,10 @@ class App(ObjectBase):
             if self.wait < 0:
                 # じゃんけん勝負を行い結果によりダメージ判定
                 result = self.Battle()
+                ct = self.com.deck.selected_card.type
+                self.history.append((self.player.deck.selected_card.type,
+                                     ct, result))
+                self.hint.Reveal(ct)
                 if 0 < result:
                     self.com.life.Damege(1)
                     self.msg_box.SetMessage('COM Damege!')
@@ -1100,7 +3807,7 @@ class App(ObjectBase):
                         self.BGMChange(self.hp1_bgm)
                 if result == 0:
                     self.msg_box.SetMessage('Drow!')
-                self.wait = 60
+                self.wait = OPTION.Wait(60)
                 if self.IsEnd():
                     self.game_sate = GameState.GAME_SET
                 else:
@@ -1117,7 +3824,7 @@ class App(ObjectBase):
                 self.msg_box.SetMessage('Hand card drow')
                 self.player.deck.HandDrow()
                 self.com.deck.HandDrow()
-                self.wait = 60
+                self.wait = OPTION.Wait(60)
                 self.game_sate = GameState.INIT
 
         elif GameState.GAME_SET == self.game_sate:
@@ -1131,15 +3838,38 @@ class App(ObjectBase):
                 if self.player.life.life <= 0:
                     self.msg_box.SetMessage('COM Win!')
                     self.BGMChange(self.make_bgm)
+                    self.results[-1] += 1
+                    chara = self.player.chara
+                    PARTICLES.Burst(chara.x + chara.w / 2,
+                                    chara.y + chara.h / 3, PARTICLE_LOSE,
+                                    (pyxel.COLOR_GRAY, pyxel.COLOR_DARK_BLUE,
+                                     pyxel.COLOR_PURPLE), 2, 90, 0.05)
                 elif self.com.life.life <= 0:
                     self.msg_box.SetMessage('Player Win!')
                     self.gallary_btn.Show()
                     self.BGMChange(self.win_bgm)
+                    self.results[1] += 1
+                    PARTICLES.Rain(PARTICLE_WIN,
+                                   (pyxel.COLOR_RED, pyxel.COLOR_YELLOW,
+                                    pyxel.COLOR_LIME, pyxel.COLOR_CYAN,
+                                    pyxel.COLOR_PINK, pyxel.COLOR_WHITE),
+                                   240)
                 else:
                     self.msg_box.SetMessage('No contest ...')
                     self.BGMChange(self.make_bgm)
+                    self.results[0] += 1
                 self.game_sate = GameState.END
-                self.wait = 60
+                self.wait = OPTION.Wait(60)
+
+                # 自動対戦の試合数に達したら終了
+                if OPTION.autoplay and 0 < OPTION.matches \
+                        and OPTION.matches <= sum(self.results.values()):
+                    print(f'seed: {RNG.seed} '
+                          f'matches: {sum(self.results.values())} '
+                          f'player win: {self.results[1]} '
+                          f'com win: {self.results[-1]} '
+                          f'no contest: {self.results[0]}')
+                    pyxel.quit()
 
         elif GameState.END == self.game_sate:
             if self.msg_box.state == MsgState.WAIT:
@@ -1152,36 +3882,52 @@ class App(ObjectBase):
         elif GameState.END_WAIT == self.game_sate:
             # リトライ選択肢
             self.choose.update()
-            if self.choose.IsYes():
+            if self.choose.IsYes() or OPTION.autoplay:
                 self.player = Player(CTRL_PLAYER)
                 self.com = Player(CTRL_COM)
                 self.msg_box = MessageBox()
+                self.history = []
+                self.hint.Reset()
                 # 再挑戦
                 self.game_sate = GameState.INIT
                 self.BGMChange(self.battle_bgm)
                 self.choose = None
-                self.wait = 60
+                self.wait = OPTION.Wait(60)
             elif self.choose.IsNo():
                 self.player = Player(CTRL_PLAYER)
                 self.com = Player(CTRL_COM)
                 self.msg_box = MessageBox()
+                self.history = []
+                self.hint.Reset()
                 # タイトル画面へ
                 self.game_sate = GameState.TITLE
                 self.BGMChange(self.opening_bgm)
                 self.choose = None
-                self.wait = 60
+                self.wait = OPTION.Wait(60)
+
+        elif GameState.SPECTATE == self.game_sate:
+            self.spectator.update()
+            # クリックでタイトルへ戻る
+            if pyxel.btnp(pyxel.MOUSE_BUTTON_LEFT) \
+                    or pyxel.btnp(pyxel.KEY_S):
+                self.spectator = None
+                self.BGMChange(self.opening_bgm)
+                self.game_sate = GameState.TITLE
 
         elif GameState.GALLARY == self.game_sate:
             self.com.update()
             self.return_btn.update()
             self.gal_arw_l.update()
             self.gal_arw_r.update()
+            chara = self.com.chara
+            self.gal_strip.update(self.GallaryItems(),
+                                  chara.PortraitIndex(self.com.life.life))
 
             if self.return_btn.IsClick():
                 # タイトル画面へ
                 self.com = Player(CTRL_COM)
                 self.game_sate = GameState.TITLE
-                self.wait = 60
+                self.wait = OPTION.Wait(60)
 
             # キャラの切り替え
             if pyxel.btnp(pyxel.MOUSE_BUTTON_LEFT):
@@ -1190,27 +3936,64 @@ class App(ObjectBase):
                 if pyxel.width - 20 < pyxel.mouse_x:
                     self.com.life.Damege(1)
 
-            self.gal_arw_l.enabled = not (LIFE_MAX <= self.com.life.life)
+            # サムネイルのクリックでその立ち絵へ
+            idx = self.gal_strip.Clicked()
+            if idx is not None:
+                life = self.GallaryLife(idx)
+                if life != self.com.life.life:
+                    self.com.life.Damege(self.com.life.life - life)
+
+            self.gal_arw_l.enabled = \
+                not (RULES.life_max <= self.com.life.life)
             self.gal_arw_r.enabled = not (self.com.life.life <= 0)
 
     def draw(self):
         '''
-        描画
+        描画(処理時間を計測して画質を調整)
+        '''
+        start = time.perf_counter()
+        self.DrawFrame()
+        QUALITY.Sample(start, time.perf_counter())
+
+    def DrawFrame(self):
+        '''
+        1フレーム分の描画
         '''
+        # 間引き描画
+        if pyxel.frame_count % OPTION.draw_every != 0:
+            return
+
+        if not self.has_resources:
+            self.err_draw()
+            return
+
+        # 待機中は見た目が変わる時だけ描き直す(前の画面がそのまま残る)
+        if not self.idle.NeedDraw(self):
+            return
+
         pyxel.cls(pyxel.COLOR_NAVY)
 
-        if GameState.TITLE == self.game_sate:
+        if GameState.LOADING == self.game_sate:
+            self.DrawLoading(pyxel.height / 2)
+        elif GameState.TITLE == self.game_sate:
             top = pyxel.height / 2 - 20
             self.DrawTextCenter(top, TITLE,
                                 pyxel.COLOR_WHITE, pyxel.COLOR_RED)
             self.start_btn.draw()
             self.gallary_btn.draw()
+            self.continue_btn.draw()
+            # 残りの読み込み中は画面下に進み具合を出す
+            if not self.loader.IsDone():
+                self.DrawLoading(pyxel.height - 20)
+        elif GameState.SPECTATE == self.game_sate:
+            self.spectator.draw()
         elif GameState.GALLARY == self.game_sate:
             # ギャラリーモード
             self.com.draw()
             self.return_btn.draw()
             self.gal_arw_l.draw()
             self.gal_arw_r.draw()
+            self.gal_strip.draw()
         else:
             self.com.draw()
             self.player.draw()
@@ -1219,6 +4002,13 @@ class App(ObjectBase):
             if self.choose is not None:
                 self.choose.draw()
 
+            # 手札ごとの勝率ヒント
+            if OPTION.hint and self.hint.IsAvailable():
+                hnd: Card
+                for hnd in self.player.deck.hands:
+                    if not hnd.is_selected:
+                        self.hint.Draw(hnd)
+
             y = self.player.deck.y - 5
             self.DrawText(10, y, f'G x {self.player.g}',
                           pyxel.COLOR_WHITE, pyxel.COLOR_BLACK)
@@ -1227,33 +4017,173 @@ class App(ObjectBase):
             self.DrawText(10, y + 30, f'P x {self.player.p}',
                           pyxel.COLOR_WHITE, pyxel.COLOR_BLACK)
 
+        PARTICLES.draw()
+
         # debug
         if self.is_debug_view:
+            self.DrawText(pyxel.width - 90, pyxel.height - 14,
+                          f'ptcl {PARTICLES.count} '
+                          f'{PARTICLES.cost * 1e6:.2f}us',
+                          pyxel.COLOR_WHITE)
+            error = getattr(self.com_ai, 'error', None)
+            if error is not None:
+                self.DrawText(5, 5, f'com: {error}', pyxel.COLOR_RED)
             if self.com.deck.selected_card is not None:
                 pyxel.rect(pyxel.width - 4, pyxel.height - 4,
                            4, 4, self.com.deck.selected_card.type)
 
+    def GallaryItems(self) -> list:
+        '''
+        ギャラリーで見られる立ち絵の番号(ライフの多い順)
+        '''
+        chara = self.com.chara
+        items = []
+        for life in range(RULES.life_max, -1, -1):
+            idx = chara.PortraitIndex(life)
+            if idx not in items:
+                items.append(idx)
+        return items
+
+    def GallaryLife(self, idx: int) -> int:
+        '''
+        立ち絵の番号を表示するライフ
+        '''
+        for life in range(RULES.life_max, -1, -1):
+            if self.com.chara.PortraitIndex(life) == idx:
+                return life
+        return self.com.life.life
+
+    def DrawLoading(self, y: float):
+        '''
+        読み込みの進み具合を描画
+        (フォント読み込み前は文字を出さずバーだけ)
+        '''
+        w = 100
+        x = pyxel.width / 2 - w / 2
+        if FONT_JP is not None:
+            self.DrawTextCenter(y - 16, 'Loading',
+                                pyxel.COLOR_WHITE, pyxel.COLOR_BLACK)
+        pyxel.rectb(x, y, w, 5, pyxel.COLOR_WHITE)
+        pyxel.rect(x + 1, y + 1, (w - 2) * self.loader.Progress(), 3,
+                   pyxel.COLOR_WHITE)
+
+    def ComThink(self):
+        '''
+        COMの探索を1フレーム分進め、プレイヤーが選んだら手を決める
+        '''
+        deck = self.com.deck
+        if deck.selected_card is not None or not deck.IsAllInit():
+            return
+        if not self.com_ai.IsActive():
+            self.com_ai.Start(ComView(self))
+        self.com_ai.Think()
+        # プレイヤーが選んだらその時点で一番良い手を出す
+        # (回数固定の場合は決まった回数の探索が終わるまで待つ)
+        if self.player.deck.selected_card is not None \
+                and self.com_ai.IsReady():
+            deck.Pick(self.com_ai.Best())
+            self.com_ai.Stop()
+
+    def OnStateChange(self):
+        '''
+        状態遷移時の処理(ターンごとにスナップショットを保存)
+        '''
+        # 対戦の演出は対戦以外の画面へ持ち越さない
+        if self.game_sate in (GameState.TITLE, GameState.GALLARY,
+                              GameState.SPECTATE):
+            PARTICLES.Clear()
+
+        if self.game_sate in (GameState.SELECT, GameState.OPEN,
+                              GameState.RESULT):
+            # ターンの区切りで乱数列を再シード(スナップショットはこの時点)
+            RNG.Reseed()
+            self.SaveSnapshot()
+        elif self.game_sate == GameState.GAME_SET:
+            # 決着したら再開できないようにする
+            SNAPSHOTS.Delete()
+        elif self.game_sate == GameState.TITLE:
+            self.continue_btn.is_show = SNAPSHOTS.Exists()
+
+    def Snapshot(self) -> dict:
+        '''
+        対戦中の状態をまとめる
+        (乱数列は OnStateChange で再シードした直後の状態を保存する)
+        '''
+        return {
+            'v': SNAPSHOT_VERSION,
+            'rules': [RULES.card_num, RULES.hand_max, RULES.life_max],
+            'state': self.game_sate.value,
+            'wait': self.wait,
+            'choose': self.choose is not None,
+            'msg': self.msg_box.Dump(),
+            'player': self.player.Dump(),
+            'com': self.com.Dump(),
+            'history': self.history,
+            'rng': RNG.Checkpoint(),
+        }
+
+    def Restore(self, data: dict):
+        '''
+        まとめた状態から対戦を再開する
+        '''
+        if data['v'] != SNAPSHOT_VERSION:
+            raise ValueError(f'unsupported snapshot version: {data["v"]}')
+        if data['rules'] != [RULES.card_num, RULES.hand_max,
+                             RULES.life_max]:
+            raise ValueError('snapshot rules do not match')
+
+        self.player = Player(CTRL_PLAYER)
+        self.com = Player(CTRL_COM)
+        self.msg_box = MessageBox()
+        self.player.Restore(data['player'])
+        self.com.Restore(data['com'])
+        self.msg_box.Restore(data['msg'])
+        self.history = [tuple(h) for h in data['history']]
+        self.hint.Reset()
+        for _, ct, _ in self.history:
+            self.hint.Reveal(ct)
+        if self.com_ai is not None:
+            self.com_ai.Stop()
+        self.choose = None
+        if data['choose']:
+            self.choose = ChooseBox(self.msg_box.y + 2)
+        self.wait = data['wait']
+        self.game_sate = GameState(data['state'])
+        RNG.Restore(data['rng'])
+
+    def SaveSnapshot(self):
+        '''
+        スナップショットを保存
+        '''
+        if not SNAPSHOTS.enabled:
+            return
+        SNAPSHOTS.Write(json.dumps(self.Snapshot(), separators=(',', ':')))
+
+    def LoadSnapshot(self) -> bool:
+        '''
+        スナップショットを読み込んで再開(壊れていたら削除する)
+        '''
+        text = SNAPSHOTS.Read()
+        if text is None:
+            return False
+        try:
+            self.Restore(json.loads(text))
+        except (ValueError, KeyError, TypeError, IndexError):
+            SNAPSHOTS.Delete()
+            self.player = Player(CTRL_PLAYER)
+            self.com = Player(CTRL_COM)
+            self.msg_box = MessageBox()
+            self.game_sate = GameState.TITLE
+            return False
+        return True
+
     def Battle(self) -> int:
         '''
         じゃんけんの勝負判定
         '''
         pt = self.player.deck.selected_card.type
         ct = self.com.deck.selected_card.type
-
-        # あいこ
-        if pt == ct:
-            return 0
-
-        # プレイヤーの勝ちパターン
-        if pt == GU and ct == CH:
-            return 1
-        if pt == CH and ct == PA:
-            return 1
-        if pt == PA and ct == GU:
-            return 1
-
-        # それ以外は負け
-        return -1
+        return Janken(pt, ct)
 
     def IsEnd(self) -> bool:
         '''
@@ -1289,5 +4219,77 @@ class App(ObjectBase):
                             pyxel.COLOR_WHITE, pyxel.COLOR_RED)
 
 
+def ParseArgs() -> argparse.Namespace:
+    '''
+    コマンドライン引数の解析
+    '''
+    parser = argparse.ArgumentParser(description=TITLE)
+    parser.add_argument('--turbo', type=int, nargs='?', const=10, default=0,
+                        metavar='N',
+                        help='早送り: 1フレームに N 回更新し演出を最小にする')
+    parser.add_argument('--draw-every', type=int, default=1, metavar='N',
+                        help='N フレームごとに描画する')
+    parser.add_argument('--autoplay', action='store_true',
+                        help='COM vs COM で自動対戦する')
+    parser.add_argument('--matches', type=int, default=0, metavar='N',
+                        help='自動対戦を N 試合で終了する')
+    parser.add_argument('--hint', action='store_true',
+                        help='手札に勝ち・あいこ・負けの確率を表示する'
+                        '(COMが random の時だけ)')
+    parser.add_argument('--seed', type=int, metavar='N',
+                        help='乱数のシード(同じシードで同じ展開になる)')
+    parser.add_argument('--dev', action='store_true',
+                        help='開発モード: アセットの更新を自動で読み直す')
+    parser.add_argument('--trace', metavar='PATH',
+                        help='演出のタイムラインを Chrome trace 形式で出力する')
+    parser.add_argument('--com', default=COM_RANDOM, metavar='NAME',
+                        help='COMの思考方法(random, ucb: 原始モンテカルロ,'
+                             ' それ以外は戦略モジュールの .py のパスか'
+                             'モジュール名)')
+    parser.add_argument('--com-deadline', type=float,
+                        default=COM_STRATEGY_DEADLINE, metavar='SEC',
+                        help='戦略モジュールの1手あたりの制限時間(秒)')
+    parser.add_argument('--rules', metavar='PATH',
+                        help='ルール設定ファイル(JSON)')
+    parser.add_argument('--spectate', type=int, nargs='?', const=SPECTATE_NUM,
+                        default=0, metavar='N',
+                        help='COM vs COM の N 試合を並べて観戦する'
+                             '(タイトル画面で S キーでも切り替え)')
+    parser.add_argument('--quality', type=int,
+                        choices=range(QUALITY_MAX + 1), metavar='N',
+                        help='画質を固定する(0-3、省略時は処理速度に合わせて'
+                             '自動で切り替える)')
+    args, _ = parser.parse_known_args()
+    if args.com not in (COM_RANDOM, COM_UCB) \
+            and not StrategyExists(args.com):
+        parser.error(f'--com: {args.com} is not random, ucb, '
+                     'a .py file or an importable module')
+    return args
+
+
 # 開始
-App()
+if __name__ == '__main__':
+    args = ParseArgs()
+    if 0 < args.turbo:
+        OPTION.fast = True
+        OPTION.turbo = args.turbo
+    OPTION.draw_every = max(1, args.draw_every)
+    OPTION.autoplay = args.autoplay
+    OPTION.dev = args.dev
+    OPTION.trace = args.trace
+    OPTION.com = args.com
+    OPTION.com_deadline = args.com_deadline
+    # シード指定・早送り時は同じ展開になるよう探索を回数で区切る
+    OPTION.com_fixed = args.seed is not None or OPTION.fast
+    if args.quality is not None:
+        QUALITY.Fix(args.quality)
+    RNG.Seed(args.seed)
+    # 自動対戦中は途中経過を保存しない
+    SNAPSHOTS.enabled = not args.autoplay
+    OPTION.matches = args.matches
+    OPTION.hint = args.hint
+    OPTION.spectate = max(0, args.spectate)
+    rules = None
+    if args.rules is not None:
+        rules = Rules().Load(args.rules)
+    App(rules)